@@ -14,6 +14,7 @@ if __name__ != "__main__":
 
     TMP_DIR = os.path.join("/tmp", os.path.basename(PROJECT_ROOT))
     LOGS_DIR = os.path.join(PROJECT_ROOT, "logs")
+    SPOOL_DIR = os.path.join(PROJECT_ROOT, "spool")
     STATIC_DIR = os.path.join(PROJECT_ROOT, "static")
     TEMPLATES_DIR = os.path.join(PROJECT_ROOT, "templates")
     CONFIG_DIR = os.path.join(PROJECT_ROOT, "conf")
@@ -25,6 +25,19 @@ def recursive_namedtuple(data, name='NT'):
         return data
 
 
+def recursive_asdict(data):
+    """
+    recursive_namedtuple の逆変換(pickle可能な辞書とリストに戻す)
+    """
+
+    if isinstance(data, tuple) and hasattr(data, "_asdict"):
+        return {k: recursive_asdict(v) for k, v in data._asdict().items()}
+    elif isinstance(data, list):
+        return [recursive_asdict(item) for item in data]
+    else:
+        return data
+
+
 def parse_influx_string_time_to_datetime(string_time):
     LOGGER.debug("date time in string: %s" % string_time)
 
@@ -35,3 +48,15 @@ def parse_influx_string_time_to_datetime(string_time):
         return datetime.datetime.fromisoformat(stripped)
     else:
         return datetime.datetime.fromisoformat(string_time)
+
+
+def utcnow_by_minute():
+    """
+    分の境界に切り捨てた現在時刻(UTC)
+
+    測定は分毎に行われるため、同じ分の間の問い合わせは同じ期間となり、
+    結果のキャッシュを共有できる
+    """
+
+    return datetime.datetime.now(datetime.UTC).replace(
+        tzinfo=None, second=0, microsecond=0)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import collections
+
+from logging import getLogger
+from influxdb.resultset import ResultSet
+
+LOGGER = getLogger(__name__)
+
+CACHES = {}
+CACHES_MUTEX = threading.Lock()
+
+
+def normalize_query(statement, params, **options):
+    """
+    空白の違いやパラメータの順序によらない問い合わせのキー
+    """
+
+    return json.dumps([" ".join(statement.split()), params, options],
+                      sort_keys=True)
+
+
+def encode_result(result):
+    # a list of ResultSet is returned for multiple statements
+    if isinstance(result, list):
+        return [each.raw for each in result]
+    return result.raw
+
+
+def decode_result(raw):
+    if isinstance(raw, list):
+        return [ResultSet(each) for each in raw]
+    return ResultSet(raw)
+
+
+class QueryCache(object):
+
+    """
+    問い合わせの結果を有効期限付きで保持するLRUキャッシュ
+
+    directory を与えた場合は、同じディレクトリを使う他のプロセス
+    (uwsgiのworkerなど)とファイルを介して結果を共有する
+    """
+
+    def __init__(self, ttl, max_entries, directory=None):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        ttl : float
+            結果を保持する秒数
+        max_entries : int
+            保持する結果の数の上限。超えた場合は最も長く使われていないものを
+            捨てる
+        directory : str
+            結果を共有するディレクトリ。None の場合は共有しない
+        """
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory = directory
+        self.mutex = threading.Lock()
+        # key -> (expires_at, raw result)
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def get_or_query(self, key, query):
+        """
+        キャッシュされた結果を返す。ない場合は query() の結果を保持して返す
+        """
+
+        current_time = time.time()
+
+        with self.mutex:
+            entry = self.entries.get(key)
+            if (entry is not None) and (current_time < entry[0]):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return decode_result(entry[1])
+
+        entry = self.load_shared(key, current_time)
+
+        if entry is not None:
+            with self.mutex:
+                self.shared_hits += 1
+            self.store(key, entry)
+            return decode_result(entry[1])
+
+        result = query()
+        entry = (time.time() + self.ttl, encode_result(result))
+
+        with self.mutex:
+            self.misses += 1
+
+        self.store(key, entry)
+        self.save_shared(key, entry)
+
+        LOGGER.debug("query cache hits: %d, shared hits: %d, misses: %d" %
+                     self.stats())
+
+        return result
+
+    def store(self, key, entry):
+
+        with self.mutex:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while self.max_entries < len(self.entries):
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns
+        -------
+        stats : tuple
+            (hits, shared_hits, misses)
+        """
+
+        with self.mutex:
+            return (self.hits, self.shared_hits, self.misses)
+
+    def path(self, key):
+        return os.path.join(self.directory,
+                            hashlib.sha256(key.encode("utf8")).hexdigest())
+
+    def load_shared(self, key, current_time):
+
+        if self.directory is None:
+            return None
+
+        path = self.path(key)
+
+        try:
+            with open(path, "r", encoding="utf8") as handle:
+                shared = json.load(handle)
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            LOGGER.warning("unable to load shared cache %s: %s" %
+                           (path, str(ex)))
+            return None
+
+        # the same digest for the other key is unlikely but checked
+        if (shared.get("key") != key) or \
+                (shared.get("expires_at", 0) <= current_time):
+            return None
+
+        try:
+            # the access time for the eviction
+            os.utime(path)
+        except OSError:
+            pass
+
+        return (shared["expires_at"], shared["result"])
+
+    def save_shared(self, key, entry):
+
+        if self.directory is None:
+            return
+
+        try:
+            with tempfile.NamedTemporaryFile("w", encoding="utf8",
+                                             dir=self.directory,
+                                             suffix=".tmp",
+                                             delete=False) as handle:
+                json.dump(dict(key=key, expires_at=entry[0],
+                               result=entry[1]), handle)
+            os.replace(handle.name, self.path(key))
+            self.evict_shared()
+        except Exception as ex:
+            LOGGER.warning("unable to save shared cache: %s" % (str(ex)))
+
+    def evict_shared(self):
+
+        current_time = time.time()
+        files = []
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".tmp"):
+                    continue
+                mtime = entry.stat().st_mtime
+                # the expired ones are removed regardless of the number
+                if self.ttl < current_time - mtime:
+                    self.remove_shared(entry.path)
+                else:
+                    files.append((mtime, entry.path))
+
+        files.sort()
+        for (_, path) in files[:max(0, len(files) - self.max_entries)]:
+            self.remove_shared(path)
+
+    def remove_shared(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_query_cache(ttl, max_entries, directory=None):
+    """
+    同じ設定のキャッシュをプロセス内の全てのDAOで共有する
+    """
+
+    key = (ttl, max_entries, directory)
+
+    with CACHES_MUTEX:
+        if key not in CACHES:
+            CACHES[key] = QueryCache(ttl, max_entries, directory)
+        return CACHES[key]
@@ -1,18 +1,32 @@
 #!/usr/bin/env python
 
+import os
+import re
 import json
+import math
 import time
+import threading
 import datetime
+import contextlib
+import collections
+import concurrent.futures
 
 from logging import getLogger
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
 from sqlalchemy import Column, Integer, String, Enum
 from sqlalchemy.ext.declarative import declarative_base
 
+import common.common.config as config
+import common.common.util as util
 import common.data.types as types
+import common.data.topology as topology
+import common.data.cache as cache
 
 LOGGER = getLogger(__name__)
 Base = declarative_base()
 
+BIND_PARAMETER = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)")
+
 
 class MeasurementTarget(Base):
 
@@ -39,6 +53,16 @@ class MeasurementTarget(Base):
 
 class InfluxDBMeasurementBase:
 
+    # seconds the tag topology is cached. shared by all the instances
+    TOPOLOGY_TTL = 60
+    topology_cache = {}
+    topology_mutex = threading.Lock()
+    # shared by all the instances. created on the first use in each process
+    # so that the forked processes(uwsgi workers) do not inherit the threads
+    executor = None
+    executor_pid = None
+    executor_mutex = threading.Lock()
+
     def __init__(self, app):
         # app is subclass of `SetupwithInfluxdb`
         self.app = app
@@ -46,51 +70,276 @@ class InfluxDBMeasurementBase:
         self.retention_policy = "rp_%s" % self.measurement_name
         self.measurement = '"%s"."%s"' % (self.retention_policy,
                                           self.measurement_name)
+        self.query_cache = None
+
+        # the results are cached only by the applications configured so
+        cache_config = getattr(getattr(app, "cnfs", None), "query_cache",
+                               None)
+        if (cache_config is not None) and cache_config.enabled:
+            self.query_cache = cache.get_query_cache(
+                cache_config.ttl_seconds,
+                cache_config.max_entries,
+                os.path.join(config.TMP_DIR, "query_cache")
+                if cache_config.shared else None)
+
+    def query(self, statement, params=None, **options):
+        """
+        問い合わせる。query_cache が有効な場合は結果をキャッシュする
 
-    def get_af_dst_name_combination(self):
+        Parameters
+        ----------
+        params : dict
+            バインドパラメータ
+        """
 
-        result = {}
+        if params is not None:
+            options["params"] = dict(params=json.dumps(params))
+
+        if self.query_cache is None:
+            return self.app.session.query(statement, **options)
+
+        key = cache.normalize_query(statement, params,
+                                    database=self.app.cnfg.data_store.database,
+                                    **{key: value
+                                       for (key, value) in options.items()
+                                       if key != "params"})
+
+        return self.query_cache.get_or_query(
+            key, lambda: self.app.session.query(statement, **options))
+
+    def query_rows(self, statement, params=None, epoch=None):
+        """
+        応答をチャンク(query_chunk_size 行ずつ)で受け取りながら行を一つずつ
+        返す。長い期間の生の測定結果を全体をメモリに載せずに読むためのもので、
+        query_cache は使わない
+
+        Parameters
+        ----------
+        statement : str
+            一つの問い合わせ
+        params : dict
+            バインドパラメータ
+
+        Yields
+        ------
+        tags : dict
+            シリーズのタグ(group by しない場合は空)
+        point : dict
+            列名 -> 値
+        """
+
+        client = self.app.session
+        request_params = dict(q=statement,
+                              db=self.app.cnfg.data_store.database,
+                              chunked="true",
+                              chunk_size=self.app.cnfg.data_store.
+                              query_chunk_size)
+        if params is not None:
+            request_params["params"] = json.dumps(params)
+        if epoch is not None:
+            request_params["epoch"] = epoch
+
+        # InfluxDBClient.query(chunked=True) reads all the chunks before
+        # returning. the session of the client is used to read them one by one
+        response = client._session.get("%s/query" % (client._baseurl),
+                                       auth=(client._username,
+                                             client._password),
+                                       params=request_params,
+                                       headers=client._headers,
+                                       proxies=client._proxies,
+                                       verify=client._verify_ssl,
+                                       timeout=client._timeout,
+                                       stream=True)
+
+        with contextlib.closing(response):
+
+            if 500 <= response.status_code < 600:
+                raise InfluxDBServerError(response.content)
+            elif response.status_code != 200:
+                raise InfluxDBClientError(response.content,
+                                          response.status_code)
+
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    raise InfluxDBClientError(data["error"])
+                for result in data.get("results", []):
+                    if "error" in result:
+                        raise InfluxDBClientError(result["error"])
+                    for series in result.get("series", []):
+                        tags = series.get("tags") or {}
+                        columns = series["columns"]
+                        for values in series.get("values", []):
+                            yield (tags, dict(zip(columns, values)))
+
+    def get_executor(self):
+
+        concurrency = self.app.cnfg.data_store.query_concurrency
+
+        with InfluxDBMeasurementBase.executor_mutex:
+            if InfluxDBMeasurementBase.executor_pid != os.getpid():
+                InfluxDBMeasurementBase.executor = \
+                    concurrent.futures.ThreadPoolExecutor(
+                        max_workers=concurrency,
+                        thread_name_prefix="influxdb-query")
+                InfluxDBMeasurementBase.executor_pid = os.getpid()
+            return InfluxDBMeasurementBase.executor
+
+    def query_concurrently(self, queries):
+        """
+        互いに独立した問い合わせを並行して行う
+
+        同時に行う問い合わせの数は general.ini の query_concurrency まで
+
+        Parameters
+        ----------
+        queries : list
+            (statement, params) のリスト
+
+        Returns
+        -------
+        results : list
+            queries と同じ順の結果
+        """
+
+        if (len(queries) <= 1) or \
+                (self.app.cnfg.data_store.query_concurrency <= 1):
+            return [self.query(statement, params)
+                    for (statement, params) in queries]
 
         proc_start = time.time()
 
-        ret_dst_names = self.app.session.query(
-            "show tag values from %s with key = dst_name" % self.measurement)
+        executor = self.get_executor()
+        futures = [executor.submit(self.query, statement, params)
+                   for (statement, params) in queries]
+        results = [future.result() for future in futures]
 
-        for dst_names in ret_dst_names:
-            for dst_name in dst_names:
-                dst_name_value = dst_name["value"]
+        LOGGER.debug("time took: %s (%d queries)" % (
+            time.time() - proc_start, len(queries)))
 
-                ret_af = self.app.session.query(
-                    "show tag values from %s with key = af where \
-                     dst_name = $dst_name" % self.measurement,
-                    params=dict(params=json.dumps(
-                        dict(dst_name=dst_name_value))))
+        return results
 
-                af_list = []
+    def query_batched(self, queries):
+        """
+        問い合わせを query_batch_size ずつ ; で連結し、一度のHTTPリクエストで
+        行う(連結したもの同士は query_concurrently で並行して行う)
+
+        Parameters
+        ----------
+        queries : list
+            (statement, params) のリスト
+
+        Returns
+        -------
+        results : list
+            queries と同じ順の結果
+        """
 
-                for afs in ret_af:
-                    for af in afs:
-                        af_list.append(af["value"])
+        batch_size = max(1, self.app.cnfg.data_store.query_batch_size)
+        batches = [queries[n:n + batch_size]
+                   for n in range(0, len(queries), batch_size)]
 
-                result[dst_name_value] = af_list
+        results = []
 
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+        for (batch, ret) in zip(batches, self.query_concurrently(
+                [make_batch_query(batch) for batch in batches])):
+            # the client returns a ResultSet for a statement
+            ret = ret if isinstance(ret, list) else [ret]
+            if len(ret) != len(batch):
+                raise ValueError("%d results returned for %d statements" %
+                                 (len(ret), len(batch)))
+            results.extend(ret)
+
+        return results
+
+    def get_topology(self):
+        """
+        読み出し対象の測定のシリーズから作ったタグの索引を返す
+
+        Returns
+        -------
+        topology : topology.TagTopology
+        """
+
+        sources = self.read_sources()
+        key = (self.app.cnfg.data_store.database, sources)
+        current_time = time.monotonic()
+
+        with InfluxDBMeasurementBase.topology_mutex:
+            cached = InfluxDBMeasurementBase.topology_cache.get(key)
+
+        if (cached is not None) and \
+                (current_time - cached[0] <
+                 InfluxDBMeasurementBase.TOPOLOGY_TTL):
+            return cached[1]
+
+        proc_start = time.time()
+
+        ret = self.app.session.query("show series from %s" % sources)
+
+        index = topology.TagTopology.from_series_keys(
+            record["key"] for records in ret for record in records)
+
+        LOGGER.debug("time took: %s (%d series)" % (
+            time.time() - proc_start, index.series))
+
+        with InfluxDBMeasurementBase.topology_mutex:
+            InfluxDBMeasurementBase.topology_cache[key] = (current_time,
+                                                           index)
+
+        return index
+
+    def get_af_dst_name_combination(self):
+
+        index = self.get_topology()
+
+        result = {}
+        for (dst_name, af) in sorted(index.combinations(("dst_name", "af"))):
+            if (dst_name is not None) and (af is not None):
+                result.setdefault(dst_name, []).append(af)
 
         return result
 
+    def read_sources(self):
+        """
+        読み出し対象の測定(FROM句)
+        """
+        return self.measurement
+
+    def convert_to_lines(self, measured_data):
+        return types.make_lines(self.measurement_name, measured_data)
+
+    def write_lines(self, lines):
+        ret = False
+
+        try:
+            LOGGER.info("writing %d lines to influxdb" % (len(lines)))
+            ret = self.app.session.write_points(
+                lines,
+                retention_policy=self.retention_policy,
+                protocol="line")
+            if not ret:
+                LOGGER.warning("writing lines to the influxdb failed")
+        except Exception as ex:
+            LOGGER.warning("%s occurred while writing" % str(ex))
+
+        return ret
+
     def write_measurement_data(self, measured_data):
         ret = False
 
         try:
-            points = [each.convert_influx_notation(self.measurement_name)
-                      for each in measured_data]
+            lines = self.convert_to_lines(measured_data)
             LOGGER.info("writing data to influxdb")
             ret = self.app.session.write_points(
-                points,
-                retention_policy=self.retention_policy)
+                lines,
+                retention_policy=self.retention_policy,
+                protocol="line")
             if not ret:
                 LOGGER.warning("writing data to the influxdb failed")
-                LOGGER.debug("while writing following %s" % str(points))
+                LOGGER.debug("while writing following %s" % str(lines))
         except Exception as ex:
             LOGGER.warning("%s occurred while writing" % str(ex))
         finally:
@@ -99,28 +348,280 @@ class InfluxDBMeasurementBase:
         return ret
 
 
+def make_batch_query(queries):
+    """
+    複数の問い合わせを ; で連結した一つの問い合わせにする
+
+    バインドパラメータは問い合わせ毎に別の名前(q<番号>_<名前>)に付け替える
+
+    Parameters
+    ----------
+    queries : list
+        (statement, params) のリスト
+
+    Returns
+    -------
+    statement : str
+    params : dict
+    """
+
+    statements = []
+    batch_params = {}
+
+    for (n, (statement, params)) in enumerate(queries):
+        prefix = "q%d_" % (n)
+        statements.append(BIND_PARAMETER.sub(
+            lambda match: "$" + prefix + match.group(1), statement))
+        for (key, value) in (params or {}).items():
+            batch_params[prefix + key] = value
+
+    return "; ".join(statements), batch_params
+
+
+def percentile_of_sorted(values, percentile):
+    """
+    InfluxDBの percentile() と同じく最近傍順位法で百分位数を求める
+
+    Parameters
+    ----------
+    values : list
+        昇順に並べた値
+    percentile : int
+        0 から 100
+
+    Returns
+    -------
+    value : float
+        該当する順位がない場合は None
+    """
+
+    index = int(math.floor(len(values) * percentile / 100.0 + 0.5)) - 1
+
+    if index < 0 or len(values) <= index:
+        return None
+
+    return values[index]
+
+
+def parse_time(string_time):
+    return datetime.datetime.fromisoformat(string_time)
+
+
 # PythonからInfluxdbを使うORMがなさそうなので、以下寄せ集め...
 class Mes_dnsprobe(InfluxDBMeasurementBase):
 
+    """
+    測定結果
+
+    スキーマv1(mes_dnsprobe)とv2(mes_dnsprobe_v2)のいずれで書き込むかは
+    general.ini の schema_version で決まる。
+    読み出しはv2の最古の時刻を境に、それ以降をv2、それより前をv1から行う
+    """
+
+    SCHEMA_MEASUREMENT_NAMES = {1: "mes_dnsprobe",
+                                2: "mes_dnsprobe_v2"}
+    PROBE_MEASUREMENT_NAME = "mes_dnsprobe_probe"
+    # seconds the boundary between the schemas is cached
+    SCHEMA_BOUNDARY_TTL = 300
+    # seconds the probe registry is shared by the getters of each probe
+    PROBE_REGISTRY_TTL = 10
+
     def __init__(self, *positional, **kw):
         super().__init__(*positional, **kw)
+        self.schema_version = int(self.app.cnfg.data_store.schema_version)
+        self.measurements = {
+            version: '"%s"."%s"' % (self.retention_policy, name)
+            for (version, name)
+            in Mes_dnsprobe.SCHEMA_MEASUREMENT_NAMES.items()}
+        self.probe_measurement = '"%s"."%s"' % (
+            self.retention_policy, Mes_dnsprobe.PROBE_MEASUREMENT_NAME)
+        # points are written in the configured schema
+        self.measurement_name = \
+            Mes_dnsprobe.SCHEMA_MEASUREMENT_NAMES[self.schema_version]
+        self.measurement = self.measurements[self.schema_version]
+        self.schema_boundary = None
+        self.schema_boundary_checked_at = None
+        self.probe_registry = None
+        self.probe_registry_checked_at = None
+
+    def convert_to_lines(self, measured_data):
+        # in schema v2 the location of the probe is written once per round
+        # by the measurer instead of the tags
+        return types.make_lines(self.measurement_name, measured_data,
+                                self.schema_version)
+
+    def get_first_time(self, measurement, start_time=None):
+        """
+        measurement の最古の時刻(start_time を与えた場合はそれ以降で最古)
+        """
 
-    def __show_tag_list(self, tag):
-        # tag parameter MUST BE TRUSTED value
-        # unable to use `bind-parameter` for `with key` statement
         proc_start = time.time()
 
-        ret = self.app.session.query("show tag values from %s \
-                                      with key = %s" %
-                                     (self.measurement, tag))
+        if start_time is None:
+            ret = self.app.session.query(
+                "select first(time_took) from %s" % measurement)
+        else:
+            ret = self.app.session.query(
+                "select first(time_took) from %s \
+                 where $start_time <= time" % measurement,
+                params=dict(params=json.dumps(dict(start_time=start_time))))
 
         LOGGER.debug("time took: %s" % (time.time() - proc_start))
 
-        result = []
-        for each in ret:
-            for record in each:
-                result.append(record["value"])
-        return result
+        for records in ret:
+            for data in records:
+                return data["time"]
+
+        return None
+
+    def get_schema_boundary(self):
+        """
+        スキーマv2の最古の時刻を返す。v2に書き込まれていない場合は None
+
+        移行ツールは新しい方から遡ってコピーするため、この時刻以降のv2は欠けていない
+        """
+
+        current_time = time.monotonic()
+
+        if (self.schema_boundary_checked_at is None) or \
+                (Mes_dnsprobe.SCHEMA_BOUNDARY_TTL <=
+                 current_time - self.schema_boundary_checked_at):
+            self.schema_boundary = self.get_first_time(self.measurements[2])
+            self.schema_boundary_checked_at = current_time
+            LOGGER.debug("schema boundary: %s" % (self.schema_boundary))
+            self.check_schema_boundary()
+
+        return self.schema_boundary
+
+    def check_schema_boundary(self):
+        """
+        境界以降にスキーマv1へ書き込んだプローブがないかを確かめる
+
+        境界は全てのプローブで共通のため、v2への切り替えが遅れたプローブの
+        境界以降のv1の測定結果は読み出されない(移行もされない)
+        """
+
+        if self.schema_boundary is None:
+            return
+
+        late = self.get_first_time(self.measurements[1],
+                                   self.schema_boundary)
+
+        if late is not None:
+            LOGGER.warning("schema v1 points found at %s after the schema "
+                           "boundary %s. they are not read. switch all the "
+                           "probes to schema v2 together" % (
+                               late, self.schema_boundary))
+
+    def split_by_schema(self, start_time, end_time=None):
+        """
+        期間を読み出すスキーマ毎に分割する
+
+        Returns
+        -------
+        portions : list
+            (測定, スキーマのバージョン, 時刻の条件式, バインドパラメータ)
+            のリスト。時刻の昇順
+        """
+
+        boundary = self.get_schema_boundary()
+        end_condition = "" if end_time is None else " and time < $end_time"
+        end_params = {} if end_time is None else dict(end_time=end_time)
+
+        if (boundary is not None) and \
+                (parse_time(boundary) <= parse_time(start_time)):
+            return [(self.measurements[2], 2,
+                     "$start_time < time" + end_condition,
+                     dict(start_time=start_time, **end_params))]
+
+        if (boundary is None) or ((end_time is not None) and
+                                  (parse_time(end_time) <=
+                                   parse_time(boundary))):
+            return [(self.measurements[1], 1,
+                     "$start_time < time" + end_condition,
+                     dict(start_time=start_time, **end_params))]
+
+        return [(self.measurements[1], 1,
+                 "$start_time < time and time < $schema_boundary",
+                 dict(start_time=start_time, schema_boundary=boundary)),
+                (self.measurements[2], 2,
+                 "$schema_boundary <= time" + end_condition,
+                 dict(schema_boundary=boundary, **end_params))]
+
+    def read_schema_v1_points(self, start_time, end_time):
+        """
+        スキーマv2へ移行するためにスキーマv1の測定結果を読み出す
+
+        Returns
+        -------
+        points : list
+            types.MigratedDNSMeasurementData のリスト。時刻の降順
+        probes : list
+            types.DNSProbe のリスト。プローブ毎に期間内で最新の位置
+        """
+
+        proc_start = time.time()
+
+        ret = self.app.session.query(
+            "select * from %s where \
+             $start_time <= time and \
+             time < $end_time \
+             group by *" % (self.measurements[1]),
+            params=dict(params=json.dumps(dict(start_time=start_time,
+                                               end_time=end_time))),
+            epoch="ns")
+
+        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+
+        points = []
+        probes = {}
+
+        for ((_, tags), records) in ret.items():
+            tags = tags or {}
+            prb_id = tags.get("prb_id")
+            for record in records:
+                timestamp = record.pop("time")
+                points.append(types.MigratedDNSMeasurementData(timestamp,
+                                                               tags,
+                                                               record))
+                if prb_id and ((prb_id not in probes) or
+                               (probes[prb_id].current_time < timestamp)):
+                    probes[prb_id] = types.DNSProbe(timestamp,
+                                                    prb_id,
+                                                    tags.get("prb_lat"),
+                                                    tags.get("prb_lon"))
+
+        points.sort(key=lambda point: point.timestamp, reverse=True)
+
+        return points, list(probes.values())
+
+    def write_schema_v2_points(self, points, probes=()):
+
+        lines = types.make_lines(Mes_dnsprobe.SCHEMA_MEASUREMENT_NAMES[2],
+                                 points)
+        lines.extend(types.make_lines(Mes_dnsprobe.PROBE_MEASUREMENT_NAME,
+                                      probes))
+
+        return self.write_lines(lines)
+
+    def read_sources(self):
+        # both schemas are read for the values of the tags
+        if self.get_schema_boundary() is None:
+            return self.measurements[1]
+        return "%s, %s" % (self.measurements[1], self.measurements[2])
+
+    def __query(self, statement, params):
+
+        proc_start = time.time()
+
+        ret = self.query(statement, params)
+
+        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+
+        return ret
+
+    def __show_tag_list(self, tag):
+        return self.get_topology().values(tag)
 
     def __make_multiple_or_condition(self, keyname, values):
         # keyname,values parameter MUST BE TRUSTED value
@@ -143,18 +644,49 @@ class Mes_dnsprobe(InfluxDBMeasurementBase):
         result = [dict(label=each, value=each) for each in ret]
         return result
 
+    def get_probe_locations_v2(self):
+        """
+        Returns
+        -------
+        locations : dict
+            prb_id -> (prb_lat, prb_lon)
+        """
+
+        locations = {}
+
+        if self.get_schema_boundary() is None:
+            return locations
+
+        ret = self.__query(
+            "select last(prb_lat) as prb_lat, last(prb_lon) as prb_lon \
+             from %s group by prb_id" % (self.probe_measurement), {})
+
+        for (measurement_name, tags) in ret.keys():
+            for record in ret.get_points(measurement=measurement_name,
+                                         tags=tags):
+                locations[tags["prb_id"]] = (record["prb_lat"],
+                                             record["prb_lon"])
+
+        return locations
+
     def make_probe_locations(self):
         probe_list = self.__show_tag_list("prb_id")
+        locations = self.get_probe_locations_v2()
         lats = []
         lons = []
         for prb_id in probe_list:
 
+            if prb_id in locations:
+                lats.append(locations[prb_id][0])
+                lons.append(locations[prb_id][1])
+                continue
+
             proc_start = time.time()
 
             ret = self.app.session.query(
                 "show tag values from %s with key in \
                 (prb_lat, prb_lon) where prb_id = $prb_id" % (
-                    self.measurement),
+                    self.measurements[1]),
                 params=dict(params=json.dumps(dict(prb_id=prb_id))))
 
             LOGGER.debug("time took: %s" % (time.time() - proc_start))
@@ -170,200 +702,307 @@ class Mes_dnsprobe(InfluxDBMeasurementBase):
 
         return probe_list, lats, lons
 
-    def get_probe_last_measured(self, probe_id):
-
-        lasttime_value = "unknown"
-
-        # performance issue #45
-        return lasttime_value
+    def make_probe_lines(self, heartbeats):
+        return types.make_lines(Mes_dnsprobe.PROBE_MEASUREMENT_NAME,
+                                heartbeats)
 
-        proc_start = time.time()
+    def get_probe_registry(self):
+        """
+        各プローブの最新の状態を一度の問い合わせで読み出す
 
-        ret_uptime = self.app.session.query(
-                    "select time, time_took from %s where \
-                     prb_id = $prb_id \
-                     order by time desc \
-                     limit 1" % (self.measurement),
-                    params=dict(params=json.dumps(
-                        dict(prb_id=probe_id))))
+        Returns
+        -------
+        registry : dict
+            prb_id -> 最新の mes_dnsprobe_probe の点
+            (last_measured にその時刻)
+        """
 
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+        ret = self.__query(
+            "select * from %s \
+             group by prb_id \
+             order by time desc \
+             limit 1" % (self.probe_measurement), {})
 
-        for uptimes in ret_uptime:
-            for uptime in uptimes:
-                lasttime_value = uptime["time"]
+        registry = {}
 
-        return str(lasttime_value)
+        for ((_, tags), records) in ret.items():
+            if (not tags) or ("prb_id" not in tags):
+                continue
+            for record in records:
+                record["last_measured"] = record.pop("time")
+                registry[tags["prb_id"]] = record
 
-    def get_probe_uptime(self, probe_id):
+        return registry
 
-        uptime_value = "unknown"
+    def __get_registry_values(self, probe_id, keys):
 
-        # performance issue #45
-        return uptime_value
+        current_time = time.monotonic()
 
-        proc_start = time.time()
+        # one registry for all the probes instead of a query for each probe
+        if (self.probe_registry_checked_at is None) or \
+                (Mes_dnsprobe.PROBE_REGISTRY_TTL <=
+                 current_time - self.probe_registry_checked_at):
+            self.probe_registry = self.get_probe_registry()
+            self.probe_registry_checked_at = current_time
 
-        ret_uptime = self.app.session.query(
-                    "select probe_uptime from %s where \
-                     prb_id = $prb_id \
-                     order by time desc \
-                     limit 1" % (self.measurement),
-                    params=dict(params=json.dumps(
-                        dict(prb_id=probe_id))))
+        probe = self.probe_registry.get(probe_id, {})
 
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+        return tuple("unknown" if probe.get(key) is None else probe[key]
+                     for key in keys)
 
-        for uptimes in ret_uptime:
-            for uptime in uptimes:
-                uptime_value = uptime["probe_uptime"]
+    # deprecated. use get_probe_registry
+    def get_probe_last_measured(self, probe_id):
+        return str(self.__get_registry_values(probe_id,
+                                              ("last_measured",))[0])
 
-        return str(uptime_value)
+    # deprecated. use get_probe_registry
+    def get_probe_uptime(self, probe_id):
+        """
+        プローブのサーバの起動時刻
+        """
+        return str(self.__get_registry_values(probe_id, ("boot_time",))[0])
 
+    # deprecated. use get_probe_registry
     def get_probe_net_desc(self, probe_id):
-
-        v4_asn = "unknown"
-        v4_desc = "unknown"
-        v6_asn = "unknown"
-        v6_desc = "unknown"
-
-        # performance issue #45
+        """
         return v4_asn, v4_desc, v6_asn, v6_desc
+        """
+        return self.__get_registry_values(probe_id, ("asn_v4",
+                                                     "asn_desc_v4",
+                                                     "asn_v6",
+                                                     "asn_desc_v6"))
 
-        proc_start = time.time()
-
-        ret_desc = self.app.session.query(
-            "select probe_asn, probe_asn_desc \
-             from %s \
-             where prb_id = $prb_id \
-             group by af \
-             order by time desc \
-             limit 1" % (self.measurement),
-            params=dict(params=json.dumps(
-                dict(prb_id=probe_id))))
-
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
-
-        try:
-            LOGGER.debug("ip description object: %s" % (str(ret_desc)))
-            measurement = (self.__class__.__name__).lower()
-            v4 = list(ret_desc.get_points(measurement=measurement,
-                                          tags=dict(af="4")))
-            v6 = list(ret_desc.get_points(measurement=measurement,
-                                          tags=dict(af="6")))
-            v4_asn = v4[0]["probe_asn"]
-            v4_desc = v4[0]["probe_asn_desc"]
-            v6_asn = v6[0]["probe_asn"]
-            v6_desc = v6[0]["probe_asn_desc"]
-        except Exception as ex:
-            LOGGER.warning("unable to get IP description: %s" % (str(ex)))
+    # deprecated
+    def get_af_proto_combination(self, dns_server_name, probe_names):
+        index = self.get_topology()
+        return [(af, proto)
+                for (af, proto) in index.combinations(("af", "proto"),
+                                                      dst_name=dns_server_name,
+                                                      prb_id=probe_names)
+                if (af is not None) and (proto is not None)]
 
-        return v4_asn, v4_desc, v6_asn, v6_desc
+    def get_rttgraph_data(self, dns_server_name, probe_names, af, proto,
+                          rrtype, start_time, end_time):
 
-    # deprecated
-    def __get_af_proto_combination_core(self, dns_server_name, probe_name):
+        return self.get_rttgraph_data_batch(dns_server_name, probe_names,
+                                            [(af, proto)], rrtype,
+                                            start_time, end_time)[(af, proto)]
 
-        proc_start = time.time()
+    def get_rttgraph_data_batch(self, dns_server_name, probe_names,
+                                af_proto_combination, rrtype, start_time,
+                                end_time):
+        """
+        アドレスファミリとプロトコルの組み合わせ毎のRTTの推移を並行して求める
 
-        ret_af = self.app.session.query(
-            "show tag values from %s with key = af where \
-             dst_name = $dst_name and prb_id = $prb_id" % (
-                self.measurement),
-            params=dict(params=json.dumps(dict(dst_name=dns_server_name,
-                                               prb_id=probe_name))))
+        Returns
+        -------
+        result : dict
+            (af, proto) -> (x, y)
+        """
 
-        ret_proto = self.app.session.query(
-            "show tag values from %s with key = proto where \
-             dst_name = $dst_name and prb_id = $prb_id" % (
-                 self.measurement),
-            params=dict(params=json.dumps(dict(dst_name=dns_server_name,
-                                               prb_id=probe_name))))
+        prb_id_condition = self.__make_multiple_or_condition("prb_id",
+                                                             probe_names)
+        portions = self.split_by_schema(start_time, end_time)
+
+        keys = []
+        queries = []
+        for (af, proto) in af_proto_combination:
+            for (measurement, _, time_condition, time_params) in portions:
+                keys.append((af, proto))
+                queries.append((
+                    "select mean(time_took) as averaged_time_took, \
+                     count(time_took) as measured from %s where \
+                     dst_name = $dst_name and \
+                     got_response = 'True' and \
+                     af = $af and \
+                     proto = $proto and \
+                     rrtype = $rrtype and \
+                     %s and \
+                     (%s) \
+                     group by time(1m)" % (measurement, time_condition,
+                                           prb_id_condition),
+                    dict(dst_name=dns_server_name,
+                         af=af,
+                         proto=proto,
+                         rrtype=rrtype,
+                         **time_params)))
 
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+        # (af, proto) -> time -> [(mean, count)]
+        buckets = {key: {} for key in af_proto_combination}
 
-        result = []
+        for (key, ret) in zip(keys, self.query_batched(queries)):
+            for records in ret:
+                for data in records:
+                    buckets[key].setdefault(data["time"], []).append(
+                        (data["averaged_time_took"], data["measured"]))
 
-        for afs in ret_af:
-            for af in afs:
-                af_value = af["value"]
-                for prots in ret_proto:
-                    for proto in prots:
-                        proto_value = proto["value"]
-                        result.append((af_value, proto_value))
+        result = {}
+        for (key, each_buckets) in buckets.items():
+            x = []
+            y = []
+            for (bucket, values) in each_buckets.items():
+                # a minute may be read from both of the schemas at the
+                # boundary
+                values = [(mean, count) for (mean, count) in values
+                          if mean is not None]
+                total = sum(count for (_, count) in values)
+                x.append(bucket)
+                y.append((sum(mean * count for (mean, count) in values) /
+                          total) if total else None)
+            result[key] = (x, y)
 
         return result
 
-    # deprecated
-    def get_af_proto_combination(self, dns_server_name, probe_names):
-        ret = []
-        for probe_name in probe_names:
-            ret.extend(self.__get_af_proto_combination_core(dns_server_name,
-                                                            probe_name))
-        return list(set(ret))
+    def get_nsidgraph_data(self, dns_server_name, probe_names, rrtype,
+                           start_time, end_time):
+        """
+        Returns
+        -------
+        counts : dict
+            nsid -> 応答数
+        """
 
-    def get_rttgraph_data(self, dns_server_name, probe_names, af, proto,
-                          rrtype, start_time, end_time):
+        prb_id_condition = self.__make_multiple_or_condition("prb_id",
+                                                             probe_names)
+        params = dict(dst_name=dns_server_name, rrtype=rrtype)
+        counts = collections.Counter()
+
+        for (measurement, version, time_condition, time_params) in \
+                self.split_by_schema(start_time, end_time):
+
+            params.update(time_params)
+
+            if version == 1:
+                ret = self.__query(
+                    "select count(time_took) \
+                     from %s where \
+                     got_response = 'True' and \
+                     dst_name = $dst_name and \
+                     rrtype = $rrtype and \
+                     %s and \
+                     (%s) \
+                     group by nsid" % (measurement, time_condition,
+                                       prb_id_condition),
+                    params)
+                for (measurement_name, tags) in ret.keys():
+                    if (not tags) or ("nsid" not in tags):
+                        continue
+                    for data in ret.get_points(measurement=measurement_name,
+                                               tags=tags):
+                        counts[tags["nsid"]] += data["count"]
+            else:
+                # nsid is a field in schema v2. count it here while reading
+                # the points so that a long range is not held in memory
+                for (_, data) in self.query_rows(
+                        "select nsid \
+                         from %s where \
+                         got_response = 'True' and \
+                         dst_name = $dst_name and \
+                         rrtype = $rrtype and \
+                         %s and \
+                         (%s)" % (measurement, time_condition,
+                                  prb_id_condition),
+                        params):
+                    counts[data["nsid"]] += 1
+
+        return dict(counts)
+
+    def __count_measurements(self, response_condition, dns_server_name,
+                             probe_names, af, proto, rrtype, start_time,
+                             end_time):
+        # response_condition MUST BE TRUSTED value
 
-        proc_start = time.time()
         prb_id_condition = self.__make_multiple_or_condition("prb_id",
                                                              probe_names)
+        count = 0
 
-        ret = self.app.session.query(
-            "select mean(time_took) as averaged_time_took from %s where \
+        queries = [(
+            "select count(time_took) from %s where \
+             %s and \
              dst_name = $dst_name and \
-             got_response = 'True' and \
              af = $af and \
              proto = $proto and \
              rrtype = $rrtype and \
-             $start_time < time and \
-             time < $end_time and \
-             (%s) \
-             group by time(1m)" % (self.measurement, prb_id_condition),
-            params=dict(params=json.dumps(
-                dict(dst_name=dns_server_name,
-                     af=af,
-                     proto=proto,
-                     rrtype=rrtype,
-                     start_time=start_time,
-                     end_time=end_time))))
+             %s and \
+             (%s)" % (measurement, response_condition, time_condition,
+                      prb_id_condition),
+            dict(dst_name=dns_server_name,
+                 af=af,
+                 proto=proto,
+                 rrtype=rrtype,
+                 **time_params))
+            for (measurement, _, time_condition, time_params)
+            in self.split_by_schema(start_time, end_time)]
+
+        for ret in self.query_batched(queries):
+            for records in ret:
+                for data in records:
+                    count += data["count"]
+
+        return count
+
+    def get_ratiograph_matrix(self, rrtype, start_time, end_time,
+                              dns_server_name=None, probe_names=None):
+        """
+        応答の成否(失敗、閾値超過、成功)毎の測定数を一度の問い合わせで数える
+
+        Parameters
+        ----------
+        dns_server_name : str
+            None の場合は全てのネームサーバ
+        probe_names : list
+            None の場合は全てのプローブ
+
+        Returns
+        -------
+        matrix : dict
+            (prb_id, dst_name, af, proto) ->
+            dict(failed=int, exceeded_slr=int, successful=int)
+        """
 
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+        conditions = ["rrtype = $rrtype"]
+        params = dict(rrtype=rrtype)
 
-        x = []
-        y = []
-        for records in ret:
-            for data in records:
-                x.append(data["time"])
-                y.append(data["averaged_time_took"])
+        if dns_server_name is not None:
+            conditions.append("dst_name = $dst_name")
+            params["dst_name"] = dns_server_name
 
-        return x, y
+        if probe_names is not None:
+            conditions.append("(%s)" % self.__make_multiple_or_condition(
+                "prb_id", probe_names))
 
-    def get_nsidgraph_data(self, dns_server_name, probe_names, rrtype,
-                           start_time, end_time):
+        matrix = {}
 
-        proc_start = time.time()
-        prb_id_condition = self.__make_multiple_or_condition("prb_id",
-                                                             probe_names)
+        queries = [(
+            "select count(time_took) from %s where \
+             %s and \
+             %s \
+             group by got_response, slr_exceeded, \
+                      prb_id, dst_name, af, proto" % (
+                 measurement, " and ".join(conditions), time_condition),
+            dict(params, **time_params))
+            for (measurement, _, time_condition, time_params)
+            in self.split_by_schema(start_time, end_time)]
+
+        for ret in self.query_batched(queries):
+
+            for ((_, tags), records) in ret.items():
+                if tags.get("got_response") != "True":
+                    column = "failed"
+                elif tags.get("slr_exceeded") == "True":
+                    column = "exceeded_slr"
+                else:
+                    column = "successful"
 
-        ret = self.app.session.query(
-            "select count(time_took) \
-             from %s where \
-             got_response = 'True' and \
-             dst_name = $dst_name and \
-             rrtype = $rrtype and \
-             $start_time < time and \
-             time < $end_time and\
-             (%s) \
-            group by nsid" % (self.measurement, prb_id_condition),
-            params=dict(params=json.dumps(
-                dict(dst_name=dns_server_name,
-                     rrtype=rrtype,
-                     start_time=start_time,
-                     end_time=end_time))))
+                counts = matrix.setdefault(
+                    (tags.get("prb_id"), tags.get("dst_name"),
+                     tags.get("af"), tags.get("proto")),
+                    dict(failed=0, exceeded_slr=0, successful=0))
 
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+                for data in records:
+                    counts[column] += data["count"]
 
-        return ret
+        return matrix
 
     def get_ratiograph_failed(self, dns_server_name, probe_names, af,
                               proto, rrtype, start_time, end_time):
@@ -376,37 +1015,9 @@ class Mes_dnsprobe(InfluxDBMeasurementBase):
              t       |      t      -> count_slr_exceeded
         """
 
-        proc_start = time.time()
-
-        prb_id_condition = self.__make_multiple_or_condition("prb_id",
-                                                             probe_names)
-
-        failed = self.app.session.query(
-            "select count(time_took) from %s where \
-             got_response = 'False' and \
-             dst_name = $dst_name and \
-             af = $af and \
-             proto = $proto and \
-             rrtype = $rrtype and \
-             $start_time < time and \
-             time < $end_time and \
-             (%s)" % (self.measurement, prb_id_condition),
-            params=dict(params=json.dumps(
-                dict(dst_name=dns_server_name,
-                     af=af,
-                     proto=proto,
-                     rrtype=rrtype,
-                     start_time=start_time,
-                     end_time=end_time))))
-
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
-
-        failed_count = 0
-        for records in failed:
-            for data in records:
-                failed_count = data["count"]
-
-        return failed_count
+        return self.__count_measurements("got_response = 'False'",
+                                         dns_server_name, probe_names, af,
+                                         proto, rrtype, start_time, end_time)
 
     def get_ratiograph_exceeded_slr(self, dns_server_name, probe_names, af,
                                     proto, rrtype, start_time, end_time):
@@ -418,37 +1029,10 @@ class Mes_dnsprobe(InfluxDBMeasurementBase):
              t       |      t      -> count_exceeded_slr
         """
 
-        proc_start = time.time()
-        prb_id_condition = self.__make_multiple_or_condition("prb_id",
-                                                             probe_names)
-
-        exceeded_slr = self.app.session.query(
-            "select count(time_took) from %s where \
-             got_response = 'True' and \
-             slr_exceeded = 'True' and \
-             dst_name = $dst_name and \
-             af = $af and \
-             proto = $proto and \
-             rrtype = $rrtype and \
-             $start_time < time and \
-             time < $end_time and \
-             (%s)" % (self.measurement, prb_id_condition),
-            params=dict(params=json.dumps(
-                dict(dst_name=dns_server_name,
-                     af=af,
-                     proto=proto,
-                     rrtype=rrtype,
-                     start_time=start_time,
-                     end_time=end_time))))
-
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
-
-        exceeded_slr_count = 0
-        for records in exceeded_slr:
-            for data in records:
-                exceeded_slr_count = data["count"]
-
-        return exceeded_slr_count
+        return self.__count_measurements("got_response = 'True' and \
+                                          slr_exceeded = 'True'",
+                                         dns_server_name, probe_names, af,
+                                         proto, rrtype, start_time, end_time)
 
     def get_ratiograph_successful(self, dns_server_name, probe_names, af,
                                   proto, rrtype, start_time, end_time):
@@ -460,37 +1044,10 @@ class Mes_dnsprobe(InfluxDBMeasurementBase):
              t       |      t      -> count_slr_exceeded
         """
 
-        proc_start = time.time()
-        prb_id_condition = self.__make_multiple_or_condition("prb_id",
-                                                             probe_names)
-
-        successful = self.app.session.query(
-            "select count(time_took) from %s where \
-             got_response = 'True' and \
-             slr_exceeded = 'False' and \
-             dst_name = $dst_name and \
-             af = $af and \
-             proto = $proto and \
-             rrtype = $rrtype and \
-             $start_time < time and \
-             time < $end_time and \
-             (%s)" % (self.measurement, prb_id_condition),
-            params=dict(params=json.dumps(
-                dict(dst_name=dns_server_name,
-                     af=af,
-                     proto=proto,
-                     rrtype=rrtype,
-                     start_time=start_time,
-                     end_time=end_time))))
-
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
-
-        successful_count = 0
-        for records in successful:
-            for data in records:
-                successful_count = data["count"]
-
-        return successful_count
+        return self.__count_measurements("got_response = 'True' and \
+                                          slr_exceeded = 'False'",
+                                         dns_server_name, probe_names, af,
+                                         proto, rrtype, start_time, end_time)
 
     def get_percentilegraph_data(self, dns_server_name, probe_names, rrtype,
                                  start_time, end_time):
@@ -505,41 +1062,84 @@ class Mes_dnsprobe(InfluxDBMeasurementBase):
         result = {}
         prb_id_condition = self.__make_multiple_or_condition("prb_id",
                                                              probe_names)
+        portions = self.split_by_schema(start_time, end_time)
+
+        if 1 < len(portions):
+            # percentiles over both of the schemas are computed here
+            values = collections.defaultdict(list)
+            for (measurement, _, time_condition, time_params) in portions:
+                # only the values are kept, not the whole of the response
+                for (tags, record) in self.query_rows(
+                        "select time_took \
+                         from %s \
+                         where \
+                         got_response = 'True' and \
+                         %s and \
+                         dst_name = $dst_name and \
+                         rrtype = $rrtype and \
+                         (%s) \
+                         group by af, proto" % (measurement, time_condition,
+                                                prb_id_condition),
+                        dict(dst_name=dns_server_name,
+                             rrtype=rrtype,
+                             **time_params)):
+                    if ("af" not in tags) or ("proto" not in tags):
+                        continue
+                    values[(tags["af"], tags["proto"])].append(
+                        record["time_took"])
+
+            for (key, time_tooks) in values.items():
+                time_tooks.sort()
+                for each_step in range(0, 100+1, xaxis_step):
+                    value = percentile_of_sorted(time_tooks, each_step)
+                    if value is None:
+                        continue
+                    if key in result:
+                        result[key][0].append(value)
+                        result[key][1].append(each_step)
+                    else:
+                        result[key] = ([value], [each_step])
 
-        for each_step in range(0, 100+1, xaxis_step):
-
-            percentile = self.app.session.query(
-                "select percentile(time_took, $each_step) \
-                 from %s \
-                 where \
-                 got_response = 'True' and \
-                 time > $start_time and \
-                 time < $end_time and \
-                 dst_name = $dst_name and \
-                 rrtype = $rrtype and \
-                 (%s) \
-                 group by af, proto" % (self.measurement, prb_id_condition),
-                params=dict(params=json.dumps(
-                    dict(each_step=each_step,
-                         dst_name=dns_server_name,
-                         rrtype=rrtype,
-                         start_time=start_time,
-                         end_time=end_time))))
+            LOGGER.debug("time took: %s" % (time.time() - proc_start))
 
-            for (measurement_name, tags) in percentile.keys():
-                record = list(percentile.get_points(
-                    measurement=measurement_name,
-                    tags=tags))
+            return result
 
-                if ("af" not in tags) or ("proto" not in tags) or \
-                        (len(record) != 1) or ("percentile" not in record[0]):
-                    LOGGER.warning(str(tags))
-                    LOGGER.warning(str(record))
-                    LOGGER.warning("unexpected influxdb scheme")
-                    continue
+        measurement, _, time_condition, time_params = portions[0]
+        steps = list(range(0, 100+1, xaxis_step))
+
+        # all the percentiles are selected in a statement to scan at once
+        percentile = self.__query(
+            "select %s \
+             from %s \
+             where \
+             got_response = 'True' and \
+             %s and \
+             dst_name = $dst_name and \
+             rrtype = $rrtype and \
+             (%s) \
+             group by af, proto" % (
+                 ", ".join("percentile(time_took, %d) as p%d" % (step, step)
+                           for step in steps),
+                 measurement, time_condition, prb_id_condition),
+            dict(dst_name=dns_server_name,
+                 rrtype=rrtype,
+                 **time_params))
+
+        for ((_, tags), records) in percentile.items():
+            records = list(records)
+
+            if (not tags) or ("af" not in tags) or ("proto" not in tags) or \
+                    (len(records) != 1):
+                LOGGER.warning(str(tags))
+                LOGGER.warning(str(records))
+                LOGGER.warning("unexpected influxdb scheme")
+                continue
 
-                key = (tags["af"], tags["proto"])
-                value = record[0]["percentile"]
+            key = (tags["af"], tags["proto"])
+            for each_step in steps:
+                value = records[0].get("p%d" % each_step)
+                if value is None:
+                    continue
                 if key in result:
                     result[key][0].append(value)
                     result[key][1].append(each_step)
@@ -551,155 +1151,194 @@ class Mes_dnsprobe(InfluxDBMeasurementBase):
         return result
 
     def get_last_measured_soa_data(self, hours):
+        """
+        ネームサーバ、プローブ毎の最大のシリアルとその最初と最後の観測時刻
 
-        current_time = datetime.datetime.utcnow()
+        ネームサーバやプローブの数によらず、スキーマ毎に一度の問い合わせで
+        時刻順の (time, serial) を読み出して求める
+        """
+
+        current_time = util.utcnow_by_minute()
         start_time = (current_time - datetime.timedelta(hours=hours)
                       ).isoformat() + "Z"
 
-        result = []
-
         proc_start = time.time()
 
-        maximum_soa_for_each_nameserver = self.app.session.query(
-            "select max(serial)\
+        # (dst_name, af, proto, prb_id) ->
+        # [maximum serial, first measured at, last measured at]
+        table = {}
+
+        queries = [(
+            "select serial\
              from %s \
              where got_response = 'True' and\
              rrtype = 'SOA' and \
-             time > $start_time\
-             group by dst_name, af, proto, prb_id" % (self.measurement),
-            params=dict(params=json.dumps(
-                dict(start_time=start_time))))
-
-        for (measurement_name, tags) in maximum_soa_for_each_nameserver.keys():
-            record = list(maximum_soa_for_each_nameserver.get_points(
-                measurement=measurement_name,
-                tags=tags))
-
-            if not (("dst_name" in tags) and ("af" in tags) and
-                    ("proto" in tags) and ("prb_id" in tags) and
-                    (len(record) == 1) and ("max" in record[0]) and
-                    ("time" in record[0])):
-                LOGGER.warning(str(tags))
-                LOGGER.warning(str(record))
-                LOGGER.warning("unexpected influxdb scheme")
-                continue
+             %s\
+             group by dst_name, af, proto, prb_id" % (measurement,
+                                                      time_condition),
+            time_params)
+            for (measurement, _, time_condition, time_params)
+            in self.split_by_schema(start_time)]
 
-            dst_name = tags["dst_name"]
-            af = tags["af"]
-            proto = tags["proto"]
-            prb_id = tags["prb_id"]
-            current_maximum_serial = record[0]["max"]
-            last_measured_at = record[0]["time"]
-
-            first_measured = self.app.session.query(
-                "select first(serial)\
-                 from %s \
-                 where \
-                 got_response = 'True' and\
-                 rrtype = 'SOA' and\
-                 time > $start_time and\
-                 dst_name = $dst_name and\
-                 af = $af and\
-                 proto = $proto and \
-                 prb_id = $prb_id and\
-                 serial = $serial" % (self.measurement),
-                params=dict(params=json.dumps(
-                    dict(start_time=start_time,
-                         dst_name=dst_name,
-                         af=af,
-                         proto=proto,
-                         prb_id=prb_id,
-                         serial=current_maximum_serial))))
-
-            last_measured = self.app.session.query(
-                "select last(serial)\
-                 from %s \
-                 where \
-                 got_response = 'True' and\
-                 rrtype = 'SOA' and\
-                 time > $start_time and\
-                 dst_name = $dst_name and\
-                 af = $af and\
-                 proto = $proto and \
-                 prb_id = $prb_id and\
-                 serial = $serial" % (self.measurement),
-                params=dict(params=json.dumps(
-                    dict(start_time=start_time,
-                         dst_name=dst_name,
-                         af=af,
-                         proto=proto,
-                         prb_id=prb_id,
-                         serial=current_maximum_serial))))
+        # the portions are in ascending order of time as well as the points
+        for measured_serials in self.query_batched(queries):
 
-            last_measured_at = list(last_measured.get_points())[0]["time"]
-            first_measured_at = list(first_measured.get_points())[0]["time"]
+            for ((_, tags), records) in measured_serials.items():
 
-            result.append(dict(dst_name=dst_name,
-                               af=af,
-                               proto=proto,
-                               prb_id=prb_id,
-                               serial=current_maximum_serial,
-                               first_measured_at=first_measured_at,
-                               last_measured_at=last_measured_at))
+                if not (tags and ("dst_name" in tags) and ("af" in tags) and
+                        ("proto" in tags) and ("prb_id" in tags)):
+                    LOGGER.warning(str(tags))
+                    LOGGER.warning("unexpected influxdb scheme")
+                    continue
+
+                key = (tags["dst_name"], tags["af"], tags["proto"],
+                       tags["prb_id"])
+                state = table.get(key)
+
+                for record in records:
+                    serial = record.get("serial")
+                    if serial is None:
+                        continue
+                    if (state is None) or (state[0] < serial):
+                        state = [serial, record["time"], record["time"]]
+                        table[key] = state
+                    elif state[0] == serial:
+                        state[2] = record["time"]
+
+        result = [dict(dst_name=dst_name,
+                       af=af,
+                       proto=proto,
+                       prb_id=prb_id,
+                       serial=serial,
+                       first_measured_at=first_measured_at,
+                       last_measured_at=last_measured_at)
+                  for ((dst_name, af, proto, prb_id),
+                       (serial, first_measured_at, last_measured_at))
+                  in table.items()]
 
         LOGGER.debug("time took: %s" % (time.time() - proc_start))
 
         return result
 
 
-class Mes_cq_nameserver_availability(InfluxDBMeasurementBase):
+class Mes_dnsprobe_rdata(InfluxDBMeasurementBase):
+
+    """
+    mes_dnsprobe の data_digest から参照されるRDATA
+
+    同じ書き込み経路(スプールを含む)を使うため mes_dnsprobe と同じ保持ポリシーに置く
+    """
 
     def __init__(self, *positional, **kw):
         super().__init__(*positional, **kw)
+        self.retention_policy = "rp_%s" % (Mes_dnsprobe.__name__.lower())
+        self.measurement = '"%s"."%s"' % (self.retention_policy,
+                                          self.measurement_name)
 
-    def count_total_measurements(self, dst_name, af, start_time, end_time):
+    def get_rdata(self, digest):
 
         proc_start = time.time()
 
-        ret_count = self.app.session.query(
-            "select count(mode) from %s \
-             where dst_name = $dst_name and af = $af and \
-             $start_time <= time and \
-             time <= $end_time" % self.measurement,
-            params=dict(params=json.dumps(dict(dst_name=dst_name,
-                                               af=af,
-                                               start_time=start_time,
-                                               end_time=end_time))))
+        ret_rdata = self.app.session.query(
+            "select last(data) as data from %s \
+             where \
+             digest = $digest" % self.measurement,
+            params=dict(params=json.dumps(dict(digest=digest))))
 
         LOGGER.debug("time took: %s" % (time.time() - proc_start))
 
-        total_measurements = 0
+        for records in ret_rdata:
+            for data in records:
+                return types.rdata_decode(data["data"])
+
+        LOGGER.warning("unable to get rdata for %s" % (digest))
+
+        return None
+
+
+class Mes_cq_nameserver_availability(InfluxDBMeasurementBase):
+
+    # value of mode which means the failure
+    FAILED_MODE = 0
+
+    def __init__(self, *positional, **kw):
+        super().__init__(*positional, **kw)
+
+    def make_count_query(self, dst_name, af, start_time, end_time,
+                         failed=False):
+
+        statement = "select count(mode) from %s \
+                     where dst_name = $dst_name and af = $af and \
+                     $start_time <= time and \
+                     time <= $end_time" % self.measurement
+
+        if failed:
+            statement += " and mode = %d" % (self.FAILED_MODE)
+
+        return statement, dict(dst_name=dst_name,
+                               af=af,
+                               start_time=start_time,
+                               end_time=end_time)
+
+    def get_count(self, ret_count):
+
+        count = 0
 
         for records in ret_count:
             for data in records:
-                total_measurements = data["count"]
+                count = data["count"]
+
+        return count
 
-        return total_measurements
+    def count_total_measurements(self, dst_name, af, start_time, end_time):
+
+        proc_start = time.time()
+
+        ret_count = self.query(*self.make_count_query(dst_name, af,
+                                                      start_time, end_time))
+
+        LOGGER.debug("time took: %s" % (time.time() - proc_start))
+
+        return self.get_count(ret_count)
 
     def count_failed_measurements(self, dst_name, af, start_time, end_time):
 
         proc_start = time.time()
 
-        ret_count = self.app.session.query(
-            "select count(mode) from %s \
-             where dst_name = $dst_name and af = $af and \
-             $start_time <= time and \
-             time <= $end_time and \
-             mode = 0" % self.measurement,
-            params=dict(params=json.dumps(dict(dst_name=dst_name,
-                                               af=af,
-                                               start_time=start_time,
-                                               end_time=end_time))))
+        ret_count = self.query(*self.make_count_query(dst_name, af,
+                                                      start_time, end_time,
+                                                      failed=True))
 
         LOGGER.debug("time took: %s" % (time.time() - proc_start))
 
-        failed_measurements = 0
+        return self.get_count(ret_count)
 
-        for records in ret_count:
-            for data in records:
-                failed_measurements = data["count"]
+    def count_measurements(self, targets, start_time, end_time):
+        """
+        全ての対象の測定数と失敗数を並行して数える
+
+        Parameters
+        ----------
+        targets : list
+            (dst_name, af) のリスト
+
+        Returns
+        -------
+        counts : list
+            targets と同じ順の (total, failed) のリスト
+        """
 
-        return failed_measurements
+        queries = []
+        for (dst_name, af) in targets:
+            for failed in (False, True):
+                queries.append(self.make_count_query(dst_name, af,
+                                                     start_time, end_time,
+                                                     failed))
+
+        counts = [self.get_count(ret)
+                  for ret in self.query_batched(queries)]
+
+        return list(zip(counts[0::2], counts[1::2]))
 
     def write_measurement_data(self, measured_data):
         pass
@@ -712,15 +1351,15 @@ class Mes_nameserver_availability(InfluxDBMeasurementBase):
 
     def get_recent_sla(self, dst_name, af):
 
-        ret_sla = self.app.session.query(
+        ret_sla = self.query(
             "select sla from %s \
              where \
              dst_name = $dst_name and \
              af = $af \
              order by time desc \
              limit 1" % self.measurement,
-            params=dict(params=json.dumps(dict(dst_name=dst_name,
-                                               af=af))))
+            dict(dst_name=dst_name,
+                 af=af))
 
         for records in ret_sla:
             for data in records:
@@ -732,34 +1371,12 @@ class Mes_nameserver_availability(InfluxDBMeasurementBase):
 
 class Mes_cq_tcp_nameserver_availability(Mes_cq_nameserver_availability):
 
+    # mode of slr_exceeded_field. exceeding the threshold is the failure
+    FAILED_MODE = 1
+
     def __init__(self, *positional, **kw):
         super().__init__(*positional, **kw)
 
-    def count_failed_measurements(self, dst_name, af, start_time, end_time):
-
-        proc_start = time.time()
-
-        ret_count = self.app.session.query(
-            "select count(mode) from %s \
-             where dst_name = $dst_name and af = $af and \
-             $start_time <= time and \
-             time <= $end_time and \
-             mode = 1" % self.measurement,
-            params=dict(params=json.dumps(dict(dst_name=dst_name,
-                                               af=af,
-                                               start_time=start_time,
-                                               end_time=end_time))))
-
-        LOGGER.debug("time took: %s" % (time.time() - proc_start))
-
-        failed_measurements = 0
-
-        for records in ret_count:
-            for data in records:
-                failed_measurements = data["count"]
-
-        return failed_measurements
-
     def write_measurement_data(self, measured_data):
         pass
 
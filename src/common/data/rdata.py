@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import time
+import threading
+
+from logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+
+class RdataDictionary(object):
+
+    """
+    ダイジェストをキーとしてRDATAを一度だけ書き込むための辞書
+
+    測定中に初めて現れたダイジェストのRDATAを書き込み待ちとして保持し、
+    書き込み済みのダイジェストとその時刻を記憶する
+    """
+
+    def __init__(self, refresh_interval=86400):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        refresh_interval : int
+            書き込み済みのRDATAをこの秒数の経過後に再度書き込む
+            (参照する測定結果よりも先にRDATAが保持期間切れとならないように)
+        """
+
+        self.refresh_interval = refresh_interval
+        self.mutex = threading.Lock()
+        self.written = {}
+        self.pending = {}
+
+    def is_known(self, digest):
+
+        if digest in self.pending:
+            return True
+
+        written_at = self.written.get(digest)
+
+        return (written_at is not None) and \
+            (time.time() - written_at < self.refresh_interval)
+
+    def register(self, digest, rrtype, blob):
+
+        with self.mutex:
+            if not self.is_known(digest):
+                self.pending[digest] = (rrtype, blob)
+                LOGGER.debug("new rdata digest: %s" % (digest))
+
+    def take_pending(self):
+        """
+        書き込み待ちのRDATAを取り出す
+
+        Returns
+        -------
+        pending : dict
+            digest -> (rrtype, blob)
+        """
+
+        with self.mutex:
+            pending, self.pending = self.pending, {}
+
+        return pending
+
+    def mark_written(self, digests):
+
+        written_at = time.time()
+
+        with self.mutex:
+            for digest in digests:
+                self.written[digest] = written_at
+
+    def restore(self, pending):
+        """
+        書き込めなかったRDATAを書き込み待ちに戻す
+        """
+
+        with self.mutex:
+            for digest, value in pending.items():
+                self.pending.setdefault(digest, value)
+
+    def load(self, written):
+
+        with self.mutex:
+            self.written.update(written)
+
+    def dump(self):
+        """
+        書き込み済みのダイジェストのうち、再書き込みの不要なものを返す
+        """
+
+        current_time = time.time()
+
+        with self.mutex:
+            self.written = {digest: written_at
+                            for (digest, written_at) in self.written.items()
+                            if current_time - written_at <
+                            self.refresh_interval}
+            return dict(self.written)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+import os
+import time
+import fcntl
+
+from logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+
+class Spool(object):
+
+    """
+    InfluxDBへ書き込めなかった測定結果を line protocol のまま保持する
+    追記専用のセグメントファイル群
+
+    セグメントは作成順に名前が付けられ、再送も同じ順序で行う
+    各行は測定時刻をタイムスタンプに持つため、同じ行を再送しても
+    InfluxDB上では同一のポイントとして上書きされるのみとなる
+    """
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_EXT = ".lp"
+    LOCK_NAME = ".lock"
+
+    def __init__(self, directory, max_bytes, segment_max_bytes, fsync=True):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        directory : str
+            セグメントファイルを配置するディレクトリ
+        max_bytes : int
+            スプール全体の上限サイズ。超過した場合は古いセグメントから破棄する
+        segment_max_bytes : int
+            1セグメントの上限サイズ
+        fsync : bool
+            追記毎にfsyncを行うか否か
+        """
+
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.segment_max_bytes = int(segment_max_bytes)
+        self.fsync = fsync
+
+    def __lock(self):
+        # created on the first use so that a spool never used leaves nothing
+        os.makedirs(self.directory, exist_ok=True)
+        handle = open(os.path.join(self.directory, Spool.LOCK_NAME), "a")
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.join(self.directory, name)
+                      for name in os.listdir(self.directory)
+                      if name.startswith(Spool.SEGMENT_PREFIX) and
+                      name.endswith(Spool.SEGMENT_EXT))
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in self.segments())
+
+    def __new_segment_name(self):
+        return os.path.join(self.directory, "%s%020d%s" % (
+            Spool.SEGMENT_PREFIX, time.time_ns(), Spool.SEGMENT_EXT))
+
+    def __active_segment(self, segments):
+        # the newest segment is reused until it reaches its size limit
+        if segments and \
+                os.path.getsize(segments[-1]) < self.segment_max_bytes:
+            return segments[-1]
+        return self.__new_segment_name()
+
+    def __enforce_max_bytes(self, segments):
+
+        total = sum(os.path.getsize(path) for path in segments)
+
+        while segments and total > self.max_bytes:
+            oldest = segments.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+            LOGGER.warning("spool exceeded %d bytes. %s dropped" %
+                           (self.max_bytes, oldest))
+
+    def append(self, lines):
+        """
+        line protocolの行を追記する。fsyncは呼び出し1回につき1度のみ行う
+        """
+
+        if not lines:
+            return True
+
+        data = ("\n".join(lines) + "\n").encode("utf8")
+
+        try:
+            with self.__lock():
+                segments = self.segments()
+                path = self.__active_segment(segments)
+                with open(path, "ab") as handle:
+                    handle.write(data)
+                    handle.flush()
+                    if self.fsync:
+                        os.fsync(handle.fileno())
+                if path not in segments:
+                    segments.append(path)
+                self.__enforce_max_bytes(segments)
+        except Exception as ex:
+            LOGGER.error("unable to append %d lines to spool: %s" %
+                         (len(lines), str(ex)))
+            return False
+
+        LOGGER.info("%d lines spooled to %s" % (len(lines), path))
+
+        return True
+
+    def replay(self, writer, batch_size):
+        """
+        スプールされた行を古い順に writer へ渡し、書き込めたセグメントを削除する
+
+        Parameters
+        ----------
+        writer : callable
+            line protocolの行のリストを受け取り、書き込みの成否を返す
+        batch_size : int
+            writer へ一度に渡す行数
+
+        Returns
+        -------
+        completed : bool
+            スプールが空になった場合に True
+        """
+
+        batch_size = max(1, int(batch_size))
+
+        if not os.path.isdir(self.directory):
+            return True
+
+        with self.__lock():
+
+            for path in self.segments():
+
+                with open(path, "r", encoding="utf8") as handle:
+                    lines = [line for line in handle.read().splitlines()
+                             if line]
+
+                for start in range(0, len(lines), batch_size):
+                    if not writer(lines[start:start + batch_size]):
+                        LOGGER.warning("replaying %s failed" % (path))
+                        return False
+
+                os.remove(path)
+                LOGGER.info("%d lines replayed from %s" % (len(lines), path))
+
+        return True
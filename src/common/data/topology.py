@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+from logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+# characters escaped with a backslash in the series key
+ESCAPABLE = frozenset(", =")
+
+
+def split_escaped(text, separator, maxsplit=-1):
+    """
+    バックスラッシュでエスケープされていない separator で分割する
+    (エスケープはそのまま残す)
+    """
+
+    result = []
+    start = 0
+    n = 0
+
+    while n < len(text):
+        c = text[n]
+        if c == "\\" and (n + 1 < len(text)) and (text[n + 1] in ESCAPABLE):
+            n += 2
+            continue
+        if c == separator and maxsplit != len(result):
+            result.append(text[start:n])
+            start = n + 1
+        n += 1
+
+    result.append(text[start:])
+
+    return result
+
+
+def unescape(text):
+
+    if "\\" not in text:
+        return text
+
+    result = []
+    n = 0
+
+    while n < len(text):
+        if text[n] == "\\" and (n + 1 < len(text)) and \
+                (text[n + 1] in ESCAPABLE):
+            n += 1
+        result.append(text[n])
+        n += 1
+
+    return "".join(result)
+
+
+def parse_series_key(key):
+    """
+    SHOW SERIES の key(measurement,tag=value,...)を分解する
+
+    Returns
+    -------
+    measurement : str
+    tags : dict
+    """
+
+    parts = split_escaped(key, ",")
+    tags = {}
+
+    for part in parts[1:]:
+        pair = split_escaped(part, "=", 1)
+        if len(pair) != 2:
+            LOGGER.warning("unexpected series key: %s" % (key))
+            continue
+        tags[unescape(pair[0])] = unescape(pair[1])
+
+    return unescape(parts[0]), tags
+
+
+class TagTopology(object):
+
+    """
+    シリーズのタグを dst_name -> af -> proto -> prb_id -> rrtype の木として
+    保持する索引
+
+    タグを持たない測定(CQの結果など)ではその階層の値は None となる
+    """
+
+    LEVELS = ("dst_name", "af", "proto", "prb_id", "rrtype")
+
+    def __init__(self):
+        self.tree = {}
+        self.series = 0
+
+    @classmethod
+    def from_series_keys(cls, keys):
+
+        topology = cls()
+        for key in keys:
+            topology.add(parse_series_key(key)[1])
+
+        return topology
+
+    def add(self, tags):
+
+        node = self.tree
+        for level in TagTopology.LEVELS:
+            node = node.setdefault(tags.get(level), {})
+        self.series += 1
+
+    def __walk(self, node, depth, conditions, path):
+
+        if depth == len(TagTopology.LEVELS):
+            yield path
+            return
+
+        allowed = conditions.get(TagTopology.LEVELS[depth])
+
+        for (value, child) in node.items():
+            if (allowed is None) or (value in allowed):
+                yield from self.__walk(child, depth + 1, conditions,
+                                       path + (value,))
+
+    def combinations(self, keys, **conditions):
+        """
+        条件に一致するシリーズのタグの値の組み合わせ
+
+        Parameters
+        ----------
+        keys : tuple
+            LEVELS のうち取り出すタグ
+        conditions : dict
+            タグ -> 値、あるいは値のリスト(いずれかに一致)
+
+        Returns
+        -------
+        combinations : set
+            keys の順の値のタプルの集合
+        """
+
+        conditions = {key: ((value,) if isinstance(value, str)
+                            else frozenset(value))
+                      for (key, value) in conditions.items()}
+        indexes = [TagTopology.LEVELS.index(key) for key in keys]
+
+        return set(tuple(path[index] for index in indexes)
+                   for path in self.__walk(self.tree, 0, conditions, ()))
+
+    def values(self, key, **conditions):
+        """
+        条件に一致するシリーズのタグの値(昇順、None は除く)
+        """
+
+        return sorted(value for (value,)
+                      in self.combinations((key,), **conditions)
+                      if value is not None)
@@ -2,8 +2,15 @@
 
 import enum
 import json
+import time
+import struct
+import binascii
+import threading
 import base64
 import gzip
+import datetime
+import functools
+import hashlib
 import dns.name
 import dns.message
 import dns.query
@@ -11,6 +18,9 @@ import dns.rdatatype
 import dns.exception
 
 from logging import getLogger
+from influxdb import line_protocol
+
+import common.net.query.wire_response as wire_response
 
 LOGGER = getLogger(__name__)
 
@@ -33,14 +43,149 @@ class AddressFamily(enum.Enum):
         return "%s" % (self.name.lower())
 
 
-class SupportedRRType(enum.IntEnum):
+# ZONEMD (RFC 8976) is unknown to dnspython 1.16. the mnemonic is registered
+# so that it can be used in the measurement info as well as the other types
+ZONEMD = 63
+if not hasattr(dns.rdatatype, "ZONEMD") and \
+        ZONEMD not in dns.rdatatype._by_value:
+    dns.rdatatype._by_text["ZONEMD"] = ZONEMD
+    dns.rdatatype._by_value[ZONEMD] = "ZONEMD"
 
-    SOA = dns.rdatatype.from_text("SOA")
-    NS = dns.rdatatype.from_text("NS")
-    DNSKEY = dns.rdatatype.from_text("DNSKEY")
+# rrtype code -> class of the measured data which has the parser
+PARSERS = {}
+# rrtype mnemonic -> the same class as above
+PARSERS_BY_NAME = {}
 
-    def __str__(self):
-        return "%s" % (self.name.lower())
+
+def register_parser(*rrtypes):
+    """
+    測定結果のクラスをrrtypeのパーサとして登録するデコレータ
+    """
+
+    def register(cls):
+        for rrtype in rrtypes:
+            rrtype_obj = dns.rdatatype.from_text(rrtype)
+            PARSERS[rrtype_obj] = cls
+            PARSERS_BY_NAME[dns.rdatatype.to_text(rrtype_obj)] = cls
+        return cls
+
+    return register
+
+
+class ParserTiming(object):
+
+    """
+    rrtype毎のパーサの呼び出し回数と所要時間(プロファイリング用)
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.stats = {}
+
+    def record(self, rrtype, elapsed):
+
+        with self.mutex:
+            stat = self.stats.get(rrtype)
+            if stat is None:
+                stat = self.stats[rrtype] = [0, 0.0]
+            stat[0] += 1
+            stat[1] += elapsed
+
+    def snapshot(self, reset=False):
+        """
+        Returns
+        -------
+        stats : dict
+            rrtype -> (呼び出し回数, 合計所要時間(秒))
+        """
+
+        with self.mutex:
+            stats = {rrtype: tuple(stat)
+                     for (rrtype, stat) in self.stats.items()}
+            if reset:
+                self.stats = {}
+
+        return stats
+
+
+PARSER_TIMING = ParserTiming()
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# tag keys of mes_dnsprobe in schema v2. the other tag keys of schema v1
+# are moved to the fields or to mes_dnsprobe_probe not to increase series
+SCHEMA_V2_TAG_KEYS = ("af", "dst_addr", "dst_name", "got_response",
+                      "prb_id", "proto", "qname", "rrtype", "slr_exceeded")
+SCHEMA_V2_TAGS_TO_FIELDS = ("error_class_name", "nsid", "src_addr")
+SCHEMA_V2_TAGS_TO_PROBE = ("prb_lat", "prb_lon")
+
+# fields whose type is not preserved by the query result in JSON
+FLOAT_FIELD_KEYS = ("time_took", "send_offset")
+INTEGER_FIELD_KEYS = ("got_response_field", "slr_exceeded_field",
+                      "id", "ttl", "serial")
+
+
+def escape_tag(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf8")
+    elif value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace(
+        " ", "\\ ").replace(",", "\\,").replace("=", "\\=")
+
+
+def escape_tag_value(value):
+    escaped = escape_tag(value)
+    if escaped.endswith("\\"):
+        escaped += " "
+    return escaped
+
+
+@functools.lru_cache(maxsize=None)
+def escape_measurement(measurement_name):
+    return escape_tag(measurement_name)
+
+
+def escape_field_value(value):
+
+    if isinstance(value, bytes):
+        value = value.decode("utf8")
+
+    if value is None:
+        return ""
+    elif isinstance(value, str):
+        if value == "":
+            return ""
+        return "\"%s\"" % (value.replace("\\", "\\\\").replace(
+            "\"", "\\\"").replace("\n", "\\n"))
+    elif isinstance(value, int) and not isinstance(value, bool):
+        return "%di" % (value)
+
+    try:
+        float(value)
+        return repr(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def convert_timestamp(string_time):
+    """
+    ISO 8601形式の時刻をline protocolのタイムスタンプ(ナノ秒)に変換する
+
+    influxdbクライアントと同じく浮動小数点数を経由して計算する
+    """
+
+    timestamp = datetime.datetime.fromisoformat(string_time)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+
+    return str(int((timestamp - EPOCH).total_seconds() * 1e9))
+
+
+def make_tag(key, value):
+    escaped = escape_tag_value(value)
+    return (key + "=" + escaped) if escaped else ""
 
 
 class InfluxDBPoints():
@@ -49,6 +194,43 @@ class InfluxDBPoints():
     InfluxDBに書き込むデータを保持するクラス
     """
 
+    __slots__ = ()
+
+    def to_line(self, measurement_name, schema_version=1):
+        # the schema has been versioned only for DNSMeasurementData
+        return line_protocol.make_lines(dict(points=[
+            self.convert_influx_notation(measurement_name)]))[:-1]
+
+
+def make_lines(measurement_name, points, schema_version=1):
+    """
+    InfluxDBPoints のリストをline protocolの行のリストに変換する
+
+    influxdbクライアントの line_protocol.make_lines と同じ行を返す
+    """
+
+    return [point.to_line(measurement_name, schema_version)
+            for point in points]
+
+
+def encode_lines(lines):
+    """
+    line protocolの行のリストをそのまま書き込めるバイト列に変換する
+    """
+
+    if not lines:
+        return b""
+
+    return ("\n".join(lines) + "\n").encode("utf8")
+
+
+def make_line_bytes(measurement_name, points, schema_version=1):
+    """
+    InfluxDBPoints のリストをそのまま書き込めるline protocolのバイト列に変換する
+    """
+
+    return encode_lines(make_lines(measurement_name, points, schema_version))
+
 
 class CalculatedSLA(InfluxDBPoints):
 
@@ -93,58 +275,172 @@ class UDP_DNS_resolution_RTT(CalculatedSLA):
         super().__init__(*positional, **kw)
 
 
-class DNSMeasurementData(InfluxDBPoints):
+class MeasurementContext(object):
 
     """
-    測定結果を保持するクラス
+    1ラウンドの測定結果に共通する値を保持するクラス
     """
 
+    __slots__ = ("current_time",
+                 "prb_id",
+                 "prb_asn",
+                 "prb_asn_desc",
+                 "server_boottime",
+                 "latitude",
+                 "longitude",
+                 "rdata_storing",
+                 "rdata_dictionary",
+                 "line_cache")
+
     def __init__(self,
                  current_time,
-                 time_diff,
-                 nameserver,
-                 dst,
-                 src,
                  prb_id,
                  prb_asn,
                  prb_asn_desc,
                  server_boottime,
                  latitude,
                  longitude,
+                 rdata_storing,
+                 rdata_dictionary=None):
+
+        self.current_time = current_time
+        self.prb_id = prb_id
+        self.prb_asn = prb_asn
+        self.prb_asn_desc = prb_asn_desc
+        self.server_boottime = server_boottime
+        self.latitude = latitude
+        self.longitude = longitude
+        self.rdata_storing = rdata_storing
+        # rdata is stored inline in each point when the dictionary is None
+        self.rdata_dictionary = rdata_dictionary
+        self.line_cache = None
+
+    def get_line_cache(self):
+        """
+        line protocolの行のうちラウンドで共通の部分を一度だけ組み立てる
+
+        Returns
+        -------
+        line_cache : tuple
+            (タイムスタンプ, エスケープ済みのタグ, エスケープ済みのフィールド,
+             エスケープ済みのprb_idタグ)
+        """
+
+        if self.line_cache is None:
+            prb_id = make_tag("prb_id", self.prb_id)
+            tags = [prb_id,
+                    make_tag("prb_lat", self.latitude),
+                    make_tag("prb_lon", self.longitude)]
+            fields = [("probe_asn", escape_field_value(self.prb_asn)),
+                      ("probe_asn_desc",
+                       escape_field_value(self.prb_asn_desc)),
+                      ("probe_uptime",
+                       escape_field_value(self.server_boottime))]
+            self.line_cache = (
+                convert_timestamp(self.current_time),
+                [tag for tag in tags if tag],
+                [(key, value) for (key, value) in fields if value],
+                prb_id)
+
+        return self.line_cache
+
+
+class DNSMeasurementData(InfluxDBPoints):
+
+    """
+    測定結果を保持するクラス
+
+    応答は受け取った時点で必要なフィールドのみを取り出して破棄する
+    """
+
+    __slots__ = ("context",
+                 "time_diff",
+                 "nameserver",
+                 "dst",
+                 "src",
+                 "af",
+                 "proto",
+                 "qname",
+                 "rrtype",
+                 "nsid",
+                 "error_class_name",
+                 "reason",
+                 "slr_exceeded",
+                 "parsed",
+                 "send_offset")
+
+    # names of the fields the parser returns, in the order stored in parsed
+    FIELD_NAMES = ()
+
+    def __init__(self,
+                 context,
+                 time_diff,
+                 nameserver,
+                 dst,
+                 src,
                  af,
                  proto,
                  qname,
                  rrtype,
                  err,
                  response,
-                 rdata_storing,
-                 slr_threshold):
+                 slr_threshold,
+                 send_offset=None):
 
-        self.current_time = current_time
+        self.context = context
         self.time_diff = time_diff
         self.nameserver = nameserver
         self.dst = dst
         self.src = src
-        self.prb_id = prb_id
-        self.prb_asn = prb_asn
-        self.prb_asn_desc = prb_asn_desc
-        self.server_boottime = server_boottime
-        self.latitude = latitude
-        self.longitude = longitude
         self.af = af
         self.proto = proto
         self.qname = qname
         self.rrtype = rrtype
-        self.err = err
-        self.response = response
-        self.rdata_storing = rdata_storing
-        self.slr_threshold = slr_threshold
+        self.nsid = "unknown"
+        self.slr_exceeded = slr_threshold < time_diff
+        # milliseconds from the beginning of the round to sending the query
+        self.send_offset = send_offset
+
+        if err:
+            self.error_class_name = err.__class__.__name__
+            self.reason = str(err)
+            self.parsed = None
+        else:
+            self.error_class_name = ""
+            self.reason = None
+            self.parsed = self.__extract_fields(response)
+
+            if isinstance(response, wire_response.WireResponse):
+                nsid = response.nsid
+                if nsid:
+                    self.nsid = nsid.decode("utf8")
+                return
+
+            for opt in response.options:
+                if opt.otype == dns.edns.NSID:
+                    self.nsid = opt.data.decode("utf8") or "unknown"
+                    break
+
+    def __extract_fields(self, response):
+
+        started_at = time.perf_counter()
+        parsed = self.__parse_response_to_fields(self.qname,
+                                                 self.rrtype,
+                                                 response)
+        PARSER_TIMING.record(self.rrtype, time.perf_counter() - started_at)
+
+        if not parsed:
+            return None
+
+        return tuple(parsed.get(name) for name in self.FIELD_NAMES)
 
     def __parse_response_to_fields(self, qname, rtype, res):
 
         try:
             qname_obj = dns.name.from_text(qname)
             rtype_obj = dns.rdatatype.from_text(rtype)
+            if isinstance(res, wire_response.WireResponse):
+                return self.wire_parser(qname_obj, rtype_obj, res)
             parsed = self.parser(qname_obj, rtype_obj, res)
             return parsed
         except Exception as ex:
@@ -167,32 +463,54 @@ class DNSMeasurementData(InfluxDBPoints):
                            python object to base64: %s" % str(ex))
             return ""
 
+    def rdata_fields(self, python_obj):
+        """
+        RDATAのダイジェストを求め、初めて現れたRDATAを辞書へ登録する
+
+        Returns
+        -------
+        fields : dict
+            data_digest(辞書を使用しない場合はdataも含む)
+        """
+
+        digest = rdata_digest(python_obj)
+        dictionary = self.context.rdata_dictionary
+
+        if dictionary is None:
+            return dict(data=self.rdata_encode(python_obj), data_digest=digest)
+
+        if not dictionary.is_known(digest):
+            dictionary.register(digest,
+                                self.rrtype,
+                                self.rdata_encode(python_obj))
+
+        return dict(data_digest=digest)
+
     def parser(self, qname_obj, rtype_obj, res):
         return {}
 
-    def convert_influx_notation(self, measurement_name):
-
-        nsid = ""
+    def wire_parser(self, qname_obj, rtype_obj, res):
+        """
+        wire形式のまま保持された応答から parser と同じフィールドを取り出す
 
-        if self.err:
-            field_data = dict(reason=str(self.err))
-            error_class_name = self.err.__class__.__name__
-        else:
-            field_data = self.__parse_response_to_fields(self.qname,
-                                                         self.rrtype,
-                                                         self.response)
-            error_class_name = ""
+        対応していないタイプは parser と同じく何も取り出さない(応答も復号しない)
+        """
+        return {}
 
-            for opt in self.response.options:
-                if opt.otype == dns.edns.NSID:
-                    nsid = opt.data.decode("utf8")
-                    break
+    def convert_influx_notation(self, measurement_name, schema_version=1):
 
-        if not nsid:
-            nsid = "unknown"
+        context = self.context
+        got_response = self.reason is None
+        slr_exceeded = self.slr_exceeded
 
-        got_response = self.err is None
-        slr_exceeded = True if self.slr_threshold < self.time_diff else False
+        if not got_response:
+            field_data = dict(reason=self.reason)
+        elif self.parsed is None:
+            field_data = {}
+        else:
+            field_data = {key: value for (key, value)
+                          in zip(self.FIELD_NAMES, self.parsed)
+                          if value is not None}
 
         field_data.update(dict(time_took=self.time_diff,
                                # following field is needed by SLA calculation.
@@ -201,35 +519,136 @@ class DNSMeasurementData(InfluxDBPoints):
                                got_response_field=(1 if got_response else 0),
                                # same above
                                slr_exceeded_field=(1 if slr_exceeded else 0),
-                               probe_uptime=self.server_boottime,
-                               probe_asn=self.prb_asn,
-                               probe_asn_desc=self.prb_asn_desc))
+                               probe_uptime=context.server_boottime,
+                               probe_asn=context.prb_asn,
+                               probe_asn_desc=context.prb_asn_desc))
+
+        if self.send_offset is not None:
+            field_data.update(dict(send_offset=self.send_offset))
+
+        if schema_version == 2:
+            field_data.update(dict(nsid=self.nsid,
+                                   src_addr=self.src,
+                                   error_class_name=self.error_class_name))
+            result = dict(measurement=measurement_name,
+                          time=context.current_time,
+                          tags=dict(af=self.af,
+                                    dst_addr=self.dst,
+                                    dst_name=self.nameserver,
+                                    prb_id=context.prb_id,
+                                    proto=self.proto,
+                                    rrtype=self.rrtype,
+                                    qname=self.qname,
+                                    got_response=got_response,
+                                    slr_exceeded=slr_exceeded),
+                          fields={key: value for (key, value)
+                                  in field_data.items()
+                                  if value not in (None, "")})
+            LOGGER.debug("result: %s" % (result))
+            return result
 
         result = dict(measurement=measurement_name,
-                      time=self.current_time,
+                      time=context.current_time,
                       tags=dict(af=self.af,
                                 dst_addr=self.dst,
                                 dst_name=self.nameserver,
-                                nsid=nsid,
+                                nsid=self.nsid,
                                 src_addr=self.src,
-                                prb_id=self.prb_id,
-                                prb_lat=self.latitude,
-                                prb_lon=self.longitude,
+                                prb_id=context.prb_id,
+                                prb_lat=context.latitude,
+                                prb_lon=context.longitude,
                                 proto=self.proto,
                                 rrtype=self.rrtype,
                                 qname=self.qname,
                                 got_response=got_response,
                                 slr_exceeded=slr_exceeded,
-                                error_class_name=error_class_name),
+                                error_class_name=self.error_class_name),
                       fields=field_data)
 
         LOGGER.debug("result: %s" % (result))
 
         return result
 
+    def to_line(self, measurement_name, schema_version=1):
+        """
+        convert_influx_notation を経由せずにline protocolの行を組み立てる
+
+        タグとフィールドは influxdbクライアントと同じくキーの昇順に並べる
+        """
+
+        timestamp, static_tags, static_fields, prb_id = \
+            self.context.get_line_cache()
+        got_response = self.reason is None
+
+        if schema_version == 2:
+            tags = [escape_measurement(measurement_name),
+                    make_tag("af", self.af),
+                    make_tag("dst_addr", self.dst),
+                    make_tag("dst_name", self.nameserver),
+                    make_tag("got_response", got_response),
+                    prb_id,
+                    make_tag("proto", self.proto),
+                    make_tag("qname", self.qname),
+                    make_tag("rrtype", self.rrtype),
+                    make_tag("slr_exceeded", self.slr_exceeded)]
+            static_fields = static_fields + [
+                ("error_class_name",
+                 escape_field_value(self.error_class_name)),
+                ("nsid", escape_field_value(self.nsid)),
+                ("src_addr", escape_field_value(self.src))]
+            return self.__make_line(tags, static_fields, timestamp)
+
+        tags = [escape_measurement(measurement_name),
+                make_tag("af", self.af),
+                make_tag("dst_addr", self.dst),
+                make_tag("dst_name", self.nameserver),
+                make_tag("error_class_name", self.error_class_name),
+                make_tag("got_response", got_response),
+                make_tag("nsid", self.nsid)]
+        tags.extend(static_tags)
+        tags.extend((make_tag("proto", self.proto),
+                     make_tag("qname", self.qname),
+                     make_tag("rrtype", self.rrtype),
+                     make_tag("slr_exceeded", self.slr_exceeded),
+                     make_tag("src_addr", self.src)))
+
+        return self.__make_line(tags, static_fields, timestamp)
+
+    def __make_line(self, tags, static_fields, timestamp):
+
+        got_response = self.reason is None
+
+        if not got_response:
+            fields = [("reason", self.reason)]
+        elif self.parsed is None:
+            fields = []
+        else:
+            fields = list(zip(self.FIELD_NAMES, self.parsed))
+
+        fields.extend((("time_took", self.time_diff),
+                       ("got_response_field", 1 if got_response else 0),
+                       ("slr_exceeded_field", 1 if self.slr_exceeded else 0)))
+
+        if self.send_offset is not None:
+            fields.append(("send_offset", self.send_offset))
 
+        escaped = [(key, escape_field_value(value)) for (key, value) in fields]
+        escaped.extend(static_fields)
+        escaped.sort()
+
+        return "%s %s %s" % (",".join(tag for tag in tags if tag),
+                             ",".join(key + "=" + value
+                                      for (key, value) in escaped if value),
+                             timestamp)
+
+
+@register_parser("SOA")
 class SOA_DNSMeasurementData(DNSMeasurementData):
 
+    __slots__ = ()
+
+    FIELD_NAMES = ("id", "ttl", "name", "mname", "rname", "serial", "type")
+
     def __init__(self, *positional, **kw):
         super().__init__(*positional, **kw)
 
@@ -254,12 +673,48 @@ class SOA_DNSMeasurementData(DNSMeasurementData):
 
         return result
 
+    def wire_parser(self, qname_obj, rtype_obj, res):
+
+        records = res.get_answer(
+            wire_response.lower_labels(qname_obj.labels[:-1]), rtype_obj)
+
+        if not records:
+            return {}
+
+        record = records[0]
+        mname, rname, serial = res.soa(record)[:3]
+
+        result = dict(id=res.id,
+                      ttl=min(each.ttl for each in records),
+                      name=wire_response.name_to_text(record.labels),
+                      mname=wire_response.name_to_text(mname),
+                      rname=wire_response.name_to_text(rname),
+                      serial=serial,
+                      type=dns.rdatatype.to_text(rtype_obj))
+
+        return result
+
+
+class RRset_DNSMeasurementData(DNSMeasurementData):
+
+    """
+    RRset全体をRDATAとして保持する測定結果のクラス
+    """
+
+    __slots__ = ()
+
+    FIELD_NAMES = ("id", "ttl", "name", "data", "data_digest", "type")
 
-class NS_DNSMeasurementData(DNSMeasurementData):
+    # digest of the answer in wire format -> python object of the rdata
+    rdata_cache = {}
+    rdata_cache_size = 4096
 
     def __init__(self, *positional, **kw):
         super().__init__(*positional, **kw)
 
+    def rdata_object(self, rrset):
+        return []
+
     def parser(self, qname_obj, rtype_obj, res):
 
         rrset = res.get_rrset(res.answer,
@@ -270,109 +725,361 @@ class NS_DNSMeasurementData(DNSMeasurementData):
         if (rrset is None) or (len(rrset) == 0):
             return {}
 
-        data = sorted([record.target.to_text()
-                       for record in rrset])
-
         result = dict(id=res.id,
                       ttl=rrset.ttl,
                       name=str(rrset.name),
-                      data=self.rdata_encode(data),
                       type=dns.rdatatype.to_text(rtype_obj))
+        result.update(self.rdata_fields(self.rdata_object(rrset)))
 
         return result
 
+    def wire_parser(self, qname_obj, rtype_obj, res):
+
+        records = res.get_answer(
+            wire_response.lower_labels(qname_obj.labels[:-1]), rtype_obj)
+
+        if not records:
+            return {}
+
+        # the same answer is decoded by dnspython only for the first time
+        key = (self.__class__,
+               bool(self.context.rdata_storing.save_dnskey),
+               res.answer_digest(records))
+        python_obj = RRset_DNSMeasurementData.rdata_cache.get(key)
+
+        if python_obj is None:
+            message = res.message
+            python_obj = self.rdata_object(
+                message.get_rrset(message.answer,
+                                  qname_obj,
+                                  dns.rdataclass.IN,
+                                  rtype_obj))
+            if RRset_DNSMeasurementData.rdata_cache_size <= \
+                    len(RRset_DNSMeasurementData.rdata_cache):
+                RRset_DNSMeasurementData.rdata_cache.clear()
+            RRset_DNSMeasurementData.rdata_cache[key] = python_obj
 
-class DNSKEY_DNSMeasurementData(DNSMeasurementData):
+        result = dict(id=res.id,
+                      ttl=min(each.ttl for each in records),
+                      name=wire_response.name_to_text(records[0].labels),
+                      type=dns.rdatatype.to_text(rtype_obj))
+        result.update(self.rdata_fields(python_obj))
+
+        return result
+
+
+@register_parser("NS")
+class NS_DNSMeasurementData(RRset_DNSMeasurementData):
+
+    __slots__ = ()
 
     def __init__(self, *positional, **kw):
         super().__init__(*positional, **kw)
 
-    def parser(self, qname_obj, rtype_obj, res):
+    def rdata_object(self, rrset):
+        return sorted([record.target.to_text()
+                       for record in rrset])
 
-        rrset = res.get_rrset(res.answer,
-                              qname_obj,
-                              dns.rdataclass.IN,
-                              rtype_obj)
 
-        if (rrset is None) or (len(rrset) == 0):
-            return {}
+@register_parser("DNSKEY")
+class DNSKEY_DNSMeasurementData(RRset_DNSMeasurementData):
+
+    __slots__ = ()
+
+    def __init__(self, *positional, **kw):
+        super().__init__(*positional, **kw)
+
+    def rdata_object(self, rrset):
 
         data = []
         for record in rrset:
             base = dict(flags=record.flags,
                         algorithm=record.algorithm)
-            if self.rdata_storing.save_dnskey:
+            if self.context.rdata_storing.save_dnskey:
                 base.update(dict(
                     key=base64.b64encode(record.key).decode("utf8")))
             data.append(base)
 
-        data = sorted(data, key=((lambda x: x["key"])
-                                 if self.rdata_storing.save_dnskey
+        return sorted(data, key=((lambda x: x["key"])
+                                 if self.context.rdata_storing.save_dnskey
                                  else (lambda x: x["flags"])))
 
-        result = dict(id=res.id,
-                      ttl=rrset.ttl,
-                      name=str(rrset.name),
-                      data=self.rdata_encode(data),
-                      type=dns.rdatatype.to_text(rtype_obj))
+
+@register_parser("A", "AAAA")
+class Address_DNSMeasurementData(RRset_DNSMeasurementData):
+
+    __slots__ = ()
+
+    def __init__(self, *positional, **kw):
+        super().__init__(*positional, **kw)
+
+    def rdata_object(self, rrset):
+        return sorted([record.address for record in rrset])
+
+
+@register_parser("DS")
+class DS_DNSMeasurementData(RRset_DNSMeasurementData):
+
+    __slots__ = ()
+
+    def __init__(self, *positional, **kw):
+        super().__init__(*positional, **kw)
+
+    def rdata_object(self, rrset):
+
+        data = [dict(key_tag=record.key_tag,
+                     algorithm=record.algorithm,
+                     digest_type=record.digest_type,
+                     digest=binascii.hexlify(record.digest).decode("utf8"))
+                for record in rrset]
+
+        return sorted(data, key=lambda x: (x["key_tag"], x["digest_type"],
+                                           x["digest"]))
+
+
+@register_parser("TXT")
+class TXT_DNSMeasurementData(RRset_DNSMeasurementData):
+
+    __slots__ = ()
+
+    def __init__(self, *positional, **kw):
+        super().__init__(*positional, **kw)
+
+    def rdata_object(self, rrset):
+        return sorted([[string.decode("utf8", "backslashreplace")
+                        for string in record.strings]
+                       for record in rrset])
+
+
+@register_parser("ZONEMD")
+class ZONEMD_DNSMeasurementData(RRset_DNSMeasurementData):
+
+    __slots__ = ()
+
+    def __init__(self, *positional, **kw):
+        super().__init__(*positional, **kw)
+
+    def rdata_object(self, rrset):
+
+        data = []
+        for record in rrset:
+            # dnspython 1.16 has no class for ZONEMD. read the wire format
+            rdata = record.to_digestable()
+            serial, scheme, hash_algorithm = struct.unpack_from("!IBB", rdata)
+            data.append(dict(serial=serial,
+                             scheme=scheme,
+                             hash_algorithm=hash_algorithm,
+                             digest=binascii.hexlify(rdata[6:]).decode(
+                                 "utf8")))
+
+        return sorted(data, key=lambda x: (x["scheme"], x["hash_algorithm"],
+                                           x["digest"]))
+
+
+class DNSProbe(InfluxDBPoints):
+
+    """
+    プローブの位置(スキーマv2で mes_dnsprobe のタグから移したもの)
+    """
+
+    __slots__ = ("current_time", "prb_id", "latitude", "longitude")
+
+    def __init__(self, current_time, prb_id, latitude, longitude):
+        self.current_time = current_time
+        self.prb_id = prb_id
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def convert_influx_notation(self, measurement_name):
+
+        result = dict(measurement=measurement_name,
+                      time=self.current_time,
+                      tags=dict(prb_id=self.prb_id),
+                      fields=dict(prb_lat=self.latitude,
+                                  prb_lon=self.longitude))
 
         return result
 
 
-def make_DNSMeasurementData(current_time,
+class DNSProbeHeartbeat(DNSProbe):
+
+    """
+    測定ラウンドの終わりに書き込むプローブの状態
+
+    位置と同じ mes_dnsprobe_probe に書き込み、プローブの一覧として読み出す
+    """
+
+    __slots__ = ("boot_time", "net_desc_v4", "net_desc_v6",
+                 "round_duration", "point_count")
+
+    def __init__(self, current_time, prb_id, latitude, longitude, boot_time,
+                 net_desc_v4, net_desc_v6, round_duration, point_count):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        net_desc_v4 : tuple
+            IPv4アドレスの (ASN, ASの説明)
+        net_desc_v6 : tuple
+            IPv6アドレスの (ASN, ASの説明)
+        round_duration : float
+            ラウンドに要した秒数
+        point_count : int
+            ラウンドで測定した点の数
+        """
+
+        super().__init__(current_time, prb_id, latitude, longitude)
+        self.boot_time = boot_time
+        self.net_desc_v4 = net_desc_v4
+        self.net_desc_v6 = net_desc_v6
+        self.round_duration = round_duration
+        self.point_count = point_count
+
+    def convert_influx_notation(self, measurement_name):
+
+        result = super().convert_influx_notation(measurement_name)
+
+        result["fields"].update(boot_time=self.boot_time,
+                                asn_v4=str(self.net_desc_v4[0]),
+                                asn_desc_v4=str(self.net_desc_v4[1]),
+                                asn_v6=str(self.net_desc_v6[0]),
+                                asn_desc_v6=str(self.net_desc_v6[1]),
+                                round_duration=round(self.round_duration, 3),
+                                point_count=int(self.point_count))
+
+        return result
+
+
+class MigratedDNSMeasurementData(InfluxDBPoints):
+
+    """
+    スキーマv1の mes_dnsprobe から読み出した1点をスキーマv2で書き込むクラス
+    """
+
+    __slots__ = ("timestamp", "tags", "fields")
+
+    def __init__(self, timestamp, tags, fields):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        timestamp : int
+            ナノ秒単位のタイムスタンプ
+        tags : dict
+            スキーマv1のタグ
+        fields : dict
+            スキーマv1のフィールド
+        """
+
+        self.timestamp = timestamp
+        self.tags = tags
+        self.fields = fields
+
+    def convert_influx_notation(self, measurement_name):
+
+        fields = {}
+        for (key, value) in self.fields.items():
+            if value is None:
+                continue
+            # integral float is returned as an integer in JSON
+            if key in FLOAT_FIELD_KEYS:
+                value = float(value)
+            elif key in INTEGER_FIELD_KEYS:
+                value = int(value)
+            fields[key] = value
+
+        for key in SCHEMA_V2_TAGS_TO_FIELDS:
+            if self.tags.get(key):
+                fields[key] = self.tags[key]
+
+        result = dict(measurement=measurement_name,
+                      time=self.timestamp,
+                      tags={key: self.tags[key]
+                            for key in SCHEMA_V2_TAG_KEYS
+                            if self.tags.get(key)},
+                      fields=fields)
+
+        return result
+
+
+class DNSRdata(InfluxDBPoints):
+
+    """
+    ダイジェストで参照されるRDATAを保持するクラス
+    """
+
+    __slots__ = ("current_time", "digest", "rrtype", "blob")
+
+    def __init__(self, current_time, digest, rrtype, blob):
+        self.current_time = current_time
+        self.digest = digest
+        self.rrtype = rrtype
+        self.blob = blob
+
+    def convert_influx_notation(self, measurement_name):
+
+        result = dict(measurement=measurement_name,
+                      time=self.current_time,
+                      tags=dict(digest=self.digest,
+                                rrtype=self.rrtype),
+                      fields=dict(data=self.blob))
+
+        return result
+
+
+def rdata_digest(python_obj):
+    """
+    RDATAのダイジェスト(SHA-256の先頭64bit)を求める
+    """
+
+    json_string = json.dumps(python_obj)
+
+    return hashlib.sha256(json_string.encode("utf8")).hexdigest()[:16]
+
+
+def rdata_decode(blob):
+    """
+    rdata_encode で符号化したRDATAを復号する
+    """
+
+    return json.loads(gzip.decompress(base64.b64decode(blob)).decode("utf8"))
+
+
+def make_DNSMeasurementData(context,
                             time_diff,
                             nameserver,
                             dst,
                             src,
-                            measurer_id,
-                            asn,
-                            asn_desc,
-                            server_boottime,
-                            latitude,
-                            longitude,
                             af,
                             proto,
                             qname,
                             rrtype,
                             err,
                             response,
-                            rdata_storing,
-                            slr_threshold):
-
-    constractors = {SupportedRRType.SOA: SOA_DNSMeasurementData,
-                    SupportedRRType.NS: NS_DNSMeasurementData,
-                    SupportedRRType.DNSKEY: DNSKEY_DNSMeasurementData}
-
-    args = (current_time,
-            time_diff,
-            nameserver,
-            dst,
-            src,
-            measurer_id,
-            asn,
-            asn_desc,
-            server_boottime,
-            latitude,
-            longitude,
-            af,
-            proto,
-            qname,
-            rrtype,
-            err,
-            response,
-            rdata_storing,
-            slr_threshold)
-
-    rrtype_obj = dns.rdatatype.from_text(rrtype)
-
-    default = DNSMeasurementData(*args)
-    try:
-        target = SupportedRRType(rrtype_obj)
-        for supported in SupportedRRType:
-            if supported == target:
-                LOGGER.debug("parser class found for %s" % (str(rrtype)))
-                return constractors[target](*args)
-    except ValueError:
-        LOGGER.warning("unsupported RR type for parsing: %s" % (rrtype))
-    LOGGER.debug("parser class NOT found for %s" % (str(rrtype)))
-    return default
+                            slr_threshold,
+                            send_offset=None):
+
+    target = PARSERS_BY_NAME.get(rrtype)
+
+    if target is None:
+        # e.g. lower case or generic notation like TYPE63
+        target = PARSERS.get(dns.rdatatype.from_text(rrtype))
+        if target is None:
+            LOGGER.warning("unsupported RR type for parsing: %s" % (rrtype))
+            target = DNSMeasurementData
+
+    return target(context,
+                  time_diff,
+                  nameserver,
+                  dst,
+                  src,
+                  af,
+                  proto,
+                  qname,
+                  rrtype,
+                  err,
+                  response,
+                  slr_threshold,
+                  send_offset)
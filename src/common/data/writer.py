@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import queue
+import threading
+import time
+
+from logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+
+class StreamingWriter(threading.Thread):
+
+    """
+    測定の完了した順に受け取った line protocol の行を、
+    件数もしくは時間で区切ったマイクロバッチとしてバックグラウンドで書き込む
+    """
+
+    __STOP = object()
+
+    def __init__(self, write, batch_size, flush_interval):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        write : callable
+            line protocolの行のリストを受け取り、書き込みの成否を返す
+        batch_size : int
+            この行数が溜まった時点で書き込む
+        flush_interval : float
+            最後の書き込みからこの秒数が経過した時点で書き込む
+        """
+
+        super().__init__(name="streaming-writer", daemon=True)
+        self.write = write
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.queue = queue.Queue()
+        self.written_lines = 0
+        self.failed_lines = 0
+
+    def put(self, lines):
+        self.queue.put(lines)
+
+    def flush(self, buffer):
+
+        if not buffer:
+            return
+
+        try:
+            ret = self.write(buffer)
+        except Exception as ex:
+            LOGGER.warning("unexpected error while writing: %s" % str(ex))
+            ret = False
+
+        if ret:
+            self.written_lines += len(buffer)
+        else:
+            self.failed_lines += len(buffer)
+
+    def run(self):
+
+        buffer = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+
+            try:
+                lines = self.queue.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                lines = []
+
+            if lines is StreamingWriter.__STOP:
+                self.flush(buffer)
+                break
+
+            buffer.extend(lines)
+
+            if (len(buffer) >= self.batch_size) or \
+                    (deadline <= time.monotonic()):
+                self.flush(buffer)
+                buffer = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def close(self):
+        """
+        残りの行を書き込んでスレッドを終了する
+
+        Returns
+        -------
+        succeeded : bool
+            全ての行を書き込めた場合に True
+        """
+
+        self.queue.put(StreamingWriter.__STOP)
+        self.join()
+
+        LOGGER.info("%d lines written, %d lines failed" %
+                    (self.written_lines, self.failed_lines))
+
+        return self.failed_lines == 0
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+import time
+import asyncio
+import struct
+import dns.message
+import dns.query
+import dns.exception
+
+from logging import getLogger
+
+import common.net.query.wire_response as wire_response
+
+LOGGER = getLogger(__name__)
+
+
+class _UDPQueryProtocol(asyncio.DatagramProtocol):
+
+    """
+    1クエリ分の応答を待ち受けるDatagramProtocol
+    """
+
+    def __init__(self, future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result((data, time.time()))
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+    def connection_lost(self, exc):
+        if (exc is not None) and (not self.future.done()):
+            self.future.set_exception(exc)
+
+
+def make_response(q, wire, lazy):
+
+    if lazy:
+        return wire_response.WireResponse(wire)
+
+    return dns.message.from_wire(wire,
+                                 keyring=q.keyring,
+                                 request_mac=q.mac)
+
+
+async def udp(q, where, timeout=None, port=53, source=None, source_port=0,
+              lazy=False):
+    """
+    dns.query.udp と同等の問い合わせをイベントループ上で行う
+
+    Parameters
+    ----------
+    q : dns.message.Message
+        送信するクエリ
+    where : str
+        問い合わせ先のIPアドレス
+    timeout : float
+        タイムアウト(秒)
+    lazy : bool
+        応答を復号せずに wire_response.WireResponse として返す
+
+    Returns
+    -------
+    response : dns.message.Message
+        応答メッセージ
+    """
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    local_addr = None if source is None else (source, source_port)
+
+    try:
+        transport, _ = await asyncio.wait_for(
+            loop.create_datagram_endpoint(
+                lambda: _UDPQueryProtocol(future),
+                local_addr=local_addr,
+                remote_addr=(where, port)),
+            timeout)
+    except asyncio.TimeoutError:
+        raise dns.exception.Timeout
+
+    try:
+        sent_time = time.time()
+        transport.sendto(q.to_wire())
+        wire, received_time = await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        raise dns.exception.Timeout
+    finally:
+        transport.close()
+
+    response = make_response(q, wire, lazy)
+
+    if not q.is_response(response):
+        raise dns.query.BadResponse
+
+    # same as dns.query.udp
+    response.time = received_time - sent_time
+
+    return response
+
+
+async def tcp(q, where, timeout=None, port=53, source=None, source_port=0,
+              lazy=False):
+    """
+    dns.query.tcp と同等の問い合わせをイベントループ上で行う
+
+    Parameters
+    ----------
+    q : dns.message.Message
+        送信するクエリ
+    where : str
+        問い合わせ先のIPアドレス
+    timeout : float
+        タイムアウト(秒)
+    lazy : bool
+        応答を復号せずに wire_response.WireResponse として返す
+
+    Returns
+    -------
+    response : dns.message.Message
+        応答メッセージ
+    """
+
+    try:
+        return await asyncio.wait_for(
+            _tcp_core(q, where, port, source, source_port, lazy), timeout)
+    except asyncio.TimeoutError:
+        raise dns.exception.Timeout
+
+
+async def _tcp_core(q, where, port, source, source_port, lazy):
+
+    begin_time = time.time()
+    local_addr = None if source is None else (source, source_port)
+    reader, writer = await asyncio.open_connection(where,
+                                                   port,
+                                                   local_addr=local_addr)
+
+    try:
+        wire = q.to_wire()
+        writer.write(struct.pack("!H", len(wire)) + wire)
+        await writer.drain()
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+        response_wire = await reader.readexactly(length)
+        received_time = time.time()
+    finally:
+        writer.close()
+
+    response = make_response(q, response_wire, lazy)
+
+    if not q.is_response(response):
+        raise dns.query.BadResponse
+
+    # same as dns.query.tcp, the connection setup is included
+    response.time = received_time - begin_time
+
+    return response
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+import asyncio
+import ipaddress
+import random
+import struct
+import time
+import dns.exception
+
+from logging import getLogger
+
+import common.net.query.aio_query as aio_query
+
+LOGGER = getLogger(__name__)
+
+
+class _MultiplexedUDPProtocol(asyncio.DatagramProtocol):
+
+    """
+    共有ソケットで受信した応答を、問い合わせ中のクエリへ振り分ける
+    """
+
+    def __init__(self, lazy=False):
+        self.lazy = lazy
+        self.transport = None
+        # (message id, destination address, destination port) -> (query, future)
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+
+        received_time = time.time()
+
+        if len(data) < 12:
+            LOGGER.debug("too short datagram from %s" % str(addr))
+            return
+
+        (qid,) = struct.unpack("!H", data[:2])
+        key = (qid, _normalize_address(addr[0]), addr[1])
+
+        if key not in self.pending:
+            LOGGER.debug("unexpected response from %s id=%d" %
+                         (str(addr), qid))
+            return
+
+        q, future = self.pending[key]
+
+        if future.done():
+            return
+
+        try:
+            response = aio_query.make_response(q, data, self.lazy)
+        except Exception as ex:
+            LOGGER.debug("undecodable response from %s: %s" %
+                         (str(addr), str(ex)))
+            return
+
+        # message id and source address matched but the question did not.
+        # it may be spoofed or stale one, so keep waiting for the real one
+        if not q.is_response(response):
+            LOGGER.debug("mismatched response from %s id=%d" %
+                         (str(addr), qid))
+            return
+
+        future.set_result((response, received_time))
+
+    def error_received(self, exc):
+        LOGGER.debug("error received on shared socket: %s" % str(exc))
+
+
+def _normalize_address(address):
+    return ipaddress.ip_address(address.split("%")[0]).compressed
+
+
+class MultiplexedUDPQueryer(object):
+
+    """
+    送信元アドレス毎に事前にbindしたソケットを共有し、
+    全てのUDPクエリをそれらのソケット経由で送受信する
+
+    応答は (message id, 送信元アドレス, question) で問い合わせに対応付ける
+    """
+
+    def __init__(self, port_pool_size=1, id_retry=16, lazy=False):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        port_pool_size : int
+            送信元アドレス毎に用意するソケット(送信元ポート)の数
+        id_retry : int
+            使用中のmessage idと衝突した際に再抽選する回数
+        lazy : bool
+            応答を復号せずに wire_response.WireResponse として返す
+        """
+
+        self.lazy = lazy
+        self.port_pool_size = max(1, int(port_pool_size))
+        self.id_retry = max(1, int(id_retry))
+        self.random = random.SystemRandom()
+        self.pools = {}
+        self.pool_mutex = None
+
+    async def open(self, source):
+        """
+        sourceにbindしたソケットを用意する(用意済みであれば何もしない)
+        """
+
+        if self.pool_mutex is None:
+            self.pool_mutex = asyncio.Lock()
+
+        async with self.pool_mutex:
+
+            if source in self.pools:
+                return self.pools[source]
+
+            loop = asyncio.get_running_loop()
+            pool = []
+
+            for _ in range(self.port_pool_size):
+                transport, protocol = await loop.create_datagram_endpoint(
+                    lambda: _MultiplexedUDPProtocol(self.lazy),
+                    local_addr=(source, 0))
+                pool.append(protocol)
+                LOGGER.debug("shared socket opened on %s" %
+                             str(transport.get_extra_info("sockname")))
+
+            self.pools[source] = pool
+
+            return pool
+
+    def retain(self, sources):
+        """
+        sources に含まれない送信元アドレスのソケットを閉じる
+        """
+
+        for source in list(self.pools.keys()):
+            if source not in sources:
+                self.close(source)
+
+    def close(self, source=None):
+
+        targets = list(self.pools.keys()) if source is None else [source]
+
+        for target in targets:
+            for protocol in self.pools.pop(target, []):
+                if protocol.transport is not None:
+                    protocol.transport.close()
+                    LOGGER.debug("shared socket closed on %s" % (target))
+
+    def allocate(self, pool, where, port):
+
+        for _ in range(self.id_retry):
+            protocol = self.random.choice(pool)
+            qid = self.random.randint(0, 0xFFFF)
+            key = (qid, where, port)
+            if key not in protocol.pending:
+                return protocol, qid, key
+
+        raise dns.exception.DNSException("unable to allocate message id")
+
+    async def udp(self, q, where, timeout=None, port=53, source=None):
+        """
+        dns.query.udp と同等の問い合わせを共有ソケット経由で行う
+
+        Parameters
+        ----------
+        q : dns.message.Message
+            送信するクエリ(message idは送信時に払い出した値で上書きされる)
+        where : str
+            問い合わせ先のIPアドレス
+        timeout : float
+            タイムアウト(秒)
+
+        Returns
+        -------
+        response : dns.message.Message
+            応答メッセージ
+        """
+
+        pool = self.pools.get(source)
+        if pool is None:
+            pool = await self.open(source)
+
+        where = _normalize_address(where)
+        protocol, qid, key = self.allocate(pool, where, port)
+
+        q.id = qid
+        future = asyncio.get_running_loop().create_future()
+        protocol.pending[key] = (q, future)
+
+        try:
+            sent_time = time.time()
+            protocol.transport.sendto(q.to_wire(), (where, port))
+            response, received_time = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout
+        finally:
+            del protocol.pending[key]
+
+        response.time = received_time - sent_time
+
+        return response
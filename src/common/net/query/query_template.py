@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import struct
+import dns.name
+import dns.message
+import dns.rdatatype
+import dns.edns
+import dns.entropy
+import dns.flags
+import dns.opcode
+import dns.rcode
+
+from logging import getLogger
+
+import common.net.query.wire_response as wire_response
+
+LOGGER = getLogger(__name__)
+
+NSID_OPTIONS = ((dns.edns.NSID, bytes()),)
+
+
+class QueryTemplate(object):
+
+    """
+    (qname, rrtype, edns options) 毎に一度だけ組み立てたクエリのwire形式を保持する
+    """
+
+    def __init__(self, qname, rrtype, edns=0, options=NSID_OPTIONS):
+
+        qname_obj = dns.name.from_text(qname)
+        rrtype_obj = dns.rdatatype.from_text(rrtype)
+
+        message = dns.message.make_query(qname_obj,
+                                         rrtype_obj,
+                                         use_edns=True)
+        message.flags &= 0xFEFF
+        message.use_edns(edns=edns,
+                         options=[dns.edns.GenericOption(otype, data)
+                                  for (otype, data) in options])
+
+        self.message = message
+        self.opcode = dns.opcode.from_flags(message.flags)
+        self.question = set((wire_response.lower_labels(rrset.name.labels[:-1]),
+                             rrset.rdtype,
+                             rrset.rdclass)
+                            for rrset in message.question)
+        # everything except the message id
+        self.wire_without_id = message.to_wire()[2:]
+
+    def make_wire(self, qid):
+        return struct.pack("!H", qid) + self.wire_without_id
+
+    def make_query(self):
+        return PreparedQuery(self, dns.entropy.random_16())
+
+
+class PreparedQuery(object):
+
+    """
+    QueryTemplate にmessage idのみを与えたクエリ
+
+    dns.query.udp/tcp などが参照する dns.message.Message の属性のみを持つ
+    """
+
+    __slots__ = ("template", "id")
+
+    keyring = None
+    mac = b""
+
+    def __init__(self, template, qid):
+        self.template = template
+        self.id = qid
+
+    def to_wire(self):
+        return self.template.make_wire(self.id)
+
+    def is_response(self, other):
+
+        if isinstance(other, wire_response.WireResponse):
+            return self.is_wire_response(other)
+
+        message = self.template.message
+
+        if other.flags & dns.flags.QR == 0 or \
+           self.id != other.id or \
+           self.template.opcode != dns.opcode.from_flags(other.flags):
+            return False
+        if dns.rcode.from_flags(other.flags, other.ednsflags) != \
+                dns.rcode.NOERROR:
+            return True
+        for n in message.question:
+            if n not in other.question:
+                return False
+        for n in other.question:
+            if n not in message.question:
+                return False
+        return True
+
+    def is_wire_response(self, other):
+
+        if other.flags & dns.flags.QR == 0 or \
+           self.id != other.id or \
+           self.template.opcode != other.opcode():
+            return False
+        if other.rcode() != dns.rcode.NOERROR:
+            return True
+        return set(other.question) == self.template.question
+
+
+class QueryTemplateCache(object):
+
+    """
+    QueryTemplate のキャッシュ
+
+    デーモンモードでは測定ラウンドをまたいで保持される
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, qname, rrtype, edns=0, options=NSID_OPTIONS):
+
+        key = (qname, rrtype, edns, options)
+        template = self.templates.get(key)
+
+        if template is None:
+            self.misses += 1
+            template = QueryTemplate(qname, rrtype, edns, options)
+            self.templates[key] = template
+            LOGGER.debug("query template created for %s" % str(key))
+        else:
+            self.hits += 1
+
+        return template
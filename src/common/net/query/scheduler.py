@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import asyncio
+import collections
+import contextlib
+import random
+import threading
+import time
+
+from logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+
+def spread_evenly(tasks, key, spread, jitter=0.0, rand=random):
+    """
+    1ラウンド分のタスクに送信時刻のオフセットを割り当てる
+
+    同じ宛先へのタスクが連続しないよう宛先毎にラウンドロビンで並べ替え、
+    spread 秒の間に等間隔(jitter 指定時はスロット内でランダム)に配置する
+
+    Parameters
+    ----------
+    tasks : iterable
+        タスク
+    key : callable
+        タスクから宛先を取り出す
+    spread : float
+        タスクを分散させる秒数。0 以下の場合は全てオフセット 0 となる
+    jitter : float
+        スロット幅に対するゆらぎの割合(0 から 1)
+
+    Returns
+    -------
+    scheduled : list
+        (オフセット(秒), タスク) のリスト。オフセットの昇順
+    """
+
+    queues = collections.OrderedDict()
+    for task in tasks:
+        queues.setdefault(key(task), collections.deque()).append(task)
+
+    interleaved = []
+    while queues:
+        for destination in list(queues.keys()):
+            interleaved.append(queues[destination].popleft())
+            if not queues[destination]:
+                del queues[destination]
+
+    if (spread <= 0) or (not interleaved):
+        return [(0.0, task) for task in interleaved]
+
+    slot = spread / len(interleaved)
+    jitter = min(max(jitter, 0.0), 1.0)
+
+    return [(slot * (n + jitter * rand.random()), task)
+            for (n, task) in enumerate(interleaved)]
+
+
+class DestinationPacer(object):
+
+    """
+    宛先アドレス毎の同時問い合わせ数と秒間問い合わせ数を制限する(スレッド用)
+    """
+
+    def __init__(self, max_concurrent=0, max_per_second=0):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        max_concurrent : int
+            宛先毎の同時問い合わせ数の上限。0 は無制限
+        max_per_second : float
+            宛先毎の秒間問い合わせ数の上限。0 は無制限
+        """
+
+        self.max_concurrent = int(max_concurrent)
+        self.interval = (1.0 / max_per_second) if max_per_second > 0 else 0
+        self.mutex = threading.Lock()
+        self.semaphores = {}
+        self.next_slot = {}
+
+    def make_semaphore(self):
+        return threading.BoundedSemaphore(self.max_concurrent)
+
+    def semaphore(self, destination):
+
+        if self.max_concurrent <= 0:
+            return contextlib.nullcontext()
+
+        with self.mutex:
+            if destination not in self.semaphores:
+                self.semaphores[destination] = self.make_semaphore()
+            return self.semaphores[destination]
+
+    def reserve(self, destination):
+        """
+        宛先への次の送信枠を予約し、その時刻までの待ち時間(秒)を返す
+        """
+
+        if self.interval <= 0:
+            return 0
+
+        with self.mutex:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(destination, now))
+            self.next_slot[destination] = slot + self.interval
+
+        return slot - now
+
+    @contextlib.contextmanager
+    def pace(self, destination):
+        with self.semaphore(destination):
+            delay = self.reserve(destination)
+            if delay > 0:
+                time.sleep(delay)
+            yield
+
+
+class AsyncDestinationPacer(DestinationPacer):
+
+    """
+    DestinationPacer のイベントループ用
+    """
+
+    def make_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrent)
+
+    @contextlib.asynccontextmanager
+    async def pace(self, destination):
+        async with self.semaphore(destination):
+            delay = self.reserve(destination)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import socket
+import struct
+import time
+import dns.inet
+import dns.query
+import dns.exception
+
+from logging import getLogger
+
+import common.net.query.wire_response as wire_response
+
+LOGGER = getLogger(__name__)
+
+# helpers of the pinned dnspython(1.16) are reused so that the timeout and
+# the address handling behave exactly as dns.query.udp/tcp
+
+
+def udp(q, where, timeout=None, port=53, source=None, source_port=0):
+    """
+    dns.query.udp と同等の問い合わせを行い、応答を復号せずに返す
+
+    Parameters
+    ----------
+    q : dns.message.Message
+        送信するクエリ
+    where : str
+        問い合わせ先のIPアドレス
+    timeout : float
+        タイムアウト(秒)
+
+    Returns
+    -------
+    response : wire_response.WireResponse
+        応答
+    """
+
+    wire = q.to_wire()
+    (af, destination, source) = dns.query._destination_and_source(
+        None, where, port, source, source_port)
+
+    with socket.socket(af, socket.SOCK_DGRAM, 0) as sock:
+
+        expiration = dns.query._compute_expiration(timeout)
+        sock.setblocking(0)
+        if source is not None:
+            sock.bind(source)
+
+        (_, sent_time) = dns.query.send_udp(sock, wire, destination,
+                                            expiration)
+
+        while True:
+            dns.query._wait_for_readable(sock, expiration)
+            (response_wire, from_address) = sock.recvfrom(65535)
+            if dns.query._addresses_equal(af, from_address, destination):
+                break
+            raise dns.query.UnexpectedSource(
+                "got a response from %s instead of %s" %
+                (from_address, destination))
+
+        received_time = time.time()
+
+    response = wire_response.WireResponse(response_wire)
+    response.time = received_time - sent_time
+
+    if not q.is_response(response):
+        raise dns.query.BadResponse
+
+    return response
+
+
+def tcp(q, where, timeout=None, port=53, source=None, source_port=0):
+    """
+    dns.query.tcp と同等の問い合わせを行い、応答を復号せずに返す
+    """
+
+    wire = q.to_wire()
+    (af, destination, source) = dns.query._destination_and_source(
+        None, where, port, source, source_port)
+
+    with socket.socket(af, socket.SOCK_STREAM, 0) as sock:
+
+        expiration = dns.query._compute_expiration(timeout)
+        sock.setblocking(0)
+        begin_time = time.time()
+        if source is not None:
+            sock.bind(source)
+
+        dns.query._connect(sock, destination)
+        dns.query.send_tcp(sock, wire, expiration)
+
+        (length,) = struct.unpack(
+            "!H", dns.query._net_read(sock, 2, expiration))
+        response_wire = dns.query._net_read(sock, length, expiration)
+
+        received_time = time.time()
+
+    response = wire_response.WireResponse(response_wire)
+    response.time = received_time - begin_time
+
+    if not q.is_response(response):
+        raise dns.query.BadResponse
+
+    return response
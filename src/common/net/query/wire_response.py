@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+import struct
+import hashlib
+import functools
+import dns.edns
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+
+from logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+HEADER = struct.Struct("!HHHHHH")
+RR_FIXED = struct.Struct("!HHIH")
+SOA_FIXED = struct.Struct("!IIIII")
+
+# same as dns.name._escaped
+ESCAPED = frozenset(b'"().;\\@$')
+
+
+def read_name(wire, offset):
+    """
+    offsetから始まる(圧縮されている可能性のある)名前を読む
+
+    Returns
+    -------
+    labels : tuple
+        ラベル(bytes)のタプル。ルートの空ラベルは含まない
+    end : int
+        名前の直後のoffset
+    """
+
+    labels = []
+    end = None
+    biggest_pointer = offset
+
+    while True:
+
+        if len(wire) <= offset:
+            raise dns.message.ShortHeader
+
+        length = wire[offset]
+
+        if length == 0:
+            offset += 1
+            break
+        elif length & 0xC0 == 0xC0:
+            if len(wire) <= offset + 1:
+                raise dns.message.ShortHeader
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) + wire[offset + 1]
+            # pointers must go backwards as dnspython does. no loop occurs
+            if biggest_pointer <= offset:
+                raise dns.name.BadPointer
+            biggest_pointer = offset
+        elif length & 0xC0 == 0:
+            if len(wire) < offset + 1 + length:
+                raise dns.message.ShortHeader
+            labels.append(wire[offset + 1:offset + 1 + length])
+            offset += 1 + length
+        else:
+            raise dns.name.BadLabelType
+
+    return tuple(labels), (offset if end is None else end)
+
+
+@functools.lru_cache(maxsize=4096)
+def name_to_text(labels):
+    """
+    dns.name.Name.to_text と同じ表記に変換する
+    (同じ名前が繰り返し現れるため結果をキャッシュする)
+    """
+
+    if not labels:
+        return "."
+
+    escaped = []
+    for label in labels:
+        text = []
+        for c in label:
+            if c in ESCAPED:
+                text.append("\\" + chr(c))
+            elif 0x20 < c < 0x7F:
+                text.append(chr(c))
+            else:
+                text.append("\\%03d" % c)
+        escaped.append("".join(text))
+
+    return ".".join(escaped) + "."
+
+
+def lower_labels(labels):
+    return tuple(label.lower() for label in labels)
+
+
+class ResourceRecord(object):
+
+    """
+    wire形式の中のリソースレコードの位置
+    """
+
+    __slots__ = ("labels", "rdtype", "rdclass", "ttl", "offset", "length")
+
+    def __init__(self, labels, rdtype, rdclass, ttl, offset, length):
+        self.labels = labels
+        self.rdtype = rdtype
+        self.rdclass = rdclass
+        self.ttl = ttl
+        self.offset = offset
+        self.length = length
+
+
+class WireResponse(object):
+
+    """
+    応答をwire形式のまま保持し、必要なフィールドのみを取り出すクラス
+
+    構造(各セクションのレコードの位置)は生成時に検査して索引を作るが、
+    RDATAは要求されたものだけを復号する。
+    dnspythonの dns.message.Message が必要な場合は message で得られる
+    """
+
+    __slots__ = ("wire", "id", "flags", "question", "answer", "additional",
+                 "time", "__message", "__options")
+
+    def __init__(self, wire):
+
+        if len(wire) < HEADER.size:
+            raise dns.message.ShortHeader
+
+        (self.id, self.flags, qdcount, ancount, nscount, arcount) = \
+            HEADER.unpack_from(wire)
+
+        self.wire = wire
+        self.time = 0
+        self.__message = None
+        self.__options = None
+
+        offset = HEADER.size
+        self.question = []
+
+        for _ in range(qdcount):
+            labels, offset = read_name(wire, offset)
+            if len(wire) < offset + 4:
+                raise dns.message.ShortHeader
+            rdtype, rdclass = struct.unpack_from("!HH", wire, offset)
+            offset += 4
+            self.question.append((lower_labels(labels), rdtype, rdclass))
+
+        self.answer, offset = self.__index_section(offset, ancount)
+        _, offset = self.__index_section(offset, nscount)
+        self.additional, offset = self.__index_section(offset, arcount)
+
+        if offset != len(wire):
+            raise dns.message.TrailingJunk
+
+    def __index_section(self, offset, count):
+
+        wire = self.wire
+        records = []
+
+        for _ in range(count):
+            labels, offset = read_name(wire, offset)
+            if len(wire) < offset + RR_FIXED.size:
+                raise dns.message.ShortHeader
+            rdtype, rdclass, ttl, length = RR_FIXED.unpack_from(wire, offset)
+            offset += RR_FIXED.size
+            if len(wire) < offset + length:
+                raise dns.message.ShortHeader
+            records.append(ResourceRecord(labels, rdtype, rdclass, ttl,
+                                          offset, length))
+            offset += length
+
+        return records, offset
+
+    @property
+    def message(self):
+        """
+        dnspythonで完全に復号した応答(初回のみ復号する)
+        """
+
+        if self.__message is None:
+            self.__message = dns.message.from_wire(self.wire)
+            self.__message.time = self.time
+
+        return self.__message
+
+    @property
+    def opt(self):
+        for record in self.additional:
+            if record.rdtype == dns.rdatatype.OPT:
+                return record
+        return None
+
+    @property
+    def ednsflags(self):
+        opt = self.opt
+        return 0 if opt is None else opt.ttl
+
+    def rcode(self):
+        return dns.rcode.from_flags(self.flags, self.ednsflags)
+
+    def opcode(self):
+        return dns.opcode.from_flags(self.flags)
+
+    @property
+    def options(self):
+        """
+        EDNSオプションの (code, data) のリスト
+        """
+
+        if self.__options is None:
+            options = []
+            opt = self.opt
+            if opt is not None:
+                offset = opt.offset
+                end = opt.offset + opt.length
+                while offset + 4 <= end:
+                    code, length = struct.unpack_from("!HH", self.wire, offset)
+                    offset += 4
+                    options.append((code, self.wire[offset:offset + length]))
+                    offset += length
+            self.__options = options
+
+        return self.__options
+
+    @property
+    def nsid(self):
+        for code, data in self.options:
+            if code == dns.edns.NSID:
+                return data
+        return None
+
+    def get_answer(self, qname_labels, rdtype, rdclass=dns.rdataclass.IN):
+        """
+        dns.message.Message.get_rrset と同じく、所有者名、クラス、タイプの
+        一致するanswerセクションのレコードを返す
+
+        Parameters
+        ----------
+        qname_labels : tuple
+            小文字にしたラベルのタプル
+        """
+
+        return [record for record in self.answer
+                if record.rdtype == rdtype and record.rdclass == rdclass and
+                lower_labels(record.labels) == qname_labels]
+
+    def soa(self, record):
+        """
+        Returns
+        -------
+        soa : tuple
+            (mname, rname, serial, refresh, retry, expire, minimum)
+        """
+
+        mname, offset = read_name(self.wire, record.offset)
+        rname, offset = read_name(self.wire, offset)
+
+        return (mname, rname) + SOA_FIXED.unpack_from(self.wire, offset)
+
+    def canonical_rdata(self, record):
+        """
+        圧縮を展開したRDATA(名前を含むタイプはSOA,NSのみ対応)
+        """
+
+        if record.rdtype in (dns.rdatatype.NS, dns.rdatatype.SOA):
+            names = 1 if record.rdtype == dns.rdatatype.NS else 2
+            offset = record.offset
+            result = []
+            for _ in range(names):
+                labels, offset = read_name(self.wire, offset)
+                result.append(b"".join(bytes((len(label),)) + label.lower()
+                                       for label in labels) + b"\x00")
+            result.append(self.wire[offset:record.offset + record.length])
+            return b"".join(result)
+
+        return self.wire[record.offset:record.offset + record.length]
+
+    def answer_digest(self, records):
+        """
+        レコードの並びに依存しないRDATAのダイジェスト
+        """
+
+        digest = hashlib.sha256()
+        for rdata in sorted(self.canonical_rdata(record)
+                            for record in records):
+            digest.update(struct.pack("!H", len(rdata)) + rdata)
+
+        return digest.digest()
@@ -71,7 +71,7 @@ class RateViewerLogic():
                 return []
             
             # 算出対象の時刻を計算
-            current_time = datetime.datetime.utcnow()
+            current_time = util.utcnow_by_minute()
             hours = self.rateviewer.cnfs.application.back_range_in_hours
             start_time = (current_time - datetime.timedelta(
                 seconds=hours * 3600)).isoformat() + "Z"
@@ -84,6 +84,10 @@ class RateViewerLogic():
             # 測定対象を取得
             target = self.rateviewer.dao_dnsprobe.get_af_dst_name_combination()
 
+            # 全ての組み合わせの測定数を一度に取得
+            matrix = self.rateviewer.dao_dnsprobe.get_ratiograph_matrix(
+                rrtype, start_time, end_time)
+
             result = []
             for (dst_name, aflist) in target.items():
                 for af in aflist:
@@ -91,16 +95,10 @@ class RateViewerLogic():
                         
                         probe_result = {}
                         for probe in probe_group:
-                            success = \
-                                self.rateviewer.dao_dnsprobe.get_ratiograph_successful(
-                                    dst_name, [probe], af, proto, rrtype, start_time, end_time)
-                            exceeded = \
-                                self.rateviewer.dao_dnsprobe.get_ratiograph_exceeded_slr(
-                                    dst_name, [probe], af, proto, rrtype, start_time, end_time)
-                            failed = \
-                                self.rateviewer.dao_dnsprobe.get_ratiograph_failed(
-                                    dst_name, [probe], af, proto, rrtype, start_time, end_time)
-                            denominator = success + exceeded + failed
+                            counts = matrix.get((probe, dst_name, af, proto),
+                                                {})
+                            success = counts.get("successful", 0)
+                            denominator = sum(counts.values())
                             if denominator != 0:
                                 percentage = (success / float(denominator)) * 100
                                 probe_result[probe.replace("-", "")] = round(percentage,3)
@@ -19,6 +19,7 @@ from flask import abort, Response
 from logging import getLogger
 from werkzeug.routing import BaseConverter
 
+import common.common.util as util
 import common.common.config as config
 
 
@@ -41,7 +42,7 @@ class RTTViewerLogic():
 
         upper = 24
         seconds_for_hour = 3600
-        current_time = datetime.datetime.utcnow()
+        current_time = util.utcnow_by_minute()
         start_index, end_index = time_range
 
         start_time = current_time - datetime.timedelta(
@@ -206,15 +207,9 @@ class RTTViewerLogic():
             title = "NSID Ratio(%s from selected probes)" % (dns_server_name)
             legend_max_num = 4
 
-            for (measurement_name, tags) in ret.keys():
-                count = list(ret.get_points(measurement=measurement_name,
-                                            tags=tags))
-                if ("nsid" not in tags) or (len(count) != 1) or \
-                        ("count" not in count[0]):
-                    break
-                else:
-                    labels.append(tags["nsid"])
-                    values.append(count[0]["count"])
+            for (nsid, count) in ret.items():
+                labels.append(nsid)
+                values.append(count)
 
             trace = go.Pie(values=values,
                            labels=labels,
@@ -298,21 +293,23 @@ class RTTViewerLogic():
                                             for row in range(rows)],
                                      vertical_spacing=0.1)
 
+            # counts of all the donuts at once
+            matrix = self.rttviewer.dao_dnsprobe.get_ratiograph_matrix(
+                rrtype, start_time, end_time, dns_server_name, probe_names)
+
+            totals = {}
+            for ((_, _, af, proto), counts) in matrix.items():
+                total = totals.setdefault((af, proto), [0, 0, 0])
+                total[0] += counts["failed"]
+                total[1] += counts["exceeded_slr"]
+                total[2] += counts["successful"]
+
             for (n, (af, proto)) in enumerate(sorted(af_proto_combination)):
                 r = int(n / row_tiling_num)
                 c = int(n % row_tiling_num)
 
-                args = (dns_server_name, probe_names, af, proto, rrtype,
-                        start_time, end_time)
-
-                failed_count = self.rttviewer.dao_dnsprobe.\
-                    get_ratiograph_failed(*args)
-
-                exceeded_count = self.rttviewer.dao_dnsprobe.\
-                    get_ratiograph_exceeded_slr(*args)
-
-                successful_count = self.rttviewer.dao_dnsprobe.\
-                    get_ratiograph_successful(*args)
+                (failed_count, exceeded_count, successful_count) = \
+                    totals.get((af, proto), (0, 0, 0))
 
                 if (failed_count + successful_count + exceeded_count) == 0:
                     continue
@@ -393,18 +390,20 @@ class RTTViewerLogic():
                 self.rttviewer.dao_dnsprobe.get_af_proto_combination(
                     dns_server_name, probe_names)
 
+            # the graphs of all the combinations are queried concurrently
+            rttgraph_data = \
+                self.rttviewer.dao_dnsprobe.get_rttgraph_data_batch(
+                    dns_server_name,
+                    probe_names,
+                    af_proto_combination,
+                    rrtype,
+                    start_time,
+                    end_time)
+
             traces = []
             for (af, proto) in sorted(af_proto_combination):
 
-                x, y = \
-                    self.rttviewer.dao_dnsprobe.get_rttgraph_data(
-                        dns_server_name,
-                        probe_names,
-                        af,
-                        proto,
-                        rrtype,
-                        start_time,
-                        end_time)
+                x, y = rttgraph_data[(af, proto)]
 
                 if not (x and y):
                     continue
@@ -459,13 +458,17 @@ class RTTViewerLogic():
             map_proj_type = "equirectangular"
             color_map = {True: "orange", False: "grey"}
             size_map = {True: 11, False: 10}
-            hovertext = "probe-id: %s<br />last measured: %s<br />uptime: %s\
+            hovertext = "probe-id: %s<br />last measured: %s<br />booted at: %s\
             <br />ASN(v4): AS%s<br />description(v4): %s\
-            <br />ASN(v6): AS%s<br />description(v6): %s"
+            <br />ASN(v6): AS%s<br />description(v6): %s\
+            <br />last round: %s sec, %s points"
 
             probe_location_name, latitudes, longitudes = \
                 self.rttviewer.dao_dnsprobe.make_probe_locations()
 
+            # metadata of all the probes at once
+            registry = self.rttviewer.dao_dnsprobe.get_probe_registry()
+
             data = []
             for (locname, lat, lon) in zip(probe_location_name,
                                            latitudes,
@@ -474,14 +477,13 @@ class RTTViewerLogic():
                 color = color_map[locname in probe_names]
                 size = size_map[locname in probe_names]
 
-                last_measured = \
-                    self.rttviewer.dao_dnsprobe.get_probe_last_measured(
-                        locname)
-                uptime = \
-                    self.rttviewer.dao_dnsprobe.get_probe_uptime(
-                        locname)
-                v4_asn, v4_desc, v6_asn, v6_desc = \
-                    self.rttviewer.dao_dnsprobe.get_probe_net_desc(locname)
+                probe = registry.get(locname, {})
+                (last_measured, boot_time, v4_asn, v4_desc, v6_asn, v6_desc,
+                 round_duration, point_count) = (
+                     "unknown" if probe.get(key) is None else probe[key]
+                     for key in ("last_measured", "boot_time", "asn_v4",
+                                 "asn_desc_v4", "asn_v6", "asn_desc_v6",
+                                 "round_duration", "point_count"))
 
                 data.append(go.Scattergeo(lon=[lon],
                                           lat=[lat],
@@ -489,11 +491,13 @@ class RTTViewerLogic():
                                           name=locname,
                                           hovertext=hovertext % (locname,
                                                                  last_measured,
-                                                                 uptime,
+                                                                 boot_time,
                                                                  v4_asn,
                                                                  v4_desc,
                                                                  v6_asn,
-                                                                 v6_desc),
+                                                                 v6_desc,
+                                                                 round_duration,
+                                                                 point_count),
                                           mode="markers",
                                           showlegend=False,
                                           marker=dict(size=size,
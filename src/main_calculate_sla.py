@@ -34,38 +34,38 @@ class SLACalculator(framework.SetupwithInfluxdb):
 
         result = []
 
-        for (dst_name, afs) in calculation_target.items():
-            for af in afs:
+        targets = [(dst_name, af)
+                   for (dst_name, afs) in calculation_target.items()
+                   for af in afs]
 
-                self.logger.info("calculation start for %s %s" % (
-                    dst_name, af))
+        # the counts of all the targets are queried concurrently
+        counts = self.dao_cq_nameserver_availability.count_measurements(
+            targets, start_time, end_time)
 
-                total_measurements = self.dao_cq_nameserver_availability.\
-                    count_total_measurements(dst_name, af, start_time,
-                                             end_time)
+        for ((dst_name, af), (total_measurements, failed_measurements)) in \
+                zip(targets, counts):
 
-                failed_measurements = self.dao_cq_nameserver_availability.\
-                    count_failed_measurements(dst_name, af, start_time,
-                                              end_time)
+            self.logger.info("calculation result for %s %s" % (
+                dst_name, af))
 
-                self.logger.info("failed / total =  %d / %d" % (
-                    failed_measurements, total_measurements))
+            self.logger.info("failed / total =  %d / %d" % (
+                failed_measurements, total_measurements))
 
-                sla_value = 100
-                if total_measurements != 0:
-                    successful = \
-                        float(total_measurements - failed_measurements)
-                    sla_value = (successful / total_measurements) * 100
-                else:
-                    self.logger.warning("number of total measurement is zero!")
+            sla_value = 100
+            if total_measurements != 0:
+                successful = \
+                    float(total_measurements - failed_measurements)
+                sla_value = (successful / total_measurements) * 100
+            else:
+                self.logger.warning("number of total measurement is zero!")
 
-                self.logger.info("calculated sla = %f" % sla_value)
+            self.logger.info("calculated sla = %f" % sla_value)
 
-                result.append(types.DNS_name_server_availability(end_time,
-                                                                 start_time,
-                                                                 dst_name,
-                                                                 af,
-                                                                 sla_value))
+            result.append(types.DNS_name_server_availability(end_time,
+                                                             start_time,
+                                                             dst_name,
+                                                             af,
+                                                             sla_value))
 
         self.dao_nameserver_availability.write_measurement_data(result)
 
@@ -84,38 +84,38 @@ class SLACalculator(framework.SetupwithInfluxdb):
 
         result = []
 
-        for (dst_name, afs) in calculation_target.items():
-            for af in afs:
+        targets = [(dst_name, af)
+                   for (dst_name, afs) in calculation_target.items()
+                   for af in afs]
 
-                self.logger.info("calculation start for %s %s" % (
-                    dst_name, af))
+        # the counts of all the targets are queried concurrently
+        counts = self.dao_cq_tcp_nameserver_availability.count_measurements(
+            targets, start_time, end_time)
 
-                total_measurements = self.dao_cq_tcp_nameserver_availability.\
-                    count_total_measurements(dst_name, af, start_time,
-                                             end_time)
+        for ((dst_name, af), (total_measurements, failed_measurements)) in \
+                zip(targets, counts):
 
-                failed_measurements = self.dao_cq_tcp_nameserver_availability.\
-                    count_failed_measurements(dst_name, af, start_time,
-                                              end_time)
+            self.logger.info("calculation result for %s %s" % (
+                dst_name, af))
 
-                self.logger.info("failed / total =  %d / %d" % (
-                    failed_measurements, total_measurements))
+            self.logger.info("failed / total =  %d / %d" % (
+                failed_measurements, total_measurements))
 
-                sla_value = 100
-                if total_measurements != 0:
-                    successful = \
-                        float(total_measurements - failed_measurements)
-                    sla_value = (successful / total_measurements) * 100
-                else:
-                    self.logger.warning("number of total measurement is zero!")
+            sla_value = 100
+            if total_measurements != 0:
+                successful = \
+                    float(total_measurements - failed_measurements)
+                sla_value = (successful / total_measurements) * 100
+            else:
+                self.logger.warning("number of total measurement is zero!")
 
-                self.logger.info("calculated sla = %f" % sla_value)
+            self.logger.info("calculated sla = %f" % sla_value)
 
-                result.append(types.TCP_DNS_resolution_RTT(end_time,
-                                                           start_time,
-                                                           dst_name,
-                                                           af,
-                                                           sla_value))
+            result.append(types.TCP_DNS_resolution_RTT(end_time,
+                                                       start_time,
+                                                       dst_name,
+                                                       af,
+                                                       sla_value))
 
         self.dao_tcp_nameserver_availability.write_measurement_data(result)
 
@@ -134,38 +134,38 @@ class SLACalculator(framework.SetupwithInfluxdb):
 
         result = []
 
-        for (dst_name, afs) in calculation_target.items():
-            for af in afs:
+        targets = [(dst_name, af)
+                   for (dst_name, afs) in calculation_target.items()
+                   for af in afs]
 
-                self.logger.info("calculation start for %s %s" % (
-                    dst_name, af))
+        # the counts of all the targets are queried concurrently
+        counts = self.dao_cq_udp_nameserver_availability.count_measurements(
+            targets, start_time, end_time)
 
-                total_measurements = self.dao_cq_udp_nameserver_availability.\
-                    count_total_measurements(dst_name, af, start_time,
-                                             end_time)
+        for ((dst_name, af), (total_measurements, failed_measurements)) in \
+                zip(targets, counts):
 
-                failed_measurements = self.dao_cq_udp_nameserver_availability.\
-                    count_failed_measurements(dst_name, af, start_time,
-                                              end_time)
+            self.logger.info("calculation result for %s %s" % (
+                dst_name, af))
 
-                self.logger.info("failed / total =  %d / %d" % (
-                    failed_measurements, total_measurements))
+            self.logger.info("failed / total =  %d / %d" % (
+                failed_measurements, total_measurements))
 
-                sla_value = 100
-                if total_measurements != 0:
-                    successful = \
-                        float(total_measurements - failed_measurements)
-                    sla_value = (successful / total_measurements) * 100
-                else:
-                    self.logger.warning("number of total measurement is zero!")
+            sla_value = 100
+            if total_measurements != 0:
+                successful = \
+                    float(total_measurements - failed_measurements)
+                sla_value = (successful / total_measurements) * 100
+            else:
+                self.logger.warning("number of total measurement is zero!")
 
-                self.logger.info("calculated sla = %f" % sla_value)
+            self.logger.info("calculated sla = %f" % sla_value)
 
-                result.append(types.UDP_DNS_resolution_RTT(end_time,
-                                                           start_time,
-                                                           dst_name,
-                                                           af,
-                                                           sla_value))
+            result.append(types.UDP_DNS_resolution_RTT(end_time,
+                                                       start_time,
+                                                       dst_name,
+                                                       af,
+                                                       sla_value))
 
         self.dao_udp_nameserver_availability.write_measurement_data(result)
 
@@ -7,6 +7,7 @@ docstring is here
 import requests
 import traceback
 import sys
+import os
 import json
 import socket
 import binascii
@@ -14,26 +15,82 @@ import netifaces
 import ipaddress
 import datetime
 import time
+import math
+import signal
+import threading
 import ipwhois
 import uptime
-import dns.name
-import dns.message
 import dns.query
 import dns.rdatatype
 import dns.exception
+import asyncio
+import collections
+import contextlib
+import functools
+import multiprocessing
 import concurrent.futures as cfu
 
+import common.common.config as config
 import common.common.framework as framework
 import common.common.util as util
 import common.data.dao as dao
 import common.data.types as types
 import common.data.errors as errors
+import common.data.rdata as rdata
+import common.data.spool as spool
+import common.data.writer as writer
+import common.net.query.aio_query as aio_query
+import common.net.query.mux_query as mux_query
+import common.net.query.query_template as query_template
+import common.net.query.scheduler as scheduler
+import common.net.query.wire_query as wire_query
+
+
+MeasurementTask = collections.namedtuple("MeasurementTask",
+                                         ["nameserver",
+                                          "dst",
+                                          "src",
+                                          "af",
+                                          "asn",
+                                          "asn_desc",
+                                          "proto",
+                                          "qname",
+                                          "rrtype",
+                                          "qo"])
 
 
 class Measurer(framework.SetupwithInfluxdb):
 
+    SHARD_SUCCEEDED = 0
+    SHARD_SPOOLED = 1
+    SHARD_FAILED = 2
+
     def __init__(self):
         super().__init__(__name__, __file__)
+        self.http_session = requests.Session()
+        self.query_template_cache = query_template.QueryTemplateCache()
+        self.event_loop = None
+        self.udp_multiplexer = None
+        # held by the round and the refresher. tmp_data is read and written
+        # only while holding it once the daemon has started
+        self.refresh_mutex = threading.Lock()
+        self.stop_event = threading.Event()
+        self.refresh_event = threading.Event()
+        # cron starts the process at the beginning of the round
+        self.round_started_at = time.time()
+        self.skipped_queries = 0
+        self.measured_points = 0
+        self.measurement_contexts = {}
+        self.rdata_dictionary = None
+        if self.cnfs.rdata_storing.content_addressed:
+            self.rdata_dictionary = rdata.RdataDictionary(
+                self.cnfs.rdata_storing.digest_refresh_interval)
+        self.spool = spool.Spool(
+            os.path.join(config.SPOOL_DIR,
+                         dao.Mes_dnsprobe.__name__.lower()),
+            self.cnfs.spool.max_bytes,
+            self.cnfs.spool.segment_max_bytes,
+            self.cnfs.spool.fsync)
 
     def set_measurer_id(self):
         hostname = socket.gethostname()
@@ -44,7 +101,8 @@ class Measurer(framework.SetupwithInfluxdb):
     def set_server_boottime(self):
         current_time = datetime.datetime.now(datetime.UTC)
         delta = datetime.timedelta(seconds=uptime.uptime())
-        self.server_boottime = str((current_time - delta).isoformat()) + "Z"
+        self.server_boottime = str((current_time - delta).replace(
+            tzinfo=None).isoformat()) + "Z"
 
     def set_global_ipaddress(self):
         selected_ipv4 = None
@@ -130,6 +188,15 @@ class Measurer(framework.SetupwithInfluxdb):
         self.logger.info("IPv4 description: %s" % str(self.net_desc_v4))
         self.logger.info("IPv6 description: %s" % str(self.net_desc_v6))
 
+    def fallback_measurement_info(self, cached):
+
+        if not (self.cnfs.controller.fallback_to_cache and cached):
+            raise errors.DNSProbeError("unable to get measurement info")
+
+        self.logger.warning("fallback to the last good measurement info")
+
+        return cached["body"]
+
     def load_measurement_info(self):
 
         protocol = self.cnfs.controller.protocol
@@ -143,27 +210,54 @@ class Measurer(framework.SetupwithInfluxdb):
         controller = "%s://%s:%s%s" % (protocol, host, port, path)
         self.logger.info("controller: %s" % (controller))
 
+        self.load_tmpdata()
+        cached = self.tmp_data.get("measurement_info")
+
+        headers = {"Accept-Encoding": "gzip"}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
         try:
-            response = requests.get(controller,
-                                    auth=(user, passwd),
-                                    timeout=timeout)
+            response = self.http_session.get(controller,
+                                             auth=(user, passwd),
+                                             headers=headers,
+                                             timeout=timeout)
         except requests.RequestException as ex:
             self.logger.error("unexpected error occurred: %s" % (str(ex)))
-            raise errors.DNSProbeError("unable to get measurement info")
+            response = None
 
-        self.logger.info("http status code: %s" % (response.status_code))
+        if response is not None:
+            self.logger.info("http status code: %s" % (response.status_code))
 
-        if response.status_code != 200:
+        if response is None:
+            json_obj = self.fallback_measurement_info(cached)
+        elif response.status_code == 304 and cached:
+            self.logger.info("measurement info not modified")
+            if hasattr(self, "measurement_info"):
+                return
+            json_obj = cached["body"]
+        elif response.status_code != 200:
             self.logger.error("status code is not 200: %s" %
                               (response.status_code))
-            raise errors.DNSProbeError("unable to get measurement info")
-
-        try:
-            json_obj = json.loads(response.text)
-            self.logger.info("json object load in properly from controller")
-        except json.decoder.JSONDecodeError as ex:
-            self.logger.error("undecodable object responsed: %s" % (str(ex)))
-            raise errors.DNSProbeError("unable to get measurement info")
+            json_obj = self.fallback_measurement_info(cached)
+        else:
+            try:
+                json_obj = json.loads(response.text)
+                self.logger.info(
+                    "json object load in properly from controller")
+            except json.decoder.JSONDecodeError as ex:
+                self.logger.error("undecodable object responsed: %s" %
+                                  (str(ex)))
+                json_obj = self.fallback_measurement_info(cached)
+            else:
+                self.tmp_data["measurement_info"] = dict(
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                    body=json_obj)
+                self.write_tmpdata()
 
         self.logger.debug(json_obj)
 
@@ -173,6 +267,61 @@ class Measurer(framework.SetupwithInfluxdb):
             self.logger.error("unable to map json obj to namedtuple")
             raise errors.DNSProbeError("unable to get measurement info")
 
+    def get_measurement_context(self, current_time, asn, asn_desc):
+
+        # values common to the round are shared by all of the measured data
+        key = (current_time, asn, asn_desc)
+        context = self.measurement_contexts.get(key)
+
+        if context is None:
+            context = types.MeasurementContext(
+                current_time,
+                self.measurer_id,
+                asn,
+                asn_desc,
+                self.server_boottime,
+                self.cnfs.measurement.latitude,
+                self.cnfs.measurement.longitude,
+                self.cnfs.rdata_storing,
+                self.rdata_dictionary)
+            context = self.measurement_contexts.setdefault(key, context)
+
+        return context
+
+    def make_measured_data(self,
+                           current_time,
+                           time_diff,
+                           nameserver,
+                           dst,
+                           src,
+                           af,
+                           asn,
+                           asn_desc,
+                           proto,
+                           qname,
+                           rrtype,
+                           err,
+                           response,
+                           slr_threshold,
+                           send_offset=None):
+
+        context = self.get_measurement_context(current_time, asn, asn_desc)
+
+        measured_data = types.make_DNSMeasurementData(context,
+                                                      time_diff,
+                                                      nameserver,
+                                                      dst,
+                                                      src,
+                                                      af,
+                                                      proto,
+                                                      qname,
+                                                      rrtype,
+                                                      err,
+                                                      response,
+                                                      slr_threshold,
+                                                      send_offset)
+        return measured_data
+
     def measurement_core(self,
                          current_time,
                          nameserver,
@@ -187,142 +336,1007 @@ class Measurer(framework.SetupwithInfluxdb):
                          qname,
                          rrtype,
                          qo,
-                         slr_threshold):
+                         slr_threshold,
+                         pacer=None,
+                         started_at=None,
+                         deadline=None):
 
         response = None
         err = None
 
-        try:
-            start_at = time.time()
-            response = queryer(qo, dst, timeout=timeout, source=src)
-        except dns.exception.Timeout as ex:
-            self.logger.warning("timeout while measurement: %s" % str(ex))
-            err = ex
-        except OSError as ex:
-            self.logger.warning("OSError while measurement: %s" % str(ex))
-            err = ex
-        except Exception as ex:
-            self.logger.warning("unexpected error while measuremet")
-            self.logger.warning("%s" % str(ex))
-            err = ex
-        finally:
-            time_diff = (time.time() - start_at) * 1000
+        with (pacer.pace(dst) if pacer else contextlib.nullcontext()):
+            if self.exceeds_deadline(deadline, time.time(), timeout):
+                return None
+            try:
+                start_at = time.time()
+                response = queryer(qo, dst, timeout=timeout, source=src)
+            except dns.exception.Timeout as ex:
+                self.logger.warning("timeout while measurement: %s" % str(ex))
+                err = ex
+            except OSError as ex:
+                self.logger.warning("OSError while measurement: %s" % str(ex))
+                err = ex
+            except Exception as ex:
+                self.logger.warning("unexpected error while measuremet")
+                self.logger.warning("%s" % str(ex))
+                err = ex
+            finally:
+                time_diff = (time.time() - start_at) * 1000
 
-        latitude = self.cnfs.measurement.latitude
-        longitude = self.cnfs.measurement.longitude
+        send_offset = None
+        if started_at is not None:
+            send_offset = (start_at - started_at) * 1000
 
-        measured_data = types.make_DNSMeasurementData(current_time,
-                                                      time_diff,
-                                                      nameserver,
-                                                      dst,
-                                                      src,
-                                                      self.measurer_id,
-                                                      asn,
-                                                      asn_desc,
-                                                      self.server_boottime,
-                                                      latitude,
-                                                      longitude,
-                                                      af,
-                                                      proto,
-                                                      qname,
-                                                      rrtype,
-                                                      err,
-                                                      response,
-                                                      self.cnfs.rdata_storing,
-                                                      slr_threshold)
-        return measured_data
+        return self.make_measured_data(current_time,
+                                       time_diff,
+                                       nameserver,
+                                       dst,
+                                       src,
+                                       af,
+                                       asn,
+                                       asn_desc,
+                                       proto,
+                                       qname,
+                                       rrtype,
+                                       err,
+                                       response,
+                                       slr_threshold,
+                                       send_offset)
+
+    async def measurement_core_async(self,
+                                     semaphore,
+                                     current_time,
+                                     nameserver,
+                                     queryer,
+                                     dst,
+                                     src,
+                                     af,
+                                     asn,
+                                     asn_desc,
+                                     timeout,
+                                     proto,
+                                     qname,
+                                     rrtype,
+                                     qo,
+                                     slr_threshold,
+                                     pacer=None,
+                                     started_at=None,
+                                     offset=0,
+                                     deadline=None):
+
+        response = None
+        err = None
+
+        # wait for the send time assigned by the scheduler
+        if started_at is not None:
+            if self.exceeds_deadline(deadline, started_at + offset, timeout):
+                return None
+            delay = started_at + offset - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        async with semaphore, \
+                (pacer.pace(dst) if pacer else contextlib.nullcontext()):
+            if self.exceeds_deadline(deadline, time.time(), timeout):
+                return None
+            try:
+                start_at = time.time()
+                response = await queryer(qo, dst, timeout=timeout, source=src)
+            except dns.exception.Timeout as ex:
+                self.logger.warning("timeout while measurement: %s" % str(ex))
+                err = ex
+            except OSError as ex:
+                self.logger.warning("OSError while measurement: %s" % str(ex))
+                err = ex
+            except Exception as ex:
+                self.logger.warning("unexpected error while measuremet")
+                self.logger.warning("%s" % str(ex))
+                err = ex
+            finally:
+                time_diff = (time.time() - start_at) * 1000
+
+        # the queryers take the time when the response arrives so that
+        # the delay of the event loop after that is not included
+        if getattr(response, "time", 0):
+            time_diff = response.time * 1000
+
+        send_offset = None
+        if started_at is not None:
+            send_offset = (start_at - started_at) * 1000
+
+        return self.make_measured_data(current_time,
+                                       time_diff,
+                                       nameserver,
+                                       dst,
+                                       src,
+                                       af,
+                                       asn,
+                                       asn_desc,
+                                       proto,
+                                       qname,
+                                       rrtype,
+                                       err,
+                                       response,
+                                       slr_threshold,
+                                       send_offset)
+
+    def make_measurement_tasks(self):
+
+        for measurement in self.measurement_info:
+
+            nameserver = measurement.nameserver
+            protocol = measurement.proto
+            query = measurement.query
+            dst = measurement.destination
+
+            qname = query.qname
+            rrtype = query.rrtype
+
+            try:
+                template = self.query_template_cache.get(qname, rrtype)
+            except dns.rdatatype.UnknownRdatatype:
+                self.logger.warning("unknown query: %s" % (rrtype))
+                self.logger.warning("measurement skipped")
+                continue
+            except Exception as ex:
+                self.logger.warning("unable to query: %s" % (str(ex)))
+                self.logger.warning("measurement skipped")
+                continue
+
+            for addr in dst:
+
+                addr_obj = ipaddress.ip_address(addr)
+
+                if addr_obj.version == 4:
+                    source = self.ipv4
+                    asn, asn_desc = self.net_desc_v4
+                elif addr_obj.version == 6:
+                    source = self.ipv6
+                    asn, asn_desc = self.net_desc_v6
+                else:
+                    self.logger.error(
+                        "unknown version addr: %s" % str(addr))
+                    continue
+
+                yield MeasurementTask(nameserver,
+                                      addr,
+                                      source,
+                                      addr_obj.version,
+                                      asn,
+                                      asn_desc,
+                                      protocol,
+                                      qname,
+                                      rrtype,
+                                      template.make_query())
+
+    def get_task_priority(self):
 
-    def measure_toplevel(self):
+        rrtypes = [rrtype.strip().upper() for rrtype in
+                   str(self.cnfs.deadline.rrtype_priority).split(",")]
+        protocols = [proto.strip().lower() for proto in
+                     str(self.cnfs.deadline.protocol_priority).split(",")]
+
+        def rank(order, value):
+            return order.index(value) if value in order else len(order)
+
+        def priority(task):
+            return (rank(rrtypes, task.rrtype.upper()),
+                    rank(protocols, task.proto))
+
+        return priority
+
+    def get_round_deadline(self):
+
+        round_deadline = self.cnfs.deadline.round_deadline
+
+        if round_deadline <= 0:
+            return None
+
+        return self.round_started_at + round_deadline
+
+    def exceeds_deadline(self, deadline, send_at, timeout):
+        return (deadline is not None) and (deadline < send_at + timeout)
+
+    def estimate_round_cost(self, scheduled, timeout_by_protocol, concurrency):
+        """
+        全てのクエリがタイムアウトした場合のラウンドの所要時間(秒)を見積もる
+
+        Parameters
+        ----------
+        scheduled : list
+            (送信時刻のオフセット, MeasurementTask) のリスト
+        timeout_by_protocol : dict
+            プロトコル毎のタイムアウト(秒)
+        concurrency : int
+            同時に問い合わせるクエリ数
+
+        Returns
+        -------
+        cost : float
+            見積もった所要時間(秒)
+        """
+
+        if not scheduled:
+            return 0.0
+
+        total = sum(timeout_by_protocol[task.proto]
+                    for (_, task) in scheduled)
+        offset, task = scheduled[-1]
+
+        return max(total / max(1, concurrency),
+                   offset + timeout_by_protocol[task.proto])
+
+    def log_round_cost(self, scheduled, timeout_by_protocol, concurrency,
+                       deadline):
+
+        cost = self.estimate_round_cost(scheduled,
+                                        timeout_by_protocol,
+                                        concurrency)
+
+        self.logger.info("%d queries scheduled. worst case cost: %.1f sec" %
+                         (len(scheduled), cost))
+
+        if deadline is None:
+            return
+
+        budget = deadline - time.time()
+        if budget < cost:
+            self.logger.warning("worst case cost exceeds the budget %.1f sec. "
+                                "low priority queries may be skipped" %
+                                (budget))
+
+    def schedule_measurement_tasks(self):
+
+        # stable sort keeps the order of measurement info in the same priority
+        return scheduler.spread_evenly(
+            sorted(self.make_measurement_tasks(),
+                   key=self.get_task_priority()),
+            lambda task: task.dst,
+            self.cnfs.scheduler.spread_seconds,
+            self.cnfs.scheduler.jitter)
+
+    def make_destination_pacer(self, pacer_class):
+
+        max_concurrent = self.cnfs.scheduler.max_concurrent_per_destination
+        max_per_second = \
+            self.cnfs.scheduler.max_queries_per_second_per_destination
+
+        if (max_concurrent <= 0) and (max_per_second <= 0):
+            return None
+
+        return pacer_class(max_concurrent, max_per_second)
+
+    def make_current_time(self):
+        return str(datetime.datetime.now(datetime.UTC).replace(
+            tzinfo=None).isoformat()) + "Z"
+
+    def measure_toplevel(self, sink=None, current_time=None):
+
+        engine = self.cnfs.measurement.engine
+        result = []
+
+        if current_time is None:
+            current_time = self.make_current_time()
+
+        self.measurement_contexts = {}
+
+        # every measured data is handed to the sink as soon as it completes
+        if sink is None:
+            sink = result.append
+
+        if engine == "asyncio":
+            measured, skipped = self.measure_toplevel_asyncio(current_time,
+                                                              sink)
+        else:
+            if engine != "thread":
+                self.logger.warning("unknown engine %s. fallback to thread" %
+                                    (engine))
+            measured, skipped = self.measure_toplevel_thread(current_time,
+                                                             sink)
+
+        self.skipped_queries = skipped
+        self.measured_points = measured
+
+        self.logger.info("%s data measured" % (measured))
+        if skipped:
+            self.logger.warning("%d queries skipped by the round deadline" %
+                                (skipped))
+        self.logger.debug("query template cache hits: %d, misses: %d" %
+                          (self.query_template_cache.hits,
+                           self.query_template_cache.misses))
+        for (rrtype, (count, elapsed)) in sorted(
+                types.PARSER_TIMING.snapshot(reset=True).items()):
+            self.logger.debug("parser for %s: %d calls, %.3f ms on average" %
+                              (rrtype, count, elapsed / count * 1000))
+        self.logger.debug("following is massured data %s" % str(result))
+
+        return result
+
+    def measurement_core_with_sink(self, sink, *positional):
+        # None means the query was skipped by the round deadline
+        measured_data = self.measurement_core(*positional)
+        if measured_data is None:
+            return False
+        sink(measured_data)
+        # only whether it was measured is returned so that the data is
+        # released once the sink has taken it
+        return True
+
+    async def measurement_core_async_with_sink(self, sink, *positional):
+        measured_data = await self.measurement_core_async(*positional)
+        if measured_data is None:
+            return False
+        sink(measured_data)
+        return True
+
+    def measure_toplevel_thread(self, current_time, sink):
 
         tcp_timeout = self.cnfg.constants.tcp_timeout
         udp_timeout = self.cnfg.constants.udp_timeout
-        current_time = str(datetime.datetime.now(datetime.UTC).isoformat()) + "Z"
-        result = []
+
+        if self.cnfs.measurement.lazy_response_parsing:
+            udp_queryer, tcp_queryer = wire_query.udp, wire_query.tcp
+        else:
+            udp_queryer, tcp_queryer = dns.query.udp, dns.query.tcp
 
         queryer_info_by_protocol = \
-            {"udp": (dns.query.udp,
+            {"udp": (udp_queryer,
                      udp_timeout,
                      self.cnfg.constants.udp_slr_threshold * 1000),
-             "tcp": (dns.query.tcp,
+             "tcp": (tcp_queryer,
                      tcp_timeout,
                      self.cnfg.constants.tcp_slr_threshold * 1000)}
 
         workers = self.cnfs.measurement.number_of_max_workers
+        pacer = self.make_destination_pacer(scheduler.DestinationPacer)
+        deadline = self.get_round_deadline()
+        scheduled = self.schedule_measurement_tasks()
         futures = []
+        skipped = 0
+
+        self.log_round_cost(scheduled,
+                            dict(udp=udp_timeout, tcp=tcp_timeout),
+                            workers,
+                            deadline)
+
+        started_at = time.time()
 
         with cfu.ThreadPoolExecutor(max_workers=workers) as threadpool:
 
-            for measurement in self.measurement_info:
-
-                nameserver = measurement.nameserver
-                protocol = measurement.proto
-                query = measurement.query
-                dst = measurement.destination
-
-                for addr in dst:
-
-                    addr_obj = ipaddress.ip_address(addr)
-
-                    if addr_obj.version == 4:
-                        source = self.ipv4
-                        asn, asn_desc = self.net_desc_v4
-                    elif addr_obj.version == 6:
-                        source = self.ipv6
-                        asn, asn_desc = self.net_desc_v6
-                    else:
-                        self.logger.error(
-                            "unknown version addr: %s" % str(addr))
-                        continue
-
-                    queryer, timeout, slr_threshold = \
-                        queryer_info_by_protocol[protocol]
-
-                    qname = query.qname
-                    rrtype = query.rrtype
-
-                    try:
-                        qname_obj = dns.name.from_text(qname)
-                        rrtype_obj = dns.rdatatype.from_text(rrtype)
-                        qo = dns.message.make_query(qname_obj,
-                                                    rrtype_obj,
-                                                    use_edns=True)
-                        qo.flags &= 0xFEFF
-                        qo.use_edns(edns=0,
-                                    options=[dns.edns.GenericOption(
-                                        dns.edns.NSID, bytes())])
-
-                    except dns.rdatatype.UnknownRdatatype:
-                        self.logger.warning("unknown query: %s" % (rrtype))
-                        self.logger.warning("measurement skipped")
-                        continue
-                    except Exception as ex:
-                        self.logger.warning("unable to query: %s" % (str(ex)))
-                        self.logger.warning("measurement skipped")
-                        continue
-
-                    futures.append(threadpool.submit(self.measurement_core,
-                                                     current_time,
-                                                     nameserver,
-                                                     queryer,
-                                                     addr,
-                                                     source,
-                                                     addr_obj.version,
-                                                     asn,
-                                                     asn_desc,
-                                                     timeout,
-                                                     protocol,
-                                                     qname,
-                                                     rrtype,
-                                                     qo,
-                                                     slr_threshold))
+            for offset, task in scheduled:
+
+                queryer, timeout, slr_threshold = \
+                    queryer_info_by_protocol[task.proto]
+
+                if self.exceeds_deadline(deadline,
+                                         started_at + offset,
+                                         timeout):
+                    skipped += 1
+                    continue
+
+                delay = started_at + offset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+                futures.append(threadpool.submit(
+                    self.measurement_core_with_sink,
+                    sink,
+                    current_time,
+                    task.nameserver,
+                    queryer,
+                    task.dst,
+                    task.src,
+                    task.af,
+                    task.asn,
+                    task.asn_desc,
+                    timeout,
+                    task.proto,
+                    task.qname,
+                    task.rrtype,
+                    task.qo,
+                    slr_threshold,
+                    pacer,
+                    started_at,
+                    deadline))
 
+        measured = 0
         for future in cfu.as_completed(futures):
-            result.append(future.result())
+            if future.result():
+                measured += 1
+            else:
+                skipped += 1
 
-        self.logger.info("%s data measured" % (len(result)))
-        self.logger.debug("following is massured data %s" % str(result))
+        return measured, skipped
 
-        return result
+    def measure_toplevel_asyncio(self, current_time, sink):
+        if self.event_loop is None:
+            return asyncio.run(self.measure_toplevel_asyncio_core(
+                current_time, sink))
+        return self.event_loop.run_until_complete(
+            self.measure_toplevel_asyncio_core(current_time, sink))
+
+    async def measure_toplevel_asyncio_core(self, current_time, sink):
+
+        tcp_timeout = self.cnfg.constants.tcp_timeout
+        udp_timeout = self.cnfg.constants.udp_timeout
+
+        lazy = self.cnfs.measurement.lazy_response_parsing
+        udp_queryer = functools.partial(aio_query.udp, lazy=lazy)
+        tcp_queryer = functools.partial(aio_query.tcp, lazy=lazy)
+        multiplexer = self.udp_multiplexer
+
+        if self.cnfs.measurement.udp_multiplexing and multiplexer is None:
+            multiplexer = mux_query.MultiplexedUDPQueryer(
+                self.cnfs.measurement.udp_port_pool_size,
+                self.cnfs.measurement.udp_id_retry,
+                lazy=lazy)
+
+        if multiplexer is not None:
+            sources = [source for source in (self.ipv4, self.ipv6)
+                       if source is not None]
+            # sockets bound to the address no longer used are released
+            multiplexer.retain(sources)
+            for source in sources:
+                await multiplexer.open(source)
+            udp_queryer = multiplexer.udp
+
+        queryer_info_by_protocol = \
+            {"udp": (udp_queryer,
+                     udp_timeout,
+                     self.cnfg.constants.udp_slr_threshold * 1000),
+             "tcp": (tcp_queryer,
+                     tcp_timeout,
+                     self.cnfg.constants.tcp_slr_threshold * 1000)}
+
+        max_inflight_queries = self.cnfs.measurement.max_inflight_queries
+        semaphore = asyncio.Semaphore(max_inflight_queries)
+        pacer = self.make_destination_pacer(scheduler.AsyncDestinationPacer)
+        deadline = self.get_round_deadline()
+        scheduled = self.schedule_measurement_tasks()
+        coroutines = []
+
+        self.log_round_cost(scheduled,
+                            dict(udp=udp_timeout, tcp=tcp_timeout),
+                            max_inflight_queries,
+                            deadline)
+
+        started_at = time.time()
+
+        for offset, task in scheduled:
+
+            queryer, timeout, slr_threshold = \
+                queryer_info_by_protocol[task.proto]
+
+            coroutines.append(self.measurement_core_async_with_sink(
+                sink,
+                semaphore,
+                current_time,
+                task.nameserver,
+                queryer,
+                task.dst,
+                task.src,
+                task.af,
+                task.asn,
+                task.asn_desc,
+                timeout,
+                task.proto,
+                task.qname,
+                task.rrtype,
+                task.qo,
+                slr_threshold,
+                pacer,
+                started_at,
+                offset,
+                deadline))
+
+        try:
+            results = await asyncio.gather(*coroutines)
+            measured = sum(results)
+            return measured, len(results) - measured
+        finally:
+            # shared sockets are kept warm across rounds in daemon mode
+            if (multiplexer is not None) and \
+                    (multiplexer is not self.udp_multiplexer):
+                multiplexer.close()
+
+    def refresh_global_ipaddress(self):
+
+        previous = (self.ipv4, self.ipv6)
+        self.set_global_ipaddress()
+
+        if (self.ipv4 is None) or (self.ipv6 is None):
+            self.logger.error("global address lost. keep using previous one")
+            self.ipv4, self.ipv6 = previous
+            return
+
+        if previous == (self.ipv4, self.ipv6):
+            return
+
+        self.logger.info("global ipaddress changed from %s to %s" %
+                         (str(previous), str((self.ipv4, self.ipv6))))
+
+        # net description cached in tmp data belongs to the previous address
+        self.load_tmpdata()
+        self.tmp_data.pop("net_desc", None)
+        self.write_tmpdata()
+        self.set_net_description()
+
+    def refresh_measurement_setting(self):
+
+        self.logger.info("refreshing measurement setting")
+
+        with self.refresh_mutex:
+            try:
+                self.load_measurement_info()
+            except errors.DNSProbeError as ex:
+                self.logger.warning("keep using current measurement info: %s" %
+                                    (ex.message))
+
+            self.refresh_global_ipaddress()
+
+    def refresh_worker(self):
+
+        refresh_interval = self.cnfs.daemon.refresh_interval
+
+        while True:
+            # woken up before the interval by SIGHUP or by stopping
+            self.refresh_event.wait(refresh_interval)
+            self.refresh_event.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                self.refresh_measurement_setting()
+            except Exception as ex:
+                self.logger.warning("unexpected error while refreshing: %s" %
+                                    (str(ex)))
+
+    def handle_stop_signal(self, signum, frame):
+        self.logger.info("signal %d received. stopping daemon" % (signum))
+        self.stop_event.set()
+        self.refresh_event.set()
+
+    def handle_refresh_signal(self, signum, frame):
+        # refreshed by the refresher. the round may be holding refresh_mutex
+        self.logger.info("signal %d received. refreshing measurement setting" %
+                         (signum))
+        self.refresh_event.set()
+
+    def get_first_round(self, current_time, round_interval):
+        """
+        current_time より後の最初のラウンドの開始時刻(壁時計の境界)
+        """
+
+        return (math.floor(current_time / round_interval) + 1) * \
+            round_interval
+
+    def get_next_round(self, next_round, current_time, round_interval):
+        """
+        next_round に始めたラウンドの次のラウンドの開始時刻
+
+        Returns
+        -------
+        next_round : float
+        skipped : int
+            超過により飛ばしたラウンドの数
+        """
+
+        next_round += round_interval
+        skipped = 0
+
+        if next_round <= current_time:
+            skipped = math.floor((current_time - next_round) /
+                                 round_interval) + 1
+            next_round += skipped * round_interval
+
+        return next_round, skipped
+
+    def replay_spool(self):
+
+        if self.spool.size() == 0:
+            return True
+
+        if self.cnfs.spool.offline and not self.check_data_store():
+            self.logger.info("data store unreachable. replaying postponed")
+            return False
+
+        return self.spool.replay(self.dao_dnsprobe.write_lines,
+                                 self.cnfs.spool.replay_batch_size)
+
+    def check_data_store(self):
+        try:
+            self.session.ping()
+            return True
+        except Exception as ex:
+            self.logger.info("unable to reach data store: %s" % (str(ex)))
+            return False
+
+    def write_lines_durably(self, lines):
+
+        if self.cnfs.spool.enabled and self.cnfs.spool.offline:
+            return self.spool.append(lines)
+
+        if self.dao_dnsprobe.write_lines(lines):
+            return True
+
+        self.data_store_available = False
+
+        if not self.cnfs.spool.enabled:
+            return False
+
+        self.logger.warning("writing failed. spooling the result")
+        return self.spool.append(lines)
+
+    def write_measurement_result(self, result):
+
+        if not self.cnfs.spool.enabled:
+            return self.dao_dnsprobe.write_measurement_data(result)
+
+        try:
+            lines = self.dao_dnsprobe.convert_to_lines(result)
+        except Exception as ex:
+            self.logger.error("unable to convert measured data: %s" %
+                              (str(ex)))
+            return False
+
+        return self.write_lines_durably(lines)
+
+    def load_rdata_digests(self):
+
+        if self.rdata_dictionary is None:
+            return
+
+        self.load_tmpdata()
+        self.rdata_dictionary.load(self.tmp_data.get("rdata_digests", {}))
+
+    def save_rdata_digests(self):
+
+        if self.rdata_dictionary is None:
+            return
+
+        self.tmp_data["rdata_digests"] = self.rdata_dictionary.dump()
+        self.write_tmpdata()
+
+    def write_rdata(self, current_time):
+        """
+        測定中に初めて現れたRDATAをダイジェスト毎に一度だけ書き込む
+        """
+
+        if self.rdata_dictionary is None:
+            return True
+
+        pending = self.rdata_dictionary.take_pending()
+
+        if not pending:
+            return True
+
+        points = [types.DNSRdata(current_time, digest, rrtype, blob)
+                  for (digest, (rrtype, blob)) in pending.items()]
+
+        try:
+            lines = self.dao_dnsprobe_rdata.convert_to_lines(points)
+        except Exception as ex:
+            self.logger.error("unable to convert rdata: %s" % (str(ex)))
+            self.rdata_dictionary.restore(pending)
+            return False
+
+        if self.cnfs.spool.enabled:
+            ret = self.write_lines_durably(lines)
+        else:
+            ret = self.dao_dnsprobe_rdata.write_lines(lines)
+
+        if ret:
+            self.rdata_dictionary.mark_written(pending.keys())
+            self.logger.info("%d new rdata written" % (len(pending)))
+        else:
+            # retry in the next round
+            self.rdata_dictionary.restore(pending)
+
+        return ret
+
+    def measure_streaming(self, current_time=None):
+
+        streaming_writer = writer.StreamingWriter(
+            self.write_lines_durably,
+            self.cnfs.measurement.streaming_batch_size,
+            self.cnfs.measurement.streaming_flush_interval)
+
+        def sink(measured_data):
+            try:
+                streaming_writer.put(
+                    self.dao_dnsprobe.convert_to_lines([measured_data]))
+            except Exception as ex:
+                self.logger.error("unable to convert measured data: %s" %
+                                  (str(ex)))
+
+        streaming_writer.start()
+        try:
+            self.measure_toplevel(sink, current_time)
+        finally:
+            ret = streaming_writer.close()
+
+        return ret
+
+    def measure_and_write(self, current_time=None, as_shard=False):
+        """
+        Parameters
+        ----------
+        as_shard : bool
+            True の場合は新たなRDATAを書き込まずに書き込み待ちのまま残し、
+            プローブの位置も書き込まない(ラウンドで一度親プロセスが書き込む)
+        """
+
+        if current_time is None:
+            current_time = self.make_current_time()
+
+        ret = as_shard or self.write_probe_location(current_time)
+
+        if self.cnfs.measurement.streaming:
+            ret = self.measure_streaming(current_time) and ret
+            if not as_shard:
+                ret = self.write_rdata(current_time) and ret
+            return ret
+
+        result = self.measure_toplevel(current_time=current_time)
+
+        # rdata is written ahead of the points referring it
+        ret = (as_shard or self.write_rdata(current_time)) and ret
+
+        return self.write_measurement_result(result) and ret
+
+    def write_probe_location(self, current_time):
+        """
+        スキーマv2ではプローブの位置をタグの代わりにラウンド毎に一度書き込む
+        """
+
+        if self.dao_dnsprobe.schema_version != 2:
+            return True
+
+        location = types.DNSProbe(current_time,
+                                  self.measurer_id,
+                                  self.cnfs.measurement.latitude,
+                                  self.cnfs.measurement.longitude)
+
+        try:
+            lines = self.dao_dnsprobe.make_probe_lines([location])
+        except Exception as ex:
+            self.logger.error("unable to convert location: %s" % (str(ex)))
+            return False
+
+        if self.cnfs.spool.enabled:
+            return self.write_lines_durably(lines)
+
+        return self.dao_dnsprobe.write_lines(lines)
+
+    def write_heartbeat(self, current_time, round_duration):
+        """
+        プローブの一覧(mes_dnsprobe_probe)にラウンドの状態を書き込む
+        """
+
+        heartbeat = types.DNSProbeHeartbeat(current_time,
+                                            self.measurer_id,
+                                            self.cnfs.measurement.latitude,
+                                            self.cnfs.measurement.longitude,
+                                            self.server_boottime,
+                                            self.net_desc_v4,
+                                            self.net_desc_v6,
+                                            round_duration,
+                                            self.measured_points)
+
+        try:
+            lines = self.dao_dnsprobe.make_probe_lines([heartbeat])
+        except Exception as ex:
+            self.logger.error("unable to convert heartbeat: %s" % (str(ex)))
+            return False
+
+        if self.cnfs.spool.enabled:
+            return self.write_lines_durably(lines)
+
+        return self.dao_dnsprobe.write_lines(lines)
+
+    def get_number_of_processes(self):
+
+        number_of_processes = self.cnfs.measurement.number_of_processes
+
+        if number_of_processes <= 0:
+            number_of_processes = os.cpu_count() or 1
+
+        return number_of_processes
+
+    def get_shard_state(self, shard, current_time):
+        """
+        シャードのプロセスでMeasurerを作り直すための状態(pickle可能なもの)
+        """
+
+        return dict(shard=util.recursive_asdict(shard),
+                    current_time=current_time,
+                    round_started_at=self.round_started_at,
+                    measurer_id=self.measurer_id,
+                    server_boottime=self.server_boottime,
+                    ipv4=self.ipv4,
+                    ipv6=self.ipv6,
+                    net_desc_v4=self.net_desc_v4,
+                    net_desc_v6=self.net_desc_v6,
+                    rdata_digests=None if self.rdata_dictionary is None
+                    else self.rdata_dictionary.dump())
+
+    def set_shard_state(self, state):
+
+        self.measurement_info = util.recursive_namedtuple(state["shard"])
+        self.round_started_at = state["round_started_at"]
+        self.measurer_id = state["measurer_id"]
+        self.server_boottime = state["server_boottime"]
+        self.ipv4 = state["ipv4"]
+        self.ipv6 = state["ipv6"]
+        self.net_desc_v4 = state["net_desc_v4"]
+        self.net_desc_v6 = state["net_desc_v6"]
+
+        if state["rdata_digests"] is None:
+            self.rdata_dictionary = None
+        elif self.rdata_dictionary is not None:
+            self.rdata_dictionary.load(state["rdata_digests"])
+
+    def get_shard_context(self):
+
+        # forking a process running the other threads (the refresher of the
+        # daemon) may deadlock the child on a lock held by them
+        if threading.active_count() == 1:
+            return multiprocessing.get_context("fork")
+
+        return multiprocessing.get_context("forkserver")
+
+    def run_shard(self, current_time, measured_points, sender):
+
+        self.data_store_available = True
+        self.setup_resource()
+        self.dao_dnsprobe = dao.Mes_dnsprobe(self)
+        self.dao_dnsprobe_rdata = dao.Mes_dnsprobe_rdata(self)
+
+        try:
+            # the new rdata is handed over to the parent process which
+            # writes it once for all the shards and remembers the digests
+            ret = self.measure_and_write(current_time, as_shard=True)
+            with measured_points.get_lock():
+                measured_points.value += self.measured_points
+        except Exception as ex:
+            self.logger.error("unexpected error in shard: %s" % (str(ex)))
+            self.logger.error(traceback.format_exc())
+            ret = False
+        finally:
+            sender.send({} if self.rdata_dictionary is None
+                        else self.rdata_dictionary.take_pending())
+            sender.close()
+            self.teardown_resource()
+
+        if not ret:
+            sys.exit(Measurer.SHARD_FAILED)
+        if not self.data_store_available:
+            sys.exit(Measurer.SHARD_SPOOLED)
+        sys.exit(Measurer.SHARD_SUCCEEDED)
+
+    def measure_sharded(self, number_of_processes, current_time):
+
+        context = self.get_shard_context()
+        # the number of points measured by the shards
+        measured_points = context.Value("q", 0)
+        processes = []
+
+        for n in range(number_of_processes):
+            shard = self.measurement_info[n::number_of_processes]
+            if not shard:
+                continue
+            state = self.get_shard_state(shard, current_time)
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=run_shard,
+                                      args=(state, measured_points, sender),
+                                      name="shard-%d" % (n))
+            process.start()
+            sender.close()
+            processes.append((process, receiver))
+
+        self.logger.info("measurement sharded into %d processes" %
+                         (len(processes)))
+
+        # digest -> (rrtype, blob) found by the shards
+        pending = {}
+        exitcodes = []
+        for (process, receiver) in processes:
+            # received before joining so that the shard never blocks on it
+            try:
+                pending.update(receiver.recv())
+            except EOFError:
+                self.logger.warning("no rdata handed over from %s" %
+                                    (process.name))
+            finally:
+                receiver.close()
+            process.join()
+            exitcodes.append(process.exitcode)
+
+        self.logger.info("exit codes of shards: %s" % (str(exitcodes)))
+        self.measured_points = measured_points.value
+
+        if any(code != Measurer.SHARD_SUCCEEDED for code in exitcodes):
+            self.data_store_available = False
+
+        # the shards leave the round-level points to the parent process
+        ret = self.write_probe_location(current_time)
+        if self.rdata_dictionary is not None:
+            self.rdata_dictionary.restore(pending)
+            ret = self.write_rdata(current_time) and ret
+
+        return ret and all(code in (Measurer.SHARD_SUCCEEDED,
+                                    Measurer.SHARD_SPOOLED)
+                           for code in exitcodes)
+
+    def run_measurement_round(self):
+
+        self.data_store_available = True
+        self.measured_points = 0
+        number_of_processes = self.get_number_of_processes()
+        current_time = self.make_current_time()
+        started_at = time.time()
+
+        with self.refresh_mutex:
+            if number_of_processes > 1:
+                ret = self.measure_sharded(number_of_processes,
+                                           current_time)
+            else:
+                ret = self.measure_and_write(current_time)
+            self.save_rdata_digests()
+
+            if not self.write_heartbeat(current_time,
+                                        time.time() - started_at):
+                self.logger.warning("unable to write heartbeat")
+
+        # data store seems to be down, replay it in the later round
+        if self.cnfs.spool.enabled and self.data_store_available:
+            self.replay_spool()
+
+        return ret
+
+    def run_daemon(self):
+
+        round_interval = self.cnfs.daemon.round_interval
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.handle_stop_signal)
+        signal.signal(signal.SIGHUP, self.handle_refresh_signal)
+
+        self.event_loop = asyncio.new_event_loop()
+        if self.cnfs.measurement.udp_multiplexing:
+            self.udp_multiplexer = mux_query.MultiplexedUDPQueryer(
+                self.cnfs.measurement.udp_port_pool_size,
+                self.cnfs.measurement.udp_id_retry,
+                lazy=self.cnfs.measurement.lazy_response_parsing)
+
+        refresher = threading.Thread(target=self.refresh_worker,
+                                     name="refresher",
+                                     daemon=True)
+        refresher.start()
+
+        # rounds are scheduled on absolute boundaries of the wall clock
+        # so that a slow round never shifts the following ones
+        next_round = self.get_first_round(time.time(), round_interval)
+
+        while not self.stop_event.wait(max(0, next_round - time.time())):
+
+            self.logger.info("measurement round started")
+            self.round_started_at = next_round
+
+            if not self.run_measurement_round():
+                self.logger.warning("measurement round failed")
+
+            self.logger.info("measurement round finished")
+
+            next_round, skipped = self.get_next_round(next_round,
+                                                      time.time(),
+                                                      round_interval)
+            if skipped:
+                self.logger.warning("round overran. %d round(s) skipped" %
+                                    (skipped))
+
+        refresher.join()
+
+        return 0
 
     def setup_application(self):
         self.set_measurer_id()
@@ -331,15 +1345,48 @@ class Measurer(framework.SetupwithInfluxdb):
         self.validate_id()
         self.set_net_description()
         self.load_measurement_info()
+        self.load_rdata_digests()
         self.dao_dnsprobe = dao.Mes_dnsprobe(self)
+        self.dao_dnsprobe_rdata = dao.Mes_dnsprobe_rdata(self)
 
     def run_application(self):
-        result = self.measure_toplevel()
-        ret = self.dao_dnsprobe.write_measurement_data(result)
+
+        if self.cnfs.daemon.enabled:
+            return self.run_daemon()
+
+        ret = self.run_measurement_round()
         if not ret:
             return 1
         return 0
 
+    def teardown_application(self):
+
+        self.stop_event.set()
+
+        if self.udp_multiplexer is not None:
+            self.udp_multiplexer.close()
+            self.udp_multiplexer = None
+
+        if self.event_loop is not None:
+            # let the closed transports finish their callbacks
+            self.event_loop.run_until_complete(asyncio.sleep(0))
+            self.event_loop.close()
+            self.event_loop = None
+
+        self.http_session.close()
+
+
+def run_shard(state, measured_points, sender):
+    """
+    シャードのプロセスの入口
+
+    forkserverでは親のMeasurerを引き継げないため、状態から作り直す
+    """
+
+    measurer = Measurer()
+    measurer.set_shard_state(state)
+    measurer.run_shard(state["current_time"], measured_points, sender)
+
 
 def main():
     try:
@@ -7,6 +7,7 @@ docstring is here
 import traceback
 import sys
 import os
+import gzip
 import flask
 from flask import render_template
 
@@ -20,6 +21,10 @@ MC = None
 
 class MeasurerController(framework.SetupwithMySQLdb):
 
+    COMPRESSIBLE_MIMETYPES = set(["application/json",
+                                  "text/html",
+                                  "text/css"])
+
     def __init__(self):
         super().__init__(__name__, __file__)
         self.server = flask.Flask(__name__,
@@ -47,7 +52,37 @@ class MeasurerController(framework.SetupwithMySQLdb):
                                             "measurement_target.tmpl"),
                                measurement_infos=data)
 
+    def compress_response(self, response):
+
+        accept_encoding = flask.request.headers.get("Accept-Encoding", "")
+
+        if ("gzip" not in accept_encoding.lower()) or \
+                (response.status_code != 200) or \
+                ("Content-Encoding" in response.headers) or \
+                (response.mimetype not in self.COMPRESSIBLE_MIMETYPES):
+            return response
+
+        response.direct_passthrough = False
+        data = response.get_data()
+
+        if len(data) < self.cnfs.server.compression_min_size:
+            return response
+
+        response.set_data(gzip.compress(data))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+
+        # gzip representation is not byte-identical with the static file.
+        # weak validator still lets the measurer revalidate with it
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(etag, weak=True)
+
+        return response
+
     def setup_application(self):
+        self.server.after_request(self.compress_response)
+
         self.server.add_url_rule("/",
                                  "index",
                                  self.index)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""
+スキーマv1(mes_dnsprobe)の測定結果をスキーマv2(mes_dnsprobe_v2)へ移行する
+
+v2の最古の時刻から古い方へ遡ってコピーするため、中断しても再実行で続きから
+移行できる。また移行中もv2は最古の時刻以降が欠けることなく読み出せる
+"""
+
+import datetime
+import time
+import traceback
+import sys
+
+import common.common.framework as framework
+import common.data.dao as dao
+
+
+def format_time(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class SchemaMigrator(framework.SetupwithInfluxdb):
+
+    def __init__(self):
+        super().__init__(__name__, __file__)
+
+    def setup_application(self):
+        self.dao_dnsprobe = dao.Mes_dnsprobe(self)
+
+    def make_batches(self, points):
+        """
+        時刻の降順の点を batch_size 程度ずつに分ける
+
+        同じ時刻の点は同じバッチに入れる(書き込みが途中で失敗しても、
+        v2の最古の時刻の点が欠けないように)
+        """
+
+        batch_size = self.cnfs.migration.batch_size
+        batch = []
+
+        for point in points:
+            if (batch_size <= len(batch)) and \
+                    (batch[-1].timestamp != point.timestamp):
+                yield batch
+                batch = []
+            batch.append(point)
+
+        if batch:
+            yield batch
+
+    def migrate(self, start_time, end_time):
+
+        points, probes = self.dao_dnsprobe.read_schema_v1_points(start_time,
+                                                                 end_time)
+
+        self.logger.info("%d points found in %s - %s" % (
+            len(points), start_time, end_time))
+
+        # the locations do not move the boundary of the schemas
+        if probes and \
+                (not self.dao_dnsprobe.write_schema_v2_points([], probes)):
+            return False
+
+        for batch in self.make_batches(points):
+            if not self.dao_dnsprobe.write_schema_v2_points(batch):
+                return False
+
+        return True
+
+    def run_application(self, **args):
+
+        if self.dao_dnsprobe.schema_version != 2:
+            self.logger.error("schema_version of general.ini must be 2")
+            return framework.BaseSetup.RET_ABNORMAL_END
+
+        boundary = self.dao_dnsprobe.get_schema_boundary()
+        oldest = self.dao_dnsprobe.get_first_time(
+            self.dao_dnsprobe.measurements[1])
+
+        if boundary is None:
+            self.logger.error("no data written in schema v2 yet")
+            return framework.BaseSetup.RET_ABNORMAL_END
+
+        if (oldest is None) or \
+                (dao.parse_time(boundary) <= dao.parse_time(oldest)):
+            self.logger.info("nothing to migrate")
+            return framework.BaseSetup.RET_NORMAL_END
+
+        self.logger.info("migrating %s - %s" % (oldest, boundary))
+
+        chunk = datetime.timedelta(minutes=self.cnfs.migration.chunk_minutes)
+        end_time = boundary
+        start = dao.parse_time(boundary)
+
+        while dao.parse_time(oldest) < start:
+            start = max(start - chunk, dao.parse_time(oldest))
+            start_time = format_time(start)
+
+            if not self.migrate(start_time, end_time):
+                self.logger.error("migration aborted at %s. run again to "
+                                  "resume" % (end_time))
+                return framework.BaseSetup.RET_ABNORMAL_END
+
+            end_time = start_time
+            time.sleep(self.cnfs.migration.interval_seconds)
+
+        self.logger.info("migration completed")
+
+        return framework.BaseSetup.RET_NORMAL_END
+
+
+def main():
+    try:
+        migrator = SchemaMigrator()
+    except Exception:
+        print(traceback.format_exc())
+        sys.exit(1)
+
+    migrator.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+応答からフィールドを取り出す処理のマイクロベンチマーク
+
+dnspythonで完全に復号する従来の経路と、wire形式から必要なフィールドのみを
+取り出す経路とで、1応答あたりの処理時間を比較する
+
+    python bench_common_net_query_wire_response.py [繰り返し回数]
+"""
+
+import sys
+import os
+import timeit
+import collections
+import dns.edns
+import dns.message
+import dns.rrset
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.data.types as types
+import common.data.rdata as rdata
+import common.net.query.query_template as query_template
+import common.net.query.wire_response as wire_response
+
+
+RdataStoring = collections.namedtuple("RdataStoring", "save_dnskey")
+
+RDATA = {
+    "SOA": ["a.dns.jp. root.dns.jp. 1700000000 3600 900 1814400 900"],
+    "NS": ["%s.dns.jp." % (name) for name in "abcdefgh"],
+    "DNSKEY": ["256 3 8 AwEAAbZ7ZcDHoSVsWwbaR8Lv2WRCLyd0Ka1k0LZM2jYZr9rh",
+               "257 3 8 AwEAAcLUtYo2T3gH2nSEG5PG6RDsxt4kdWJzVkEdnQrx8Oy5"]}
+
+
+def make_wire(rrtype):
+
+    query = query_template.QueryTemplate("jp", rrtype).make_query()
+    response = dns.message.make_response(
+        dns.message.from_wire(query.to_wire()))
+    response.answer.append(
+        dns.rrset.from_text("jp.", 86400, "IN", rrtype, *RDATA[rrtype]))
+    response.use_edns(0, options=[
+        dns.edns.GenericOption(dns.edns.NSID, b"a1.tyo")])
+
+    return response.to_wire()
+
+
+def main(number):
+
+    context = types.MeasurementContext("2024-01-01T00:00:00.0Z", "tyo-1",
+                                       "2497", "IIJ", "2023-01-01T00:00:00Z",
+                                       "35.689556", "139.691722",
+                                       RdataStoring(""),
+                                       rdata.RdataDictionary())
+
+    def measure(rrtype, make_response, wire):
+        types.make_DNSMeasurementData(context, 12.5, "a.dns.jp",
+                                      "203.119.1.1", "10.0.2.15", 4, "udp",
+                                      "jp", rrtype, None, make_response(wire),
+                                      500).to_line("mes_dnsprobe")
+
+    print("%-8s %12s %12s %8s" % ("rrtype", "dnspython", "wire", "ratio"))
+
+    for rrtype in RDATA:
+        wire = make_wire(rrtype)
+        result = []
+        for make_response in (dns.message.from_wire,
+                              wire_response.WireResponse):
+            elapsed = min(timeit.repeat(
+                lambda: measure(rrtype, make_response, wire),
+                number=number, repeat=3))
+            result.append(elapsed / number * 1000 * 1000)
+        print("%-8s %10.2fus %10.2fus %7.2fx" %
+              (rrtype, result[0], result[1], result[0] / result[1]))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if 1 < len(sys.argv) else 10000)
@@ -102,6 +102,7 @@ class TestIntegrateMeasurement(framework.SetupwithMySQLdb,
             self.assertTrue(hasattr(mes, "measurement_info"))
 
             mes.dao_dnsprobe = dao.Mes_dnsprobe(mes)
+            mes.dao_dnsprobe_rdata = dao.Mes_dnsprobe_rdata(mes)
 
             self.assertTrue(mes.run_application() == 0)
 
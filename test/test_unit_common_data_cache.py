@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+from influxdb.resultset import ResultSet
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.data.cache as cache
+
+
+class TestCommonDataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queried = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_query(self, value):
+        def query():
+            self.queried.append(value)
+            return ResultSet({"series": [{"name": "m",
+                                          "columns": ["time", "count"],
+                                          "values": [["t", value]]}]})
+        return query
+
+    def test_0_normalize_query(self):
+        self.assertEqual(
+            cache.normalize_query("select  count(x)\n from m",
+                                  dict(a=1, b=2)),
+            cache.normalize_query("select count(x) from m",
+                                  dict(b=2, a=1)))
+
+    def test_1_hit_and_expire(self):
+        query_cache = cache.QueryCache(0.2, 10)
+
+        for _ in range(3):
+            ret = query_cache.get_or_query("k", self.make_query(1))
+            self.assertEqual(list(ret.get_points())[0]["count"], 1)
+        self.assertEqual(query_cache.stats(), (2, 0, 1))
+
+        time.sleep(0.3)
+        query_cache.get_or_query("k", self.make_query(2))
+        self.assertEqual(self.queried, [1, 2])
+
+    def test_2_lru_eviction(self):
+        query_cache = cache.QueryCache(60, 2)
+
+        query_cache.get_or_query("a", self.make_query(1))
+        query_cache.get_or_query("b", self.make_query(2))
+        query_cache.get_or_query("a", self.make_query(1))
+        query_cache.get_or_query("c", self.make_query(3))
+        query_cache.get_or_query("a", self.make_query(1))
+        query_cache.get_or_query("b", self.make_query(2))
+
+        self.assertEqual(self.queried, [1, 2, 3, 2])
+
+    def test_3_shared(self):
+        writer = cache.QueryCache(60, 2, self.tmpdir.name)
+        reader = cache.QueryCache(60, 2, self.tmpdir.name)
+
+        writer.get_or_query("k", self.make_query(1))
+        ret = reader.get_or_query("k", self.make_query(2))
+
+        self.assertEqual(list(ret.get_points())[0]["count"], 1)
+        self.assertEqual(reader.stats(), (0, 1, 0))
+        self.assertEqual(self.queried, [1])
+
+        for key in ("x", "y", "z"):
+            writer.get_or_query(key, self.make_query(3))
+        self.assertEqual(len(os.listdir(self.tmpdir.name)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
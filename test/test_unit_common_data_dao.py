@@ -98,3 +98,67 @@ class TestCommonDataDao(unittest.TestCase,
                 start_time.isoformat() + "Z",
                 end_time.isoformat() + "Z"),
             int))
+
+    def test_12_get_ratiograph_matrix(self):
+        end_time = datetime.datetime.utcnow()
+        start_time = end_time - datetime.timedelta(seconds=3600*5)
+        matrix = self.dao_dnsprobe.get_ratiograph_matrix(
+            "SOA",
+            start_time.isoformat() + "Z",
+            end_time.isoformat() + "Z")
+        self.assertTrue(isinstance(matrix, dict))
+        for ((prb_id, dst_name, af, proto), counts) in matrix.items():
+            self.assertEqual(
+                sum(counts.values()),
+                self.dao_dnsprobe.get_ratiograph_failed(
+                    dst_name, [prb_id], af, proto, "SOA",
+                    start_time.isoformat() + "Z",
+                    end_time.isoformat() + "Z") +
+                counts["exceeded_slr"] + counts["successful"])
+
+    def test_13_count_measurements(self):
+        end_time = (datetime.datetime.utcnow()).isoformat() + "Z"
+        start_time = (datetime.datetime.utcnow() - datetime.timedelta(
+            minutes=24 * 60)).isoformat() + "Z"
+        targets = [(dst_name, af)
+                   for (dst_name, afs) in self.dao_mes_cq_nameserver_availability.
+                   get_af_dst_name_combination().items()
+                   for af in afs]
+        self.assertEqual(
+            self.dao_mes_cq_nameserver_availability.count_measurements(
+                targets, start_time, end_time),
+            [(self.dao_mes_cq_nameserver_availability.
+              count_total_measurements(dst_name, af, start_time, end_time),
+              self.dao_mes_cq_nameserver_availability.
+              count_failed_measurements(dst_name, af, start_time, end_time))
+             for (dst_name, af) in targets])
+
+    def test_14_query_batched(self):
+        queries = [("select count(time_took) from mes_dnsprobe \
+                     where dst_name = $dst_name and time > now() - 1h",
+                    dict(dst_name=dst_name))
+                   for dst_name in
+                   self.dao_dnsprobe.get_af_dst_name_combination()]
+        self.assertEqual(
+            [ret.raw.get("series") for ret in
+             self.dao_dnsprobe.query_batched(queries)],
+            [self.dao_dnsprobe.query(statement, params).raw.get("series")
+             for (statement, params) in queries])
+        self.assertEqual(
+            dao.make_batch_query([("select a from m where b = $b",
+                                   dict(b="x")),
+                                  ("select a from m where b = $b and c = $c",
+                                   dict(b="y", c="z"))]),
+            ("select a from m where b = $q0_b; "
+             "select a from m where b = $q1_b and c = $q1_c",
+             dict(q0_b="x", q1_b="y", q1_c="z")))
+
+    def test_15_query_rows(self):
+        statement = "select time_took from mes_dnsprobe \
+                     where time > now() - 1h group by af, proto"
+        self.assertEqual(
+            list(self.dao_dnsprobe.query_rows(statement)),
+            [(tags or {}, point)
+             for ((_, tags), points) in
+             self.dao_dnsprobe.query(statement).items()
+             for point in points])
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import datetime
+from influxdb.resultset import ResultSet
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.common.framework as framework
+import common.common.util as util
+import common.data.dao as dao
+
+
+def make_result(columns, series):
+    return ResultSet(dict(series=[
+        dict(name="mes_dnsprobe", tags=tags, columns=columns, values=values)
+        for (tags, values) in series]))
+
+
+class FakeSession:
+
+    """
+    ; で連結された問い合わせに、測定毎に与えた結果を返す
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    def query(self, statement, **options):
+        ret = [self.results[2 if "mes_dnsprobe_v2" in each else 1]
+               for each in statement.split(";")]
+        return ret if 1 < len(ret) else ret[0]
+
+
+class TestCommonDataDaoOffline(unittest.TestCase,
+                               framework.SetupwithInfluxdb):
+
+    """
+    InfluxDBなしで問い合わせ結果の処理を確かめる
+    """
+
+    def __init__(self, *positional, **keyword):
+        framework.SetupwithInfluxdb.__init__(self, __name__, __file__)
+        unittest.TestCase.__init__(self, *positional, **keyword)
+
+    def setUp(self):
+        self.cnfs = util.recursive_namedtuple(
+            dict(graph=dict(percentile_axis_step=50)))
+        self.dao_dnsprobe = dao.Mes_dnsprobe(self)
+        # the points are read from both of the schemas across the boundary
+        self.dao_dnsprobe.schema_boundary = (
+            util.utcnow_by_minute() -
+            datetime.timedelta(hours=1)).isoformat() + "Z"
+        self.dao_dnsprobe.schema_boundary_checked_at = time.monotonic()
+
+    def test_0_percentile_of_sorted(self):
+        self.assertIsNone(dao.percentile_of_sorted([], 50))
+
+        # the nearest rank, index = floor(n * p / 100 + 0.5) - 1
+        self.assertIsNone(dao.percentile_of_sorted([1], 0))
+        self.assertIsNone(dao.percentile_of_sorted([1], 1))
+        self.assertEqual(dao.percentile_of_sorted([1], 50), 1)
+        self.assertEqual(dao.percentile_of_sorted([1], 100), 1)
+
+        values = [1, 2, 3, 4]
+        self.assertIsNone(dao.percentile_of_sorted(values, 0))
+        self.assertIsNone(dao.percentile_of_sorted(values, 12))
+        self.assertEqual(dao.percentile_of_sorted(values, 13), 1)
+        self.assertEqual(dao.percentile_of_sorted(values, 25), 1)
+        self.assertEqual(dao.percentile_of_sorted(values, 50), 2)
+        self.assertEqual(dao.percentile_of_sorted(values, 75), 3)
+        self.assertEqual(dao.percentile_of_sorted(values, 87), 3)
+        self.assertEqual(dao.percentile_of_sorted(values, 88), 4)
+        self.assertEqual(dao.percentile_of_sorted(values, 100), 4)
+
+        values = list(range(1, 101))
+        for percentile in range(1, 101):
+            self.assertEqual(dao.percentile_of_sorted(values, percentile),
+                             percentile)
+
+    def test_1_percentilegraph_across_schemas(self):
+        rows = {
+            1: [(dict(af="4", proto="udp"), dict(time_took=5.0)),
+                (dict(af="4", proto="udp"), dict(time_took=1.0)),
+                (dict(af="6", proto="tcp"), dict(time_took=7.0)),
+                (dict(af="4"), dict(time_took=100.0))],
+            2: [(dict(af="4", proto="udp"), dict(time_took=3.0)),
+                (dict(af="4", proto="udp"), dict(time_took=4.0)),
+                (dict(af="4", proto="udp"), dict(time_took=2.0))]}
+        queried = []
+
+        def query_rows(statement, params=None, epoch=None):
+            version = 2 if "mes_dnsprobe_v2" in statement else 1
+            queried.append(version)
+            return iter(rows[version])
+
+        self.dao_dnsprobe.query_rows = query_rows
+        start_time = (util.utcnow_by_minute() -
+                      datetime.timedelta(hours=2)).isoformat() + "Z"
+        end_time = util.utcnow_by_minute().isoformat() + "Z"
+
+        result = self.dao_dnsprobe.get_percentilegraph_data(
+            "a.dns.jp", ["probe1"], "A", start_time, end_time)
+
+        self.assertEqual(queried, [1, 2])
+        # percentiles of 1, 2, 3, 4, 5 over both of the schemas
+        self.assertEqual(result, {("4", "udp"): ([3.0, 5.0], [50, 100]),
+                                  ("6", "tcp"): ([7.0, 7.0], [50, 100])})
+
+    def test_2_last_measured_soa_data(self):
+        columns = ["time", "serial"]
+        probe1 = dict(dst_name="a.dns.jp", af="4", proto="udp",
+                      prb_id="probe1")
+        probe2 = dict(dst_name="a.dns.jp", af="4", proto="udp",
+                      prb_id="probe2")
+        probe3 = dict(dst_name="a.dns.jp", af="6", proto="udp",
+                      prb_id="probe1")
+        self.session = FakeSession({
+            1: make_result(columns, [
+                (probe1, [["t1", 10], ["t2", 11], ["t3", 11]]),
+                (probe2, [["t1", 10], ["t2", None]]),
+                # never responded with a serial
+                (probe3, [["t1", None]]),
+                (dict(dst_name="a.dns.jp"), [["t1", 12]])]),
+            2: make_result(columns, [
+                (probe1, [["t4", 11], ["t5", None], ["t6", 10]])])})
+
+        result = self.dao_dnsprobe.get_last_measured_soa_data(2)
+
+        self.assertEqual(
+            sorted(result, key=lambda each: each["prb_id"]),
+            # the maximum serial and when it was first and last measured,
+            # across the boundary of the schemas
+            [dict(probe1, serial=11, first_measured_at="t2",
+                  last_measured_at="t4"),
+             dict(probe2, serial=10, first_measured_at="t1",
+                  last_measured_at="t1")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.data.spool as spool
+
+
+class TestCommonDataSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.spool = spool.Spool(self.tmpdir.name, 1024, 256)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_0_replay_in_order(self):
+        for n in range(20):
+            self.assertTrue(self.spool.append(["m,k=v f=%di %d" % (n, n)]))
+
+        written = []
+
+        def writer(lines):
+            written.extend(lines)
+            return True
+
+        self.assertTrue(self.spool.replay(writer, 3))
+        self.assertEqual(written, ["m,k=v f=%di %d" % (n, n)
+                                   for n in range(20)])
+        self.assertEqual(self.spool.segments(), [])
+
+    def test_1_replay_failed(self):
+        self.assertTrue(self.spool.append(["m,k=v f=1i 1"]))
+        self.assertFalse(self.spool.replay(lambda lines: False, 10))
+        self.assertEqual(len(self.spool.segments()), 1)
+
+    def test_2_max_bytes(self):
+        for n in range(100):
+            self.assertTrue(self.spool.append(["m,k=v f=%di %d" % (n, n)]))
+        self.assertTrue(self.spool.size() <= 1024)
+
+    def test_3_created_on_append(self):
+        directory = os.path.join(self.tmpdir.name, "lazy")
+        lazy = spool.Spool(directory, 1024, 256)
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(lazy.size(), 0)
+        self.assertTrue(lazy.replay(lambda lines: False, 10))
+        self.assertFalse(os.path.exists(directory))
+        self.assertTrue(lazy.append(["m,k=v f=1i 1"]))
+        self.assertEqual(len(lazy.segments()), 1)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.data.topology as topology
+
+
+class TestCommonDataTopology(unittest.TestCase):
+
+    def setUp(self):
+        self.topology = topology.TagTopology.from_series_keys([
+            "mes_dnsprobe,af=4,dst_name=a.dns.jp,prb_id=tyo-1,proto=udp,"
+            "rrtype=SOA",
+            "mes_dnsprobe,af=6,dst_name=a.dns.jp,prb_id=tyo-1,proto=tcp,"
+            "rrtype=SOA",
+            "mes_dnsprobe,af=4,dst_name=b.dns.jp,prb_id=osa\\,1,proto=udp,"
+            "rrtype=NS",
+            "mes_dnsprobe,af=4,dst_name=b.dns.jp,prb_id=osa\\,1,proto=udp,"
+            "rrtype=SOA",
+            "mes_cq_nameserver_availability,af=6,dst_name=c\\ dns\\=jp"])
+
+    def test_0_parse_series_key(self):
+        self.assertEqual(
+            topology.parse_series_key("m\\ 1,k\\=1=v\\,1\\ 2,k2=v2"),
+            ("m 1", {"k=1": "v,1 2", "k2": "v2"}))
+        self.assertEqual(topology.parse_series_key("m"), ("m", {}))
+
+    def test_1_values(self):
+        self.assertEqual(self.topology.series, 5)
+        self.assertEqual(self.topology.values("dst_name"),
+                         ["a.dns.jp", "b.dns.jp", "c dns=jp"])
+        self.assertEqual(self.topology.values("prb_id"), ["osa,1", "tyo-1"])
+        self.assertEqual(self.topology.values("rrtype", dst_name="b.dns.jp"),
+                         ["NS", "SOA"])
+        self.assertEqual(self.topology.values("af", dst_name="x.dns.jp"),
+                         [])
+
+    def test_2_combinations(self):
+        self.assertEqual(
+            self.topology.combinations(("af", "proto"),
+                                       dst_name="a.dns.jp",
+                                       prb_id=["tyo-1", "osa,1"]),
+            {("4", "udp"), ("6", "tcp")})
+        self.assertEqual(
+            self.topology.combinations(("dst_name", "proto"), af="6"),
+            {("a.dns.jp", "tcp"), ("c dns=jp", None)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import collections
+import dns.edns
+import dns.exception
+import dns.message
+import dns.rrset
+import dns.rdatatype
+import datetime
+import random
+from influxdb import line_protocol
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.data.types as types
+import common.data.rdata as rdata
+import common.net.query.wire_response as wire_response
+
+
+RdataStoring = collections.namedtuple("RdataStoring", "save_dnskey")
+
+
+class TestCommonDataTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.context = types.MeasurementContext("2024-01-01T00:00:00.0Z",
+                                                "tyo-1",
+                                                "2497",
+                                                "IIJ",
+                                                "2023-01-01T00:00:00Z",
+                                                "35.689556",
+                                                "139.691722",
+                                                RdataStoring(""))
+
+    def make_response(self, rrtype, rdata):
+        query = dns.message.make_query("jp", rrtype, use_edns=True)
+        response = dns.message.make_response(query)
+        response.answer.append(dns.rrset.from_text("jp.", 3600, "IN",
+                                                   rrtype, rdata))
+        response.use_edns(edns=0,
+                          options=[dns.edns.GenericOption(dns.edns.NSID,
+                                                          b"a1.tyo")])
+        return dns.message.from_wire(response.to_wire())
+
+    def test_0_make_DNSMeasurementData(self):
+        response = self.make_response(
+            "SOA", "z.dns.jp. root.dns.jp. 1700000000 3600 900 1814400 900")
+
+        data = types.make_DNSMeasurementData(self.context, 12.5,
+                                             "a.dns.jp", "203.119.1.1",
+                                             "10.0.2.15", 4, "udp", "jp",
+                                             "SOA", None, response, 500)
+
+        self.assertIsInstance(data, types.SOA_DNSMeasurementData)
+        self.assertFalse(hasattr(data, "__dict__"))
+        self.assertFalse(hasattr(data, "response"))
+
+        point = data.convert_influx_notation("mes_dnsprobe")
+        self.assertEqual(point["time"], "2024-01-01T00:00:00.0Z")
+        self.assertEqual(point["tags"]["nsid"], "a1.tyo")
+        self.assertEqual(point["tags"]["prb_id"], "tyo-1")
+        self.assertEqual(point["tags"]["got_response"], True)
+        self.assertEqual(point["fields"]["serial"], 1700000000)
+        self.assertEqual(point["fields"]["ttl"], 3600)
+        self.assertEqual(point["fields"]["mname"], "z.dns.jp.")
+        self.assertEqual(point["fields"]["probe_asn"], "2497")
+
+    def test_1_make_DNSMeasurementData_error(self):
+        data = types.make_DNSMeasurementData(self.context, 2500.0,
+                                             "a.dns.jp", "203.119.1.1",
+                                             "10.0.2.15", 4, "udp", "jp",
+                                             "NS", dns.exception.Timeout(),
+                                             None, 500)
+
+        point = data.convert_influx_notation("mes_dnsprobe")
+        self.assertEqual(point["tags"]["nsid"], "unknown")
+        self.assertEqual(point["tags"]["got_response"], False)
+        self.assertEqual(point["tags"]["slr_exceeded"], True)
+        self.assertEqual(point["tags"]["error_class_name"], "Timeout")
+        self.assertIn("reason", point["fields"])
+        self.assertEqual(point["fields"]["got_response_field"], 0)
+
+    def assertLineCompatible(self, points):
+        expected = line_protocol.make_lines(dict(points=[
+            point.convert_influx_notation("mes_dnsprobe")
+            for point in points])).encode("utf8")
+        self.assertEqual(types.make_line_bytes("mes_dnsprobe", points),
+                         expected)
+
+    def test_2_make_line_bytes(self):
+        responses = [
+            ("SOA", self.make_response(
+                "SOA", "z.dns.jp. root.dns.jp. 1700000000 3600 900 1 900")),
+            ("NS", self.make_response("NS", "a.dns.jp.")),
+            ("DNSKEY", self.make_response(
+                "DNSKEY", "257 3 8 AwEAAbTL1bX0qYmP0/Q0XmWhKYvQ")),
+            ("A", self.make_response("A", "192.0.2.1"))]
+        errors = [None,
+                  dns.exception.Timeout(),
+                  OSError("a \"quoted\", multi\nline=reason\\"),
+                  ValueError("")]
+
+        points = []
+        for (rrtype, response) in responses:
+            for err in errors:
+                for src in ("10.0.2.15", None):
+                    points.append(types.make_DNSMeasurementData(
+                        self.context, 12.5, "a.dns.jp", "203.119.1.1", src,
+                        4, "udp", "jp", rrtype, err,
+                        None if err else response, 500, 3.0))
+
+        self.assertLineCompatible(points)
+
+    def test_3_make_line_bytes_escaping(self):
+        context = types.MeasurementContext("2024-02-29T23:59:59.999999Z",
+                                           "tyo 1,a=b\\",
+                                           "",
+                                           "AS \"2497\"\n",
+                                           "2023-01-01T00:00:00Z",
+                                           "",
+                                           "139.691722",
+                                           RdataStoring("yes"))
+        data = types.make_DNSMeasurementData(context, 0.1, "a b,c=d\\",
+                                             "2001:db8::1", "::1", 6, "tcp",
+                                             "jp", "DNSKEY",
+                                             None, self.make_response(
+                                                 "DNSKEY",
+                                                 "256 3 8 AwEAAbTL1bX0qYmP"),
+                                             500)
+
+        self.assertLineCompatible([data])
+
+    def test_4_convert_timestamp(self):
+        start = datetime.datetime(2019, 1, 1)
+        for _ in range(1000):
+            timestamp = start + datetime.timedelta(
+                microseconds=random.randrange(10 ** 15))
+            string_time = timestamp.isoformat() + "Z"
+            expected = str(int(line_protocol._convert_timestamp(string_time)))
+            self.assertEqual(types.convert_timestamp(string_time), expected)
+
+    def test_5_content_addressed_rdata(self):
+        dictionary = rdata.RdataDictionary()
+        context = types.MeasurementContext("2024-01-01T00:00:00.0Z",
+                                           "tyo-1", "2497", "IIJ",
+                                           "2023-01-01T00:00:00Z",
+                                           "35.689556", "139.691722",
+                                           RdataStoring(""),
+                                           dictionary)
+        response = self.make_response("NS", "a.dns.jp.")
+
+        points = [types.make_DNSMeasurementData(context, 12.5, "a.dns.jp",
+                                                dst, "10.0.2.15", 4, "udp",
+                                                "jp", "NS", None, response,
+                                                500)
+                  for dst in ("203.119.1.1", "203.119.1.2")]
+        fields = [point.convert_influx_notation("mes_dnsprobe")["fields"]
+                  for point in points]
+
+        digest = types.rdata_digest(["a.dns.jp."])
+        self.assertEqual(fields[0]["data_digest"], digest)
+        self.assertEqual(fields[1]["data_digest"], digest)
+        self.assertNotIn("data", fields[0])
+        self.assertLineCompatible(points)
+
+        pending = dictionary.take_pending()
+        self.assertEqual(list(pending.keys()), [digest])
+        self.assertEqual(types.rdata_decode(pending[digest][1]),
+                         ["a.dns.jp."])
+
+        dictionary.mark_written(pending.keys())
+        types.make_DNSMeasurementData(context, 12.5, "a.dns.jp",
+                                      "203.119.1.1", "10.0.2.15", 4, "tcp",
+                                      "jp", "NS", None, response, 500)
+        self.assertEqual(dictionary.take_pending(), {})
+        self.assertIn(digest, dictionary.dump())
+
+    def test_6_wire_response(self):
+        for (rrtype, text) in (
+                ("SOA", "z.dns.jp. root.dns.jp. 1700000000 3600 900 1 900"),
+                ("NS", "a.dns.jp."),
+                ("DNSKEY", "257 3 8 AwEAAbTL1bX0qYmP0/Q0XmWhKYvQ"),
+                ("A", "192.0.2.1")):
+            response = self.make_response(rrtype, text)
+            wire = wire_response.WireResponse(response.to_wire())
+            for save_dnskey in ("", "yes"):
+                # rdata is not inlined so that the lines do not depend on
+                # the mtime of gzip
+                context = types.MeasurementContext(
+                    "2024-01-01T00:00:00.0Z", "tyo-1", "2497", "IIJ",
+                    "2023-01-01T00:00:00Z", "35.689556", "139.691722",
+                    RdataStoring(save_dnskey), rdata.RdataDictionary())
+                expected, lazy = [types.make_DNSMeasurementData(
+                    context, 12.5, "a.dns.jp", "203.119.1.1", "10.0.2.15",
+                    4, "udp", "jp", rrtype, None, res, 500, 3.0).to_line(
+                        "mes_dnsprobe") for res in (response, wire)]
+                self.assertEqual(lazy, expected)
+
+    def test_7_parser_registry(self):
+        responses = [
+            ("A", "192.0.2.2", "192.0.2.1"),
+            ("AAAA", "2001:db8::1"),
+            ("DS", "12345 8 2 49FD46E6C4B45C55D4AC69CBD3CD34AC1AFE51DE"),
+            ("TXT", "\"v=spf1 -all\""),
+            ("ZONEMD", "\\# 38 6553f100 01 01 " + "ab" * 32)]
+        expected = [["192.0.2.1", "192.0.2.2"],
+                    ["2001:db8::1"],
+                    [dict(key_tag=12345, algorithm=8, digest_type=2,
+                          digest="49fd46e6c4b45c55d4ac69cbd3cd34ac1afe51de")],
+                    [["v=spf1 -all"]],
+                    [dict(serial=1700000000, scheme=1, hash_algorithm=1,
+                          digest="ab" * 32)]]
+
+        types.PARSER_TIMING.snapshot(reset=True)
+        for ((rrtype, *rdatas), data) in zip(responses, expected):
+            query = dns.message.make_query("jp", rrtype)
+            response = dns.message.make_response(query)
+            response.answer.append(dns.rrset.from_text("jp.", 3600, "IN",
+                                                       rrtype, *rdatas))
+            for res in (dns.message.from_wire(response.to_wire()),
+                        wire_response.WireResponse(response.to_wire())):
+                point = types.make_DNSMeasurementData(
+                    self.context, 12.5, "a.dns.jp", "203.119.1.1",
+                    "10.0.2.15", 4, "udp", "jp", rrtype, None, res,
+                    500).convert_influx_notation("mes_dnsprobe")
+                self.assertIs(types.PARSERS_BY_NAME[rrtype],
+                              types.PARSERS[dns.rdatatype.from_text(rrtype)])
+                self.assertEqual(point["fields"]["type"], rrtype)
+                self.assertEqual(
+                    types.rdata_decode(point["fields"]["data"]), data)
+
+        timing = types.PARSER_TIMING.snapshot()
+        self.assertEqual(sorted(timing.keys()),
+                         sorted(rrtype for (rrtype, *_) in responses))
+        self.assertEqual(timing["A"][0], 2)
+
+        data = types.make_DNSMeasurementData(self.context, 12.5, "a.dns.jp",
+                                             "203.119.1.1", "10.0.2.15", 4,
+                                             "udp", "jp", "MX",
+                                             dns.exception.Timeout(), None,
+                                             500)
+        self.assertIs(type(data), types.DNSMeasurementData)
+
+    def test_8_schema_v2(self):
+        points = []
+        for (rrtype, rdata_text) in (("SOA", "z.dns.jp. root.dns.jp. "
+                                      "1700000000 3600 900 1 900"),
+                                     ("NS", "a.dns.jp.")):
+            response = self.make_response(rrtype, rdata_text)
+            for err in (None, dns.exception.Timeout(), OSError("a=b, c")):
+                for src in ("10.0.2.15", None):
+                    points.append(types.make_DNSMeasurementData(
+                        self.context, 12.5, "a.dns.jp", "203.119.1.1", src,
+                        4, "udp", "jp", rrtype, err,
+                        None if err else response, 500, 3.0))
+
+        v2_points = [point.convert_influx_notation("mes_dnsprobe_v2", 2)
+                     for point in points]
+        expected = line_protocol.make_lines(dict(points=v2_points))
+        self.assertEqual(
+            types.make_line_bytes("mes_dnsprobe_v2", points, 2),
+            expected.encode("utf8"))
+
+        for point in v2_points:
+            self.assertTrue(set(point["tags"]) <=
+                            set(types.SCHEMA_V2_TAG_KEYS))
+            self.assertIn(point["fields"]["nsid"], ("a1.tyo", "unknown"))
+
+        # v1 points as read from the influxdb
+        migrated = []
+        for point in points:
+            v1_point = point.convert_influx_notation("mes_dnsprobe")
+            timestamp = int(line_protocol._convert_timestamp(
+                v1_point["time"]))
+            migrated.append(types.MigratedDNSMeasurementData(
+                timestamp,
+                {key: str(value)
+                 for (key, value) in v1_point["tags"].items()
+                 if value is not None},
+                dict(v1_point["fields"])))
+        self.assertEqual(types.make_line_bytes("mes_dnsprobe_v2", migrated),
+                         expected.encode("utf8"))
+
+    def test_9_probe_heartbeat(self):
+        heartbeat = types.DNSProbeHeartbeat("2024-01-01T00:00:00.0Z",
+                                            "tyo-1", "35.689556",
+                                            "139.691722",
+                                            "2023-01-01T00:00:00Z",
+                                            (2497, "IIJ"),
+                                            ("unknown", "unknown"),
+                                            3.14159, 1200)
+        point = heartbeat.convert_influx_notation("mes_dnsprobe_probe")
+        self.assertEqual(point["tags"], dict(prb_id="tyo-1"))
+        self.assertEqual(point["fields"]["asn_v4"], "2497")
+        self.assertEqual(point["fields"]["round_duration"], 3.142)
+        self.assertEqual(
+            types.make_line_bytes("mes_dnsprobe_probe", [heartbeat]),
+            line_protocol.make_lines(dict(points=[point])).encode("utf8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.data.writer as writer
+
+
+class TestCommonDataWriter(unittest.TestCase):
+
+    def test_0_batch_size(self):
+        batches = []
+
+        streaming_writer = writer.StreamingWriter(
+            lambda lines: batches.append(lines) or True, 10, 60)
+        streaming_writer.start()
+        for n in range(25):
+            streaming_writer.put(["line %d" % n])
+
+        self.assertTrue(streaming_writer.close())
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+        self.assertEqual(streaming_writer.written_lines, 25)
+
+    def test_1_failed(self):
+        streaming_writer = writer.StreamingWriter(lambda lines: False, 10, 60)
+        streaming_writer.start()
+        streaming_writer.put(["line"])
+
+        self.assertFalse(streaming_writer.close())
+        self.assertEqual(streaming_writer.failed_lines, 1)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import unittest
+import asyncio
+import sys
+import os
+import dns.exception
+import dns.message
+import dns.rrset
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.net.query.mux_query as mux_query
+
+
+class Responder(asyncio.DatagramProtocol):
+
+    """
+    受信したクエリを handler に渡すだけのUDPサーバ
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.handler(self.transport, dns.message.from_wire(data), addr)
+
+
+def make_response(query, address):
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(
+        query.question[0].name, 300, "IN", "A", address))
+    return response.to_wire()
+
+
+class TestCommonNetQueryMuxQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.queryer = mux_query.MultiplexedUDPQueryer(port_pool_size=2)
+
+    async def query(self, qname, port, timeout=1.0):
+        q = dns.message.make_query(qname, "A")
+        response = await self.queryer.udp(q, "127.0.0.1", timeout=timeout,
+                                          port=port, source="127.0.0.1")
+        return response.answer[0][0].address
+
+    def run_queries(self, handler, *coroutines):
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: Responder(handler), local_addr=("127.0.0.1", 0))
+            port = transport.get_extra_info("sockname")[1]
+            try:
+                return await asyncio.gather(
+                    *[coroutine(port) for coroutine in coroutines],
+                    return_exceptions=True)
+            finally:
+                transport.close()
+                # the queries still waiting on the shared sockets
+                self.pending = sum(len(protocol.pending)
+                                   for pool in self.queryer.pools.values()
+                                   for protocol in pool)
+                self.queryer.close()
+
+        return asyncio.run(run())
+
+    def test_0_demultiplex(self):
+        received = []
+
+        def handler(transport, query, addr):
+            received.append((query, addr))
+            if len(received) < 3:
+                return
+            # answered in the reverse order on the shared sockets
+            for (each, each_addr) in reversed(received):
+                address = "192.0.2.%s" % (
+                    each.question[0].name.labels[0].decode()[1:])
+                transport.sendto(make_response(each, address), each_addr)
+
+        result = self.run_queries(
+            handler,
+            *[lambda port, n=n: self.query("q%d.example." % (n), port)
+              for n in range(1, 4)])
+
+        self.assertEqual(result, ["192.0.2.1", "192.0.2.2", "192.0.2.3"])
+
+    def test_1_ignore_mismatched(self):
+
+        def handler(transport, query, addr):
+            # another message id
+            stale = dns.message.from_wire(query.to_wire())
+            stale.id = (query.id + 1) & 0xFFFF
+            transport.sendto(make_response(stale, "192.0.2.1"), addr)
+            # another question with the same message id
+            other = dns.message.make_query("other.example.", "A")
+            other.id = query.id
+            transport.sendto(make_response(other, "192.0.2.2"), addr)
+            # another source port
+            loop = asyncio.get_running_loop()
+            loop.create_task(send_from_other_port(query, addr))
+            # the real one comes last
+            loop.call_later(0.1, transport.sendto,
+                            make_response(query, "192.0.2.4"), addr)
+
+        async def send_from_other_port(query, addr):
+            loop = asyncio.get_running_loop()
+            transport, _ = await loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol, local_addr=("127.0.0.1", 0))
+            transport.sendto(make_response(query, "192.0.2.3"), addr)
+            transport.close()
+
+        result = self.run_queries(
+            handler, lambda port: self.query("q.example.", port))
+
+        self.assertEqual(result, ["192.0.2.4"])
+
+    def test_2_partial_timeout(self):
+
+        def handler(transport, query, addr):
+            if query.question[0].name.labels[0] == b"answered":
+                transport.sendto(make_response(query, "192.0.2.1"), addr)
+
+        result = self.run_queries(
+            handler,
+            lambda port: self.query("answered.example.", port, 0.5),
+            lambda port: self.query("dropped.example.", port, 0.5))
+
+        self.assertEqual(result[0], "192.0.2.1")
+        self.assertIsInstance(result[1], dns.exception.Timeout)
+        self.assertEqual(self.pending, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
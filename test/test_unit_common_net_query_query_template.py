@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import dns.name
+import dns.message
+import dns.rdatatype
+import dns.edns
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.net.query.query_template as query_template
+
+
+class TestCommonNetQueryQueryTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = query_template.QueryTemplateCache()
+
+    def test_0_make_wire(self):
+        qo = dns.message.make_query(dns.name.from_text("jp"),
+                                    dns.rdatatype.from_text("SOA"),
+                                    use_edns=True)
+        qo.flags &= 0xFEFF
+        qo.use_edns(edns=0,
+                    options=[dns.edns.GenericOption(dns.edns.NSID,
+                                                    bytes())])
+
+        template = self.cache.get("jp", "SOA")
+        self.assertEqual(template.make_wire(qo.id), qo.to_wire())
+
+    def test_1_get(self):
+        template = self.cache.get("jp", "SOA")
+        self.assertIs(self.cache.get("jp", "SOA"), template)
+        self.assertIsNot(self.cache.get("jp", "NS"), template)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_2_is_response(self):
+        query = self.cache.get("jp", "SOA").make_query()
+        response = dns.message.make_response(
+            dns.message.from_wire(query.to_wire()))
+        self.assertTrue(query.is_response(response))
+        response.id = (query.id + 1) % 0x10000
+        self.assertFalse(query.is_response(response))
+
+    def test_3_unknown_rrtype(self):
+        self.assertRaises(dns.rdatatype.UnknownRdatatype,
+                          self.cache.get, "jp", "UNKNOWNTYPE")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.net.query.scheduler as scheduler
+
+
+class TestCommonNetQueryScheduler(unittest.TestCase):
+
+    def test_0_spread_evenly(self):
+        tasks = [("a", 0), ("a", 1), ("a", 2), ("b", 0), ("c", 0)]
+        scheduled = scheduler.spread_evenly(tasks, lambda t: t[0], 10)
+
+        self.assertEqual([task for (_, task) in scheduled],
+                         [("a", 0), ("b", 0), ("c", 0), ("a", 1), ("a", 2)])
+        self.assertEqual([offset for (offset, _) in scheduled],
+                         [0.0, 2.0, 4.0, 6.0, 8.0])
+
+    def test_1_spread_evenly_with_jitter(self):
+        tasks = [("a", n) for n in range(100)]
+        scheduled = scheduler.spread_evenly(tasks, lambda t: t[0], 10, 1.0)
+
+        for n, (offset, _) in enumerate(scheduled):
+            self.assertTrue(n * 0.1 <= offset < (n + 1) * 0.1)
+
+    def test_2_spread_evenly_disabled(self):
+        tasks = [("a", 0), ("b", 0)]
+        scheduled = scheduler.spread_evenly(tasks, lambda t: t[0], 0)
+        self.assertEqual([offset for (offset, _) in scheduled], [0.0, 0.0])
+
+    def test_3_reserve(self):
+        pacer = scheduler.DestinationPacer(max_per_second=10)
+
+        self.assertEqual(pacer.reserve("a"), 0)
+        self.assertAlmostEqual(pacer.reserve("a"), 0.1, places=2)
+        self.assertAlmostEqual(pacer.reserve("a"), 0.2, places=2)
+        self.assertEqual(pacer.reserve("b"), 0)
+
+        unlimited = scheduler.DestinationPacer()
+        self.assertEqual(unlimited.reserve("a"), 0)
+        self.assertEqual(unlimited.reserve("a"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import dns.name
+import dns.message
+import dns.rdatatype
+import dns.rrset
+import dns.edns
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import common.net.query.query_template as query_template
+import common.net.query.wire_response as wire_response
+
+
+class TestCommonNetQueryWireResponse(unittest.TestCase):
+
+    def make_response(self, rrtype, *rdatas, nsid=b"ns1"):
+        query = query_template.QueryTemplate("jp", rrtype).make_query()
+        response = dns.message.make_response(
+            dns.message.from_wire(query.to_wire()))
+        response.answer.append(
+            dns.rrset.from_text("jp.", 300, "IN", rrtype, *rdatas))
+        response.use_edns(0, options=[
+            dns.edns.GenericOption(dns.edns.NSID, nsid)])
+        return query, response.to_wire()
+
+    def test_0_header(self):
+        query, wire = self.make_response("SOA", "a.dns.jp. root.dns.jp. "
+                                         "1700000000 3600 900 1814400 900")
+        res = wire_response.WireResponse(wire)
+        message = dns.message.from_wire(wire)
+        self.assertEqual(res.id, message.id)
+        self.assertEqual(res.flags, message.flags)
+        self.assertEqual(res.rcode(), message.rcode())
+        self.assertEqual(res.nsid, b"ns1")
+        self.assertTrue(query.is_response(res))
+
+    def test_1_soa(self):
+        _, wire = self.make_response("SOA", "a.dns.jp. root.dns.jp. "
+                                     "1700000000 3600 900 1814400 900")
+        res = wire_response.WireResponse(wire)
+        records = res.get_answer((b"jp",), dns.rdatatype.SOA)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].ttl, 300)
+        mname, rname, serial = res.soa(records[0])[:3]
+        self.assertEqual(wire_response.name_to_text(mname), "a.dns.jp.")
+        self.assertEqual(wire_response.name_to_text(rname), "root.dns.jp.")
+        self.assertEqual(serial, 1700000000)
+
+    def test_2_answer_digest(self):
+        _, wire1 = self.make_response("NS", "a.dns.jp.", "b.dns.jp.")
+        _, wire2 = self.make_response("NS", "b.dns.jp.", "A.DNS.JP.")
+        _, wire3 = self.make_response("NS", "a.dns.jp.", "c.dns.jp.")
+        digests = []
+        for wire in (wire1, wire2, wire3):
+            res = wire_response.WireResponse(wire)
+            digests.append(res.answer_digest(
+                res.get_answer((b"jp",), dns.rdatatype.NS)))
+        self.assertEqual(digests[0], digests[1])
+        self.assertNotEqual(digests[0], digests[2])
+
+    def test_3_malformed(self):
+        _, wire = self.make_response("NS", "a.dns.jp.")
+        self.assertRaises(dns.message.ShortHeader,
+                          wire_response.WireResponse, wire[:-3])
+        self.assertRaises(dns.message.TrailingJunk,
+                          wire_response.WireResponse, wire + b"\x00")
+        # pointer to itself
+        looped = wire[:12] + b"\xc0\x0c" + wire[14:]
+        self.assertRaises(dns.name.BadPointer,
+                          wire_response.WireResponse, looped)
+
+    def test_4_name_to_text(self):
+        name = dns.name.from_text("a\\.b.x\\032y.jp.")
+        self.assertEqual(wire_response.name_to_text(name.labels[:-1]),
+                         name.to_text())
+        self.assertEqual(wire_response.name_to_text(()), ".")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,9 +5,14 @@ import ipaddress
 import re
 import sys
 import os
+import pickle
+import tempfile
 import datetime
 import multiprocessing as mp
 import time
+import signal
+import threading
+import unittest.mock
 import dns.query
 import namedtupled
 
@@ -15,6 +20,10 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
 
 import main_measurer as measurer
 import main_measurer_controller as mc
+import common.data.dao as dao
+import common.data.rdata as rdata
+import common.data.spool as spool
+import common.common.util as util
 import common.data.errors as errors
 
 
@@ -23,9 +32,22 @@ class TestMainMeasurer(unittest.TestCase):
     def setUp(self):
         self.measurer = measurer.Measurer()
         self.measurer.setup_resource()
+        # results spooled by the tests never reach the working tree
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.measurer.spool = spool.Spool(self.tmpdir.name, 1024 * 1024,
+                                          1024 * 1024, False)
 
     def tearDown(self):
         self.measurer.teardown_resource()
+        self.tmpdir.cleanup()
+
+    def set_shard_context(self):
+        self.measurer.set_measurer_id()
+        self.measurer.set_server_boottime()
+        self.measurer.ipv4 = "192.0.2.1"
+        self.measurer.ipv6 = "2001:db8::1"
+        self.measurer.net_desc_v4 = ("64496", "test AS")
+        self.measurer.net_desc_v6 = ("64496", "test AS")
 
     def test_0_set_measurer_id(self):
         id_pattern = re.compile("^[a-z][a-z][a-z]\-[0-9]+$")
@@ -79,10 +101,27 @@ class TestMainMeasurer(unittest.TestCase):
         proc.terminate()
 
     def test_6_load_measurement_info(self):
+        self.measurer.cnfs = self.measurer.cnfs._replace(
+            controller=self.measurer.cnfs.controller._replace(
+                fallback_to_cache=False))
         self.assertRaises(errors.DNSProbeError, 
                           self.measurer.load_measurement_info)
         self.assertFalse(hasattr(self.measurer, "measurement_info"))
 
+    def test_6_1_load_measurement_info_fallback(self):
+        self.measurer.load_tmpdata()
+        self.measurer.tmp_data["measurement_info"] = dict(
+            etag=None,
+            last_modified=None,
+            body=[{"nameserver": "a.dns.jp",
+                   "destination": ["203.119.1.1"],
+                   "proto": "udp",
+                   "query": {"qname": "jp", "rrtype": "SOA"}}])
+        self.measurer.write_tmpdata()
+
+        self.measurer.load_measurement_info()
+        self.assertEqual(len(self.measurer.measurement_info), 1)
+
     def test_7_measurement_core(self):
 
         self.measurer.set_measurer_id()
@@ -235,3 +274,267 @@ class TestMainMeasurer(unittest.TestCase):
 
         self.assertTrue(
             self.measurer.measure_toplevel())
+
+    def test_11_measurement_toplevel_asyncio(self):
+        raw_measurement_info = [
+            {"nameserver": "a.dns.jp",
+             "destination": [
+                 "203.119.1.1"],
+             "proto": "udp",
+             "query": {
+                 "qname": "jp",
+                 "rrtype": "SOA"
+             }
+            },
+            {"nameserver": "a.dns.jp",
+             "destination": [
+                 "203.119.1.1"
+             ],
+             "proto": "tcp",
+             "query": {
+                 "qname": "jp",
+                 "rrtype": "SOA"
+             }}]
+
+        self.measurer.measurement_info = namedtupled.map(raw_measurement_info)
+        self.measurer.cnfs = self.measurer.cnfs._replace(
+            measurement=self.measurer.cnfs.measurement._replace(
+                engine="asyncio"))
+        self.measurer.set_measurer_id()
+        self.measurer.set_server_boottime()
+        self.measurer.ipv4 = "10.0.2.15"  # rewrite addr depending on test environment
+        self.measurer.net_desc_v4 = ("", "")
+
+        result = self.measurer.measure_toplevel()
+        self.assertEqual(len(result), 2)
+
+    def test_12_get_number_of_processes(self):
+        self.measurer.cnfs = self.measurer.cnfs._replace(
+            measurement=self.measurer.cnfs.measurement._replace(
+                number_of_processes=4))
+        self.assertEqual(self.measurer.get_number_of_processes(), 4)
+
+        self.measurer.cnfs = self.measurer.cnfs._replace(
+            measurement=self.measurer.cnfs.measurement._replace(
+                number_of_processes=0))
+        self.assertGreaterEqual(self.measurer.get_number_of_processes(), 1)
+
+    def test_13_round_budgeting(self):
+        tasks = [measurer.MeasurementTask(
+            "a.dns.jp", "203.119.1.1", "10.0.2.15", 4, "", "",
+            proto, "jp", rrtype, None)
+            for proto in ("tcp", "udp")
+            for rrtype in ("DNSKEY", "NS", "SOA")]
+
+        ordered = sorted(tasks, key=self.measurer.get_task_priority())
+        self.assertEqual([(task.rrtype, task.proto) for task in ordered],
+                         [("SOA", "udp"), ("SOA", "tcp"),
+                          ("NS", "udp"), ("NS", "tcp"),
+                          ("DNSKEY", "udp"), ("DNSKEY", "tcp")])
+
+        scheduled = [(0, task) for task in ordered]
+        cost = self.measurer.estimate_round_cost(scheduled,
+                                                 dict(udp=2, tcp=6),
+                                                 2)
+        self.assertEqual(cost, 12)
+
+        self.assertTrue(self.measurer.exceeds_deadline(10, 5, 6))
+        self.assertFalse(self.measurer.exceeds_deadline(10, 5, 5))
+        self.assertFalse(self.measurer.exceeds_deadline(None, 5, 6))
+
+    def test_14_measure_sharded_rdata(self):
+        # lines written by the parent process
+        written = []
+
+        def measure_toplevel(measurer, sink=None, current_time=None):
+            # every shard finds the same rdata
+            measurer.rdata_dictionary.register("digest", "NS", b"rdata")
+            return []
+
+        def write_lines(dao_object, lines):
+            written.extend(lines)
+            return True
+
+        self.measurer.cnfs = self.measurer.cnfs._replace(
+            measurement=self.measurer.cnfs.measurement._replace(
+                streaming=False))
+        self.set_shard_context()
+        self.measurer.measurement_info = ["shard-0", "shard-1"]
+        self.measurer.rdata_dictionary = rdata.RdataDictionary()
+        self.measurer.data_store_available = True
+        self.measurer.dao_dnsprobe = dao.Mes_dnsprobe(self.measurer)
+        self.measurer.dao_dnsprobe_rdata = \
+            dao.Mes_dnsprobe_rdata(self.measurer)
+        current_time = self.measurer.make_current_time()
+
+        with unittest.mock.patch.object(measurer.Measurer,
+                                        "measure_toplevel",
+                                        measure_toplevel), \
+                unittest.mock.patch.object(dao.InfluxDBMeasurementBase,
+                                           "write_lines", write_lines):
+            self.assertTrue(self.measurer.measure_sharded(2, current_time))
+            self.assertEqual(len([line for line in written
+                                  if line.startswith("mes_dnsprobe_rdata")]),
+                             1)
+            self.assertIn("digest", self.measurer.rdata_dictionary.dump())
+
+            del written[:]
+            self.assertTrue(self.measurer.measure_sharded(2, current_time))
+            self.assertFalse([line for line in written
+                              if line.startswith("mes_dnsprobe_rdata")])
+
+    def test_15_measure_sharded(self):
+
+        def measure_and_write(measurer, current_time=None, as_shard=False):
+            # each shard reports the outcome given in its measurement info
+            measurer.measured_points = len(measurer.measurement_info)
+            if "spooled" in measurer.measurement_info:
+                measurer.data_store_available = False
+            return "failed" not in measurer.measurement_info
+
+        self.set_shard_context()
+        self.measurer.rdata_dictionary = None
+        self.measurer.dao_dnsprobe = dao.Mes_dnsprobe(self.measurer)
+        current_time = self.measurer.make_current_time()
+
+        with unittest.mock.patch.object(measurer.Measurer,
+                                        "measure_and_write",
+                                        measure_and_write):
+            for (measurement_info, expected, available) in (
+                    (["succeeded"] * 4, True, True),
+                    (["succeeded", "spooled"] * 2, True, False),
+                    (["succeeded", "failed"] * 2, False, False)):
+                self.measurer.measurement_info = measurement_info
+                self.measurer.data_store_available = True
+                self.assertEqual(
+                    self.measurer.measure_sharded(2, current_time), expected)
+                self.assertEqual(self.measurer.data_store_available,
+                                 available)
+                self.assertEqual(self.measurer.measured_points, 4)
+
+    def test_16_daemon_round_boundary(self):
+        self.assertEqual(self.measurer.get_first_round(120.0, 60), 180)
+        self.assertEqual(self.measurer.get_first_round(121.5, 60), 180)
+        self.assertEqual(self.measurer.get_first_round(179.9, 60), 180)
+
+        # the round finished in time
+        self.assertEqual(self.measurer.get_next_round(180, 200.0, 60),
+                         (240, 0))
+        # the round overran the following two boundaries
+        self.assertEqual(self.measurer.get_next_round(180, 300.0, 60),
+                         (360, 2))
+        self.assertEqual(self.measurer.get_next_round(180, 359.9, 60),
+                         (360, 2))
+
+    def test_17_daemon_stop(self):
+        started_at = []
+
+        def run_measurement_round(measurer):
+            started_at.append(time.time())
+            # stopped while the round is running
+            measurer.handle_stop_signal(signal.SIGTERM, None)
+            return True
+
+        self.measurer.cnfs = self.measurer.cnfs._replace(
+            daemon=self.measurer.cnfs.daemon._replace(round_interval=1),
+            measurement=self.measurer.cnfs.measurement._replace(
+                udp_multiplexing=False))
+
+        try:
+            with unittest.mock.patch.object(measurer.Measurer,
+                                            "run_measurement_round",
+                                            run_measurement_round):
+                self.assertEqual(self.measurer.run_daemon(), 0)
+        finally:
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            self.measurer.event_loop.close()
+
+        # only one round started on the boundary of the wall clock
+        self.assertEqual(len(started_at), 1)
+        self.assertLess(started_at[0] % 1, 0.5)
+        self.assertNotIn("refresher", [thread.name for thread
+                                       in threading.enumerate()])
+
+    def test_18_shard_state(self):
+        self.set_shard_context()
+        self.measurer.rdata_dictionary = rdata.RdataDictionary()
+        self.measurer.rdata_dictionary.mark_written(["digest"])
+        shard = util.recursive_namedtuple(
+            [{"nameserver": "a.dns.jp",
+              "destination": ["203.119.1.1"],
+              "proto": "udp",
+              "query": {"qname": "jp", "rrtype": "SOA"}}])
+
+        # the state is sent to the shard started by forkserver
+        state = pickle.loads(pickle.dumps(
+            self.measurer.get_shard_state(shard, "2020-01-01T00:00:00Z")))
+
+        shard_measurer = measurer.Measurer()
+        shard_measurer.set_shard_state(state)
+        self.assertEqual(shard_measurer.measurement_info, shard)
+        self.assertEqual(shard_measurer.measurer_id,
+                         self.measurer.measurer_id)
+        self.assertEqual(shard_measurer.net_desc_v6,
+                         self.measurer.net_desc_v6)
+        self.assertIn("digest", shard_measurer.rdata_dictionary.dump())
+
+        # forkserver is used once the daemon has started the refresher
+        self.assertEqual(
+            self.measurer.get_shard_context().get_start_method(), "fork")
+        stop_event = threading.Event()
+        thread = threading.Thread(target=stop_event.wait)
+        thread.start()
+        try:
+            self.assertEqual(
+                self.measurer.get_shard_context().get_start_method(),
+                "forkserver")
+        finally:
+            stop_event.set()
+            thread.join()
+
+    def test_19_probe_location(self):
+        written = []
+
+        def write_lines(dao_object, lines):
+            written.extend(lines)
+            return True
+
+        self.measurer.cnfg = self.measurer.cnfg._replace(
+            data_store=self.measurer.cnfg.data_store._replace(
+                schema_version=2))
+        self.set_shard_context()
+        self.measurer.measurement_info = ["shard-0", "shard-1"]
+        self.measurer.rdata_dictionary = None
+        self.measurer.data_store_available = True
+        self.measurer.dao_dnsprobe = dao.Mes_dnsprobe(self.measurer)
+        current_time = self.measurer.make_current_time()
+
+        with unittest.mock.patch.object(measurer.Measurer,
+                                        "measure_toplevel",
+                                        lambda *positional, **kw: []), \
+                unittest.mock.patch.object(dao.InfluxDBMeasurementBase,
+                                           "write_lines", write_lines):
+            # written once per round whether streaming or not
+            for streaming in (True, False):
+                self.measurer.cnfs = self.measurer.cnfs._replace(
+                    measurement=self.measurer.cnfs.measurement._replace(
+                        streaming=streaming))
+                del written[:]
+                self.assertTrue(self.measurer.measure_and_write(current_time))
+                self.assertEqual(len(written), 1)
+                self.assertTrue(written[0].startswith(
+                    "mes_dnsprobe_probe,prb_id=%s prb_lat=" %
+                    (self.measurer.measurer_id)))
+
+                # the shards leave it to the parent process
+                del written[:]
+                self.assertTrue(self.measurer.measure_and_write(
+                    current_time, as_shard=True))
+                self.assertEqual(written, [])
+
+            del written[:]
+            self.assertTrue(self.measurer.measure_sharded(2, current_time))
+            self.assertEqual(len([line for line in written
+                                  if line.startswith("mes_dnsprobe_probe")]),
+                             1)
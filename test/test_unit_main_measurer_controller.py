@@ -34,3 +34,13 @@ class TestMainMeasurerController(unittest.TestCase):
         ret = self.client.get("/static/data/measurement_info.json")
         self.assertTrue(ret)
 
+    def test_3_static_data_measurement_info_gzip(self):
+        ret = self.client.get("/static/data/measurement_info.json",
+                              headers={"Accept-Encoding": "gzip"})
+        self.assertTrue(ret.headers.get("ETag"))
+        self.assertTrue(ret.headers.get("Last-Modified"))
+
+        ret = self.client.get("/static/data/measurement_info.json",
+                              headers={"Accept-Encoding": "gzip",
+                                       "If-None-Match": ret.headers["ETag"]})
+        self.assertEqual(ret.status_code, 304)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import sys
+import os
+from influxdb.resultset import ResultSet
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import main_migrate_schema as migrate_schema
+import common.common.framework as framework
+import common.data.dao as dao
+import common.data.types as types
+
+
+BASE_TIME = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def to_ns(dt):
+    return int(dt.timestamp()) * 10**9
+
+
+def from_ns(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp // 10**9,
+                                           datetime.timezone.utc)
+
+
+class FakeMes_dnsprobe:
+
+    """
+    v1とv2の点の時刻だけを保持する Mes_dnsprobe の代わり
+    """
+
+    def __init__(self, v1_minutes, v2_minutes, fail_at=None):
+        self.schema_version = 2
+        self.measurements = dao.Mes_dnsprobe.SCHEMA_MEASUREMENT_NAMES
+        self.v1 = [to_ns(BASE_TIME + datetime.timedelta(minutes=minute))
+                   for minute in v1_minutes]
+        self.v2 = set(to_ns(BASE_TIME + datetime.timedelta(minutes=minute))
+                      for minute in v2_minutes)
+        self.windows = []
+        self.writes = 0
+        self.fail_at = fail_at
+
+    def get_schema_boundary(self):
+        if not self.v2:
+            return None
+        return migrate_schema.format_time(from_ns(min(self.v2)))
+
+    def get_first_time(self, measurement):
+        return migrate_schema.format_time(from_ns(min(self.v1)))
+
+    def read_schema_v1_points(self, start_time, end_time):
+        start = to_ns(dao.parse_time(start_time))
+        end = to_ns(dao.parse_time(end_time))
+        self.windows.append((start_time, end_time))
+        points = [types.MigratedDNSMeasurementData(timestamp, {}, {})
+                  for timestamp in sorted(self.v1, reverse=True)
+                  if start <= timestamp < end]
+        return (points, [])
+
+    def write_schema_v2_points(self, points, probes=()):
+        if self.writes == self.fail_at:
+            self.fail_at = None
+            return False
+        self.writes += 1
+        self.v2.update(point.timestamp for point in points)
+        return True
+
+
+class FakeSession:
+
+    def __init__(self, result):
+        self.result = result
+        self.lines = []
+
+    def query(self, *positional, **kw):
+        return self.result
+
+    def write_points(self, lines, **kw):
+        self.lines.extend(lines)
+        return True
+
+
+class TestMainMigrateSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.migrator = migrate_schema.SchemaMigrator()
+        self.migrator.cnfs = self.migrator.cnfs._replace(
+            migration=self.migrator.cnfs.migration._replace(
+                chunk_minutes=60,
+                batch_size=2,
+                interval_seconds=0))
+
+    def window(self, start_minute, end_minute):
+        return tuple(migrate_schema.format_time(
+            BASE_TIME + datetime.timedelta(minutes=minute))
+            for minute in (start_minute, end_minute))
+
+    def test_0_make_batches(self):
+        points = [types.MigratedDNSMeasurementData(timestamp, {}, {})
+                  for timestamp in (5, 5, 5, 4, 3, 3, 2)]
+
+        batches = [[point.timestamp for point in batch]
+                   for batch in self.migrator.make_batches(points)]
+
+        self.assertEqual(batches, [[5, 5, 5], [4, 3, 3], [2]])
+
+    def test_1_windows(self):
+        self.migrator.dao_dnsprobe = FakeMes_dnsprobe(range(0, 180, 10),
+                                                      [180])
+
+        self.assertEqual(self.migrator.run_application(),
+                         framework.BaseSetup.RET_NORMAL_END)
+        # newest first, contiguous and not before the oldest point
+        self.assertEqual(self.migrator.dao_dnsprobe.windows,
+                         [self.window(120, 180),
+                          self.window(60, 120),
+                          self.window(0, 60)])
+        self.assertEqual(self.migrator.dao_dnsprobe.v2,
+                         set(self.migrator.dao_dnsprobe.v1) |
+                         set([to_ns(BASE_TIME +
+                                    datetime.timedelta(minutes=180))]))
+
+    def test_2_resume(self):
+        # the second batch of the second window fails
+        self.migrator.dao_dnsprobe = FakeMes_dnsprobe(range(0, 180, 10),
+                                                      [180],
+                                                      fail_at=4)
+
+        self.assertEqual(self.migrator.run_application(),
+                         framework.BaseSetup.RET_ABNORMAL_END)
+        self.assertEqual(self.migrator.dao_dnsprobe.get_schema_boundary(),
+                         self.window(100, 100)[0])
+
+        self.migrator.dao_dnsprobe.windows = []
+        self.assertEqual(self.migrator.run_application(),
+                         framework.BaseSetup.RET_NORMAL_END)
+        # resumed from the oldest point written in schema v2
+        self.assertEqual(self.migrator.dao_dnsprobe.windows,
+                         [self.window(40, 100),
+                          self.window(0, 40)])
+        self.assertTrue(set(self.migrator.dao_dnsprobe.v1) <=
+                        self.migrator.dao_dnsprobe.v2)
+
+    def test_3_nothing_to_migrate(self):
+        self.migrator.dao_dnsprobe = FakeMes_dnsprobe([10, 20], [0])
+        self.assertEqual(self.migrator.run_application(),
+                         framework.BaseSetup.RET_NORMAL_END)
+        self.assertEqual(self.migrator.dao_dnsprobe.windows, [])
+
+        self.migrator.dao_dnsprobe = FakeMes_dnsprobe([10, 20], [])
+        self.assertEqual(self.migrator.run_application(),
+                         framework.BaseSetup.RET_ABNORMAL_END)
+        self.assertEqual(self.migrator.dao_dnsprobe.windows, [])
+
+    def test_4_convert_points(self):
+        tags = dict(af="4", dst_addr="192.0.2.1", dst_name="a.example",
+                    got_response="True", prb_id="probe1", proto="udp",
+                    qname="example", rrtype="SOA", slr_exceeded="False",
+                    error_class_name="", nsid="ns1", src_addr="192.0.2.2",
+                    prb_lat="35.0", prb_lon="139.0")
+        columns = ["time", "time_took", "got_response_field", "ttl",
+                   "serial", "name"]
+        timestamps = [to_ns(BASE_TIME), to_ns(BASE_TIME) + 10**9]
+        result = ResultSet(dict(series=[dict(
+            name="mes_dnsprobe",
+            tags=tags,
+            columns=columns,
+            values=[[timestamp, 12, 1, 3600, 1, None]
+                    for timestamp in timestamps])]))
+
+        self.migrator.session = FakeSession(result)
+        self.migrator.dao_dnsprobe = dao.Mes_dnsprobe(self.migrator)
+
+        self.assertTrue(self.migrator.migrate(
+            migrate_schema.format_time(BASE_TIME),
+            migrate_schema.format_time(
+                BASE_TIME + datetime.timedelta(minutes=60))))
+
+        (probe, *points) = self.migrator.session.lines
+
+        # the latest location of the probe in the period
+        self.assertEqual(
+            probe,
+            "mes_dnsprobe_probe,prb_id=probe1 "
+            "prb_lat=\"35.0\",prb_lon=\"139.0\" %d" % (timestamps[1]))
+        # the newest first. the fields only in schema v1 tags are moved and
+        # the types lost in JSON are restored
+        self.assertEqual(
+            points,
+            ["mes_dnsprobe_v2,af=4,dst_addr=192.0.2.1,dst_name=a.example,"
+             "got_response=True,prb_id=probe1,proto=udp,qname=example,"
+             "rrtype=SOA,slr_exceeded=False "
+             "got_response_field=1i,nsid=\"ns1\",serial=1i,"
+             "src_addr=\"192.0.2.2\",time_took=12.0,ttl=3600i %d" % (
+                 timestamp)
+             for timestamp in reversed(timestamps)])
+
+
+if __name__ == "__main__":
+    unittest.main()